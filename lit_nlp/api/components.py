@@ -48,6 +48,23 @@ class Interpreter(metaclass=abc.ABCMeta):
     inputs = [ex['data'] for ex in indexed_inputs]
     return self.run(inputs, model, dataset, model_outputs, config)
 
+  def is_cacheable(self) -> bool:
+    """Whether outputs can be cached and re-used for the same request.
+
+    This should be true if the output depends only on the model, dataset,
+    config, and inputs (including their ids). Stateful components, or ones
+    which cache their own results, should return False.
+    """
+    return True
+
+  def is_per_example(self) -> bool:
+    """Whether the output is a list of results, computed for each input alone.
+
+    If true, results can be cached per example, and only the uncached inputs
+    of a request are passed to run_with_metadata().
+    """
+    return False
+
 
 class ComponentGroup(Interpreter):
   """Convenience class to package a group of components together."""
@@ -71,6 +88,9 @@ class ComponentGroup(Interpreter):
                                               model_outputs, config)
     return ret
 
+  def is_cacheable(self) -> bool:
+    return all(c.is_cacheable() for c in self._subcomponents.values())
+
 
 class Generator(metaclass=abc.ABCMeta):
   """Base class for LIT generators."""
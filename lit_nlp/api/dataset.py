@@ -15,7 +15,8 @@
 # Lint as: python3
 """Base classes for LIT models."""
 import random
-from typing import List, Dict
+import threading
+from typing import Callable, List, Dict, Optional
 
 from absl import logging
 
@@ -23,8 +24,12 @@ from lit_nlp.api import types
 from lit_nlp.lib import utils
 
 JsonDict = types.JsonDict
+ExampleId = types.ExampleId
 Spec = types.Spec
 
+# IndexedInput is a dict of {'id': ExampleId, 'data': JsonDict}
+IdFnType = Callable[[JsonDict], ExampleId]
+
 
 class SliceWrapper(object):
   """Shim object to implement custom slicing via foo[a:b:c] rather than constructing a slice object explicitly."""
@@ -87,3 +92,69 @@ class Dataset(object):
     new_spec = utils.remap_dict(self.spec(), field_map)
     new_examples = [utils.remap_dict(ex, field_map) for ex in self.examples]
     return Dataset(new_spec, new_examples)
+
+
+class IndexedDataset(Dataset):
+  """Dataset with stable example ids, computed once and shared.
+
+  Wraps another Dataset, and lazily builds the list of IndexedInputs (dicts of
+  {'id': ..., 'data': ...}) and an id -> position index the first time they are
+  needed. The LIT server wraps each dataset in this class and passes it to
+  interpreters and generators, so that components don't need to re-hash the
+  whole dataset on each request.
+  """
+
+  def __init__(self, base: Dataset, id_fn: IdFnType):
+    """Wrap a dataset.
+
+    Args:
+      base: dataset to wrap
+      id_fn: function to compute a stable id from an example
+    """
+    self._base = base
+    self._id_fn = id_fn
+    self._lock = threading.Lock()
+    self._indexed_examples = None
+    self._index = None
+
+  def spec(self) -> Spec:
+    return self._base.spec()
+
+  @property
+  def examples(self) -> List[JsonDict]:
+    return self._base.examples
+
+  def _maybe_build_index(self):
+    with self._lock:
+      if self._indexed_examples is None:
+        logging.info('Computing ids for %d examples.', len(self.examples))
+        indexed_examples = self.index_inputs(self.examples)
+        self._index = {ex['id']: i for i, ex in enumerate(indexed_examples)}
+        self._indexed_examples = indexed_examples
+
+  @property
+  def indexed_examples(self) -> List[JsonDict]:
+    """Return examples as IndexedInputs, in the same order as examples."""
+    self._maybe_build_index()
+    return self._indexed_examples
+
+  @property
+  def ids(self) -> List[ExampleId]:
+    return [ex['id'] for ex in self.indexed_examples]
+
+  @property
+  def index(self) -> Dict[ExampleId, int]:
+    """Return a map of example id -> position in examples."""
+    self._maybe_build_index()
+    return self._index
+
+  def get(self, example_id: ExampleId) -> Optional[JsonDict]:
+    """Return the IndexedInput with the given id, or None if not found."""
+    position = self.index.get(example_id)
+    if position is None:
+      return None
+    return self._indexed_examples[position]
+
+  def index_inputs(self, examples: List[JsonDict]) -> List[JsonDict]:
+    """Compute IndexedInputs for examples, which need not be in the dataset."""
+    return [{'data': ex, 'id': self._id_fn(ex)} for ex in examples]
@@ -46,6 +46,38 @@ class DatasetTest(absltest.TestCase):
     self.assertNotIn("score", remapped_dset.spec())
     self.assertEqual({"val": 0, "text": "a"}, remapped_dset.examples[0])
 
+  def test_indexed_dataset(self):
+    """Test that ids are computed once and shared."""
+    spec = {"text": types.TextSegment()}
+    datapoints = [{"text": "a"}, {"text": "b"}]
+    num_calls = []
+
+    def id_fn(example):
+      num_calls.append(1)
+      return "id_" + example["text"]
+
+    dset = lit_dataset.IndexedDataset(
+        lit_dataset.Dataset(spec, datapoints), id_fn=id_fn)
+    self.assertEqual(spec, dset.spec())
+    self.assertLen(dset, 2)
+    self.assertEqual([{
+        "data": {"text": "a"},
+        "id": "id_a"
+    }, {
+        "data": {"text": "b"},
+        "id": "id_b"
+    }], dset.indexed_examples)
+    self.assertEqual(["id_a", "id_b"], dset.ids)
+    self.assertEqual({"id_a": 0, "id_b": 1}, dset.index)
+    self.assertEqual({"data": {"text": "b"}, "id": "id_b"}, dset.get("id_b"))
+    self.assertIsNone(dset.get("id_c"))
+    self.assertLen(num_calls, 2)
+    # New examples are hashed with the same function.
+    self.assertEqual([{
+        "data": {"text": "c"},
+        "id": "id_c"
+    }], dset.index_inputs([{"text": "c"}]))
+
 
 if __name__ == "__main__":
   absltest.main()
@@ -15,8 +15,14 @@
 # Lint as: python3
 """Base classes for LIT models."""
 import abc
-from typing import List, Tuple, Iterable, Iterator, Text
-
+import collections
+import concurrent.futures
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Iterable, Iterator, Text
+
+from absl import logging
 import attr
 from lit_nlp.api import types
 import numpy as np
@@ -24,6 +30,83 @@ import numpy as np
 JsonDict = types.JsonDict
 Spec = types.Spec
 
+# With length bucketing (see Model.input_length()), inputs are sorted in windows
+# of this many minibatches, so that predict() still streams long input lists.
+LENGTH_BUCKET_WINDOW = 32
+
+
+def is_out_of_memory_error(e: Exception) -> bool:
+  """Whether an exception (from any framework) means we ran out of memory."""
+  if isinstance(e, MemoryError):
+    return True
+  # TensorFlow's ResourceExhaustedError, or PyTorch's OutOfMemoryError and
+  # 'CUDA out of memory' RuntimeErrors.
+  if type(e).__name__ in ('ResourceExhaustedError', 'OutOfMemoryError'):
+    return True
+  return 'out of memory' in str(e).lower()
+
+
+class AdaptiveBatchSize(object):
+  """Minibatch size which adapts to throughput and available memory.
+
+  The size starts at initial_size. Once num_samples full minibatches have run
+  at the current size, it is doubled (up to max_size) if throughput improved
+  on the previous size, and otherwise set back to the previous size and fixed
+  there. On an out-of-memory error, the size is halved, and max_size is
+  lowered so that it won't grow back.
+
+  This is shared by concurrent calls to predict(), so is locked.
+  """
+
+  def __init__(self, initial_size: int, max_size: int, num_samples: int = 3):
+    self._lock = threading.Lock()
+    self._size = max(1, min(initial_size, max_size))
+    self._max_size = max_size
+    self._num_samples = num_samples
+    self._samples = []  # seconds per minibatch, at the current size
+    self._rates = {}  # batch size -> best examples per second
+    self._settled = False  # whether the size has stopped growing
+    self._previous_size = None  # size before the last increase
+
+  @property
+  def size(self) -> int:
+    return self._size
+
+  def record(self, batch_size: int, seconds: float):
+    """Record the time taken to run a minibatch."""
+    with self._lock:
+      if self._settled or batch_size != self._size:
+        return  # Only compare full minibatches.
+      self._samples.append(seconds)
+      if len(self._samples) < self._num_samples:
+        return
+      # Use the fastest, so that one-time costs such as tracing don't count.
+      rate = self._size / max(min(self._samples), 1e-9)
+      self._samples = []
+      self._rates[self._size] = rate
+      previous = self._rates.get(self._previous_size)
+      if previous is not None and rate <= previous:
+        self._size = self._max_size = self._previous_size
+        self._settled = True
+        logging.info('Minibatch size fixed at %d (%.1f examples/s)',
+                     self._size, previous)
+      elif self._size < self._max_size:
+        self._previous_size = self._size
+        self._size = min(self._size * 2, self._max_size)
+        logging.info('Minibatch size increased to %d (%.1f examples/s)',
+                     self._size, rate)
+      else:
+        self._settled = True
+
+  def out_of_memory(self, batch_size: int):
+    """Reduce the size after running out of memory on a minibatch."""
+    with self._lock:
+      self._max_size = max(1, min(self._max_size, batch_size // 2))
+      self._size = min(self._size, self._max_size)
+      self._samples = []
+      logging.warning('Out of memory on minibatch of %d; using at most %d.',
+                      batch_size, self._max_size)
+
 
 def maybe_copy(arr):
   """Decide if we should make a copy of an array in order to release memory.
@@ -92,6 +175,59 @@ class Model(metaclass=abc.ABCMeta):
     """Maximum minibatch size for this model."""
     return 1
 
+  def pipeline_depth(self, config=None) -> int:
+    """Number of minibatches to run ahead of the consumer, in predict().
+
+    If > 0, predict() runs preprocess_minibatch(), predict_preprocessed(), and
+    postprocess_minibatch() on separate threads, so that preprocessing of the
+    next minibatch and postprocessing of the previous one overlap with
+    inference on the current one. Up to this many minibatches may be computed
+    before their outputs are consumed, so use at least 2 to overlap all three
+    stages. Outputs are returned in order.
+
+    This is most useful for models which release the GIL during inference, as
+    TensorFlow and PyTorch do, and which implement the three stages above.
+    """
+    return 0
+
+  def max_adaptive_minibatch_size(self, config=None) -> int:
+    """If > 0, let predict() choose the minibatch size, up to this size.
+
+    The size starts at max_minibatch_size(), and grows while larger minibatches
+    give higher throughput. If a minibatch runs out of memory, it is retried in
+    halves, and later minibatches are kept smaller; see AdaptiveBatchSize. The
+    size is adapted for the lifetime of the model, across calls to predict().
+
+    This applies to predict_minibatch(), so it is not used with pipelining
+    (see pipeline_depth()).
+    """
+    return 0
+
+  def input_length(self, example: JsonDict) -> Optional[int]:
+    """Cheap estimate of the length of an input, such as its number of words.
+
+    If this returns a number, predict() sorts inputs by length before making
+    minibatches, so that each minibatch needs less padding, and returns the
+    outputs in the original order. This should be much faster to compute than
+    the model itself, e.g. not involve running a tokenizer.
+
+    Args:
+      example: an input, following input_spec()
+
+    Returns:
+      estimated length, or None to batch inputs in their original order.
+    """
+    return None
+
+  def supports_output_keys(self) -> bool:
+    """Whether predict_minibatch() takes an 'output_keys' argument.
+
+    If true, callers which only need some of the output fields, such as
+    CachingModelWrapper, pass output_keys=<set of field names> to predict(),
+    and the model may skip computing the others. See predict_minibatch().
+    """
+    return False
+
   # pylint: enable=unused-argument
 
   @abc.abstractmethod
@@ -100,10 +236,12 @@ class Model(metaclass=abc.ABCMeta):
                         config=None) -> List[JsonDict]:
     """Run prediction on a batch of inputs.
 
-    TODO(lit-team): add a 'level' argument (enumerate preprocessing, forward,
-    backward) to save on expensive operations when not needed. For example,
+    Models which return true from supports_output_keys() also receive an
+    'output_keys' argument: the set of output fields which the caller needs.
+    They can use this to skip expensive work when it isn't needed; for example,
     computing gradients invokes a backward pass, which costs ~2x the memory and
-    ~2x the compute of just running a forward prediction.
+    ~2x the compute of just running a forward prediction. Fields which aren't
+    requested may be omitted from the outputs.
 
     Args:
       inputs: sequence of inputs, following model.input_spec()
@@ -115,6 +253,27 @@ class Model(metaclass=abc.ABCMeta):
     """
     return
 
+  ##
+  # Optional: predict_minibatch() in stages, for pipelined inference. These
+  # are only used if pipeline_depth() > 0, and by default run all of
+  # predict_minibatch() as the inference stage.
+  # pylint: disable=unused-argument
+  def preprocess_minibatch(self, inputs: List[JsonDict], config=None) -> Any:
+    """Prepare a minibatch for predict_preprocessed(), e.g. by tokenizing."""
+    return inputs
+
+  def predict_preprocessed(self, batch: Any, config=None, **kw) -> Any:
+    """Run inference on the output of preprocess_minibatch()."""
+    if config is not None:
+      kw["config"] = config
+    return list(self.predict_minibatch(batch, **kw))
+
+  def postprocess_minibatch(self, outputs: Any, config=None) -> List[JsonDict]:
+    """Convert the output of predict_preprocessed() to a list of outputs."""
+    return outputs
+
+  # pylint: enable=unused-argument
+
   @abc.abstractmethod
   def input_spec(self) -> types.Spec:
     """Return a spec describing model inputs."""
@@ -167,7 +326,9 @@ class Model(metaclass=abc.ABCMeta):
         results will not be immediately consumed and discarded, as otherwise the
         common practice of slicing arrays returned by e.g. TensorFlow can result
         in large memory leaks.
-      **kw: additional kwargs passed to predict_minibatch()
+      **kw: additional kwargs passed to predict_minibatch(). This may include
+        output_keys, the output fields needed by the caller; it is dropped if
+        the model doesn't support it (see supports_output_keys()).
 
     Returns:
       model outputs, for each input
@@ -177,19 +338,162 @@ class Model(metaclass=abc.ABCMeta):
       results = (scrub_numpy_refs(res) for res in results)
     return results
 
-  def _batched_predict(self, inputs: Iterable[JsonDict],
-                       **kw) -> Iterator[JsonDict]:
-    """Internal helper to predict using minibatches."""
+  def _adaptive_batch_size(self, **kw) -> Optional[AdaptiveBatchSize]:
+    """Get the AdaptiveBatchSize for this model, if enabled."""
+    max_size = self.max_adaptive_minibatch_size(**kw)
+    if max_size <= 0 or self.pipeline_depth(**kw) > 0:
+      return None
+    # Created on first use, since subclasses don't call Model.__init__.
+    # dict.setdefault is atomic, so concurrent calls share one instance.
+    if '_adaptive_batch_size_state' not in self.__dict__:
+      self.__dict__.setdefault(
+          '_adaptive_batch_size_state',
+          AdaptiveBatchSize(self.max_minibatch_size(**kw), max_size))
+    return self.__dict__['_adaptive_batch_size_state']
+
+  def _minibatches(self, inputs: Iterable[JsonDict],
+                   **kw) -> Iterator[List[JsonDict]]:
+    """Split inputs into minibatches of at most max_minibatch_size()."""
+    adaptive = self._adaptive_batch_size(**kw)
     minibatch_size = self.max_minibatch_size(**kw)
     minibatch = []
     for ex in inputs:
+      if adaptive is not None and not minibatch:
+        minibatch_size = adaptive.size
       if len(minibatch) < minibatch_size:
         minibatch.append(ex)
       if len(minibatch) >= minibatch_size:
-        yield from self.predict_minibatch(minibatch, **kw)
+        yield minibatch
         minibatch = []
     if len(minibatch) > 0:  # pylint: disable=g-explicit-length-test
-      yield from self.predict_minibatch(minibatch, **kw)
+      yield minibatch
+
+  def _predict_minibatch_adaptive(self, minibatch: List[JsonDict],
+                                  adaptive: AdaptiveBatchSize,
+                                  **kw) -> List[JsonDict]:
+    """Run predict_minibatch(), splitting the minibatch on out-of-memory."""
+    start = time.perf_counter()
+    try:
+      outputs = list(self.predict_minibatch(minibatch, **kw))
+    except Exception as e:  # pylint: disable=broad-except
+      if len(minibatch) <= 1 or not is_out_of_memory_error(e):
+        raise
+      adaptive.out_of_memory(len(minibatch))
+      half = len(minibatch) // 2
+      return (
+          self._predict_minibatch_adaptive(minibatch[:half], adaptive, **kw) +
+          self._predict_minibatch_adaptive(minibatch[half:], adaptive, **kw))
+    adaptive.record(len(minibatch), time.perf_counter() - start)
+    return outputs
+
+  def _batched_predict(self,
+                       inputs: Iterable[JsonDict],
+                       output_keys: Optional[Iterable[Text]] = None,
+                       **kw) -> Iterator[JsonDict]:
+    """Internal helper to predict using minibatches.
+
+    Args:
+      inputs: iterable of input dicts
+      output_keys: (optional) output fields needed by the caller. Only passed
+        to the model if supports_output_keys() is true.
+      **kw: passed to predict_minibatch() and the other model hooks
+
+    Yields:
+      model outputs, for each input
+    """
+    predict_kw = dict(kw)
+    if output_keys is not None and self.supports_output_keys():
+      predict_kw["output_keys"] = frozenset(output_keys)
+    inputs = iter(inputs)
+    first = next(inputs, None)
+    if first is None:
+      return
+    inputs = itertools.chain([first], inputs)
+    if self.input_length(first) is None:
+      yield from self._predict_in_order(inputs, predict_kw, **kw)
+      return
+
+    # Sort each window of inputs by length, and un-sort the outputs.
+    window_size = self.max_minibatch_size(**kw) * LENGTH_BUCKET_WINDOW
+    while True:
+      window = list(itertools.islice(inputs, window_size))
+      if not window:
+        return
+      lengths = [self.input_length(ex) for ex in window]
+      if any(length is None for length in lengths):
+        # Can't sort; batch this window in its original order.
+        yield from self._predict_in_order(window, predict_kw, **kw)
+        continue
+      order = sorted(range(len(window)), key=lengths.__getitem__)
+      outputs = [None] * len(window)
+      sorted_outputs = self._predict_in_order([window[i] for i in order],
+                                               predict_kw, **kw)
+      for i, output in zip(order, sorted_outputs):
+        outputs[i] = output
+      yield from outputs
+
+  def _predict_in_order(self, inputs: Iterable[JsonDict],
+                        predict_kw: Dict[Text, Any],
+                        **kw) -> Iterator[JsonDict]:
+    """Predict on minibatches of inputs, in the order given."""
+    if self.pipeline_depth(**kw) > 0:
+      yield from self._pipelined_predict(inputs, predict_kw, **kw)
+      return
+    adaptive = self._adaptive_batch_size(**kw)
+    for minibatch in self._minibatches(inputs, **kw):
+      if adaptive is not None:
+        yield from self._predict_minibatch_adaptive(minibatch, adaptive,
+                                                    **predict_kw)
+      else:
+        yield from self.predict_minibatch(minibatch, **predict_kw)
+
+  def _pipelined_predict(self, inputs: Iterable[JsonDict],
+                         predict_kw: Dict[Text, Any],
+                         **kw) -> Iterator[JsonDict]:
+    """As _batched_predict(), but with each stage on its own thread.
+
+    Each stage has a single worker, so stages run in order for successive
+    minibatches, and at most one inference call is active at a time.
+
+    Args:
+      inputs: iterable of input dicts
+      predict_kw: passed to predict_preprocessed()
+      **kw: passed to each stage
+
+    Yields:
+      model outputs, for each input
+    """
+    depth = self.pipeline_depth(**kw)
+    stages = [
+        concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        for _ in range(3)
+    ]
+    preprocess, predict, postprocess = stages
+
+    def _after(future, fn, **fn_kw):
+      return lambda: fn(future.result(), **fn_kw)
+
+    # Futures for each stage of each minibatch, in input order.
+    in_flight = collections.deque()
+    try:
+      for minibatch in self._minibatches(inputs, **kw):
+        batch = preprocess.submit(self.preprocess_minibatch, minibatch, **kw)
+        outputs = predict.submit(
+            _after(batch, self.predict_preprocessed, **predict_kw))
+        results = postprocess.submit(
+            _after(outputs, self.postprocess_minibatch, **kw))
+        in_flight.append((batch, outputs, results))
+        while len(in_flight) > depth:
+          yield from in_flight.popleft()[-1].result()
+      while in_flight:
+        yield from in_flight.popleft()[-1].result()
+    finally:
+      # On error, or if the consumer stops early, don't start any more work.
+      for futures in in_flight:
+        for future in futures:
+          future.cancel()
+      for stage in stages:
+        stage.shutdown(wait=False)
 
   def predict_with_metadata(self, indexed_inputs: Iterable[JsonDict],
                             **kw) -> Iterator[JsonDict]:
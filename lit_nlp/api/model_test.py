@@ -15,6 +15,8 @@
 # Lint as: python3
 """Tests for lit_nlp.lib.model."""
 
+from unittest import mock
+
 from absl.testing import absltest
 
 from lit_nlp.api import model
@@ -130,6 +132,142 @@ class ModelTest(absltest.TestCase):
                                         {"scores": 6}])
     self.assertEqual(test_model.count, 2)
 
+  def test_pipelined_predict(self):
+    """Tests that pipelined predict() gives the same outputs, in order."""
+    inputs = [{"value": i} for i in range(10)]
+    for depth in (0, 1, 2):
+      test_model = testing_utils.TestPipelinedModel(depth=depth)
+      result = list(test_model.predict(inputs))
+      self.assertListEqual(result, [{"scores": i} for i in range(10)])
+      self.assertEqual(test_model.count, 4)
+
+  def test_predict_output_keys(self):
+    """Tests that output_keys is passed only to models which support it."""
+    inputs = [{"val": i} for i in range(4)]
+    test_model = testing_utils.TestOutputKeysModel()
+    result = list(test_model.predict(inputs, output_keys=["score"]))
+    self.assertListEqual(result, [{"score": i} for i in range(4)])
+    self.assertEqual([frozenset(["score"])] * 2, test_model.requests)
+    result = list(test_model.predict(inputs))
+    self.assertEqual({"score": 1, "expensive": 2}, result[1])
+    self.assertIsNone(test_model.requests[-1])
+    # Models which don't support it never see the argument.
+    test_model = testing_utils.TestModelBatched()
+    with mock.patch.object(
+        test_model, "predict_minibatch",
+        wraps=test_model.predict_minibatch) as predict_minibatch:
+      list(test_model.predict([{"value": 1}], output_keys=["scores"]))
+    self.assertEqual({}, predict_minibatch.call_args[1])
+
+  def test_pipelined_predict_error(self):
+    """Tests that errors from a pipeline stage are raised to the caller."""
+
+    class FailingModel(testing_utils.TestPipelinedModel):
+
+      def predict_preprocessed(self, batch):
+        if 5 in batch:
+          raise ValueError("bad batch")
+        return super().predict_preprocessed(batch)
+
+    test_model = FailingModel(depth=2)
+    result = test_model.predict([{"value": i} for i in range(10)])
+    self.assertListEqual([next(result) for _ in range(3)],
+                         [{"scores": i} for i in range(3)])
+    with self.assertRaises(ValueError):
+      list(result)
+
+  def test_length_bucketed_predict(self):
+    """Tests that inputs are batched by length, and outputs re-ordered."""
+
+    class LengthModel(testing_utils.TestModelBatched):
+
+      def __init__(self):
+        super().__init__()
+        self.minibatches = []
+
+      def input_length(self, example):
+        if example["text"] is None:
+          return None
+        return len(example["text"])
+
+      def predict_minibatch(self, inputs, **kw):
+        self.minibatches.append([x["value"] for x in inputs])
+        return super().predict_minibatch(inputs, **kw)
+
+    test_model = LengthModel()
+    lengths = [5, 1, 4, 1, 5, 2, 3]
+    inputs = [{"text": "x" * n, "value": i} for i, n in enumerate(lengths)]
+    result = list(test_model.predict(inputs))
+    self.assertListEqual(result, [{"scores": i} for i in range(len(inputs))])
+    self.assertListEqual(test_model.minibatches, [[1, 3, 5], [6, 2, 0], [4]])
+
+    # If any length is unknown, inputs are batched in their original order.
+    test_model = LengthModel()
+    inputs.append({"text": None, "value": len(inputs)})
+    result = list(test_model.predict(inputs))
+    self.assertListEqual(result, [{"scores": i} for i in range(len(inputs))])
+    self.assertListEqual(test_model.minibatches,
+                         [[0, 1, 2], [3, 4, 5], [6, 7]])
+
+  def test_adaptive_minibatch_size(self):
+    """Tests that the minibatch size grows, and backs off on OOM errors."""
+
+    clock = [0.0]
+
+    class OOMModel(testing_utils.TestModelBatched):
+
+      def __init__(self):
+        super().__init__()
+        self.minibatch_sizes = []
+
+      def max_adaptive_minibatch_size(self):
+        return 64
+
+      def predict_minibatch(self, inputs, **kw):
+        if len(inputs) > 20:
+          raise RuntimeError("CUDA out of memory.")
+        self.minibatch_sizes.append(len(inputs))
+        clock[0] += 1.0  # Each minibatch takes 1s, regardless of size.
+        return [{"scores": x["value"]} for x in inputs]
+
+    test_model = OOMModel()
+    inputs = [{"value": i} for i in range(100)]
+    with mock.patch.object(model.time, "perf_counter", lambda: clock[0]):
+      result = list(test_model.predict(inputs))
+    self.assertListEqual(result, [{"scores": i} for i in range(100)])
+    # Starts at max_minibatch_size() = 3, and doubles after 3 minibatches, until
+    # 24 runs out of memory and is split in half. Later minibatches use 12.
+    self.assertListEqual(test_model.minibatch_sizes,
+                         [3, 3, 3, 6, 6, 6, 12, 12, 12, 12, 12, 12, 1])
+
+  def test_adaptive_minibatch_size_other_errors(self):
+    """Tests that errors other than OOM are raised as usual."""
+
+    class FailingModel(testing_utils.TestModelBatched):
+
+      def max_adaptive_minibatch_size(self):
+        return 64
+
+      def predict_minibatch(self, inputs, **kw):
+        raise ValueError("bad input")
+
+    with self.assertRaises(ValueError):
+      list(FailingModel().predict([{"value": 1}, {"value": 2}]))
+
+  def test_adaptive_batch_size_settles(self):
+    """Tests that the size stops growing when throughput doesn't improve."""
+    adaptive = model.AdaptiveBatchSize(4, max_size=64, num_samples=1)
+    adaptive.record(4, 1.0)  # 4/s
+    self.assertEqual(8, adaptive.size)
+    adaptive.record(8, 1.0)  # 8/s
+    self.assertEqual(16, adaptive.size)
+    adaptive.record(16, 4.0)  # 4/s, so go back to 8.
+    self.assertEqual(8, adaptive.size)
+    adaptive.record(8, 10.0)
+    self.assertEqual(8, adaptive.size)
+    adaptive.out_of_memory(8)
+    self.assertEqual(4, adaptive.size)
+
 
 if __name__ == "__main__":
   absltest.main()
@@ -18,11 +18,12 @@
 import collections
 import functools
 import glob
+import hashlib
 import os
 import pickle
 import random
 import time
-from typing import Optional, Text, List, Mapping
+from typing import Dict, Iterable, Optional, Text, List, Mapping, Union
 
 from absl import logging
 
@@ -40,6 +41,8 @@ from lit_nlp.components import scrambler
 from lit_nlp.components import umap
 from lit_nlp.components import word_replacer
 from lit_nlp.lib import caching
+from lit_nlp.lib import instrumentation
+from lit_nlp.lib import jobs
 from lit_nlp.lib import serialize
 from lit_nlp.lib import utils
 from lit_nlp.lib import wsgi_app
@@ -51,7 +54,12 @@ JsonDict = types.JsonDict
 PredsCache = caching.PredsCache
 
 
-def make_handler(fn):
+def make_handler(fn,
+                 streaming=False,
+                 memoize=False,
+                 etag_fn=None,
+                 precision_fn=None,
+                 metrics: Optional[instrumentation.RequestMetrics] = None):
   """Convenience wrapper to handle args and serialization.
 
   This is a thin shim between server (handler, request) and model logic
@@ -59,30 +67,148 @@ def make_handler(fn):
 
   Args:
     fn: function (JsonDict, **kw) -> JsonDict
+    streaming: if true, list outputs are serialized and sent incrementally, so
+      that large responses don't need to be held in memory as a single string.
+    memoize: if true, the serialized response is computed once for each set of
+      URL parameters and re-used, and sent with an ETag so that clients can
+      re-validate their copy without downloading it again. Only use this for
+      endpoints whose output depends only on the URL parameters and the
+      models and datasets of the app, such as /get_info.
+    etag_fn: optional function (**kw) -> str, which identifies the version of
+      the response from the URL parameters without computing it. The response
+      is sent with an ETag derived from this, so that clients can re-validate
+      it, but is not kept in memory. Use this instead of memoize for large
+      streamed responses, such as /get_dataset.
+    precision_fn: optional function (**kw) -> Dict[field name, int], which
+      gives the number of decimal places to round fields to in frontend
+      responses, based on the URL parameters.
+    metrics: optional RequestMetrics, to record the time spent in each phase of
+      handling requests, and the size of requests and responses.
 
   Returns:
     fn wrapped as a request handler
   """
 
+  memo = {}  # query string -> (response body, etag)
+  metrics = metrics or instrumentation.RequestMetrics()
+
+  def _respond(handler, request, timer, response_body, etag=None):
+    with timer.phase('respond'):
+      response = handler.respond(
+          request, response_body, 'application/json', 200, etag=etag)
+    timer.finish(
+        request_bytes=len(request.data), response_bytes=len(response_body))
+    return response
+
   @functools.wraps(fn)
   def _handler(handler, request):
     logging.info('Request received: %s', request.full_path)
-    kw = request.args.to_dict()
-    # The frontend needs "simple" data (e.g. NumPy arrays converted to lists),
-    # but for requests from Python we may want to use the invertible encoding
-    # so that datatypes from remote models are the same as local ones.
-    response_simple_json = utils.coerce_bool(
-        kw.pop('response_simple_json', True))
-    data = serialize.from_json(request.data) if len(request.data) else None
-    outputs = fn(data, **kw)
-    response_body = serialize.to_json(outputs, simple=response_simple_json)
-    return handler.respond(request, response_body, 'application/json', 200)
+    timer = metrics.start(request.path.rstrip('/'))
+    try:
+      if memoize and request.query_string in memo:
+        response_body, etag = memo[request.query_string]
+        return _respond(handler, request, timer, response_body, etag=etag)
+      with timer.phase('parse'):
+        kw = request.args.to_dict()
+        # The frontend needs "simple" data (e.g. NumPy arrays converted to
+        # lists), but for requests from Python we may want to use the
+        # invertible encoding so that datatypes from remote models are the
+        # same as local ones.
+        response_simple_json = utils.coerce_bool(
+            kw.pop('response_simple_json', True))
+        # Python clients can also ask for NumPy arrays as raw (base64)
+        # buffers, which are smaller and much faster to encode and decode.
+        response_binary_arrays = utils.coerce_bool(
+            kw.pop('response_binary_arrays', False))
+        # Floats in frontend responses can be rounded, to make them smaller.
+        # This doesn't affect the invertible encoding.
+        response_precision = kw.pop('response_precision', None)
+        response_precision = (
+            int(response_precision) if response_precision else None)
+        field_precision = precision_fn(**kw) if precision_fn else None
+        data = serialize.from_json(request.data) if len(request.data) else None
+        etag = None
+        if etag_fn is not None:
+          # The same version may be serialized differently, depending on the
+          # response_* parameters, so these are part of the tag.
+          etag = hashlib.blake2b(
+              request.query_string + etag_fn(**kw).encode('utf-8'),
+              digest_size=16).hexdigest()
+      with timer.phase('compute'):
+        outputs = fn(data, **kw)
+      serialize_kw = dict(
+          simple=response_simple_json,
+          binary_arrays=response_binary_arrays,
+          precision=response_precision,
+          field_precision=field_precision)
+      if streaming and not memoize:
+        # Serialization happens as the response is sent, so is timed (and
+        # the request finished) by the chunk iterator.
+        chunks = (c.encode('utf-8')
+                  for c in serialize.to_json_chunks(outputs, **serialize_kw))
+        response_body = timer.time_chunks(
+            'serialize', chunks, request_bytes=len(request.data))
+        with timer.phase('respond'):
+          response = handler.respond(
+              request, response_body, 'application/json', 200, etag=etag)
+        if response.status_code == 304:
+          # The body is never sent, so the chunk iterator won't finish this.
+          timer.finish(request_bytes=len(request.data), response_bytes=0)
+        return response
+      with timer.phase('serialize'):
+        response_body = serialize.to_json(outputs, **serialize_kw).encode(
+            'utf-8')
+      if memoize:
+        etag = hashlib.blake2b(response_body, digest_size=16).hexdigest()
+        memo[request.query_string] = (response_body, etag)
+      return _respond(handler, request, timer, response_body, etag=etag)
+    except Exception:
+      timer.finish(request_bytes=len(request.data), error=True)
+      raise
 
   return _handler
 
 
+def _parse_precision_by_type(
+    precision_by_type: Optional[Union[Mapping[Text, int], Iterable[Text]]]
+) -> Dict[Text, int]:
+  """Parse a dict of LitType name -> decimal places, or 'Name:places' list."""
+  if not precision_by_type:
+    return {}
+  if not isinstance(precision_by_type, Mapping):
+    precision_by_type = dict(
+        item.split(':', 1) for item in precision_by_type)
+  ret = {}
+  for t_name, places in precision_by_type.items():
+    t_class = getattr(types, t_name, None)
+    if not (isinstance(t_class, type) and issubclass(t_class, types.LitType)):
+      raise ValueError(f"Class '{t_name}' is not a valid LitType.")
+    ret[t_name] = int(places)
+  return ret
+
+
+def _make_indexed_dataset(
+    dataset: lit_dataset.Dataset) -> lit_dataset.IndexedDataset:
+  if isinstance(dataset, lit_dataset.IndexedDataset):
+    return dataset
+  return lit_dataset.IndexedDataset(dataset, id_fn=caching.input_hash)
+
+
 class LitApp(object):
-  """LIT WSGI application."""
+  """LIT WSGI application.
+
+  Thread-safety: a single LitApp can serve concurrent requests, as with
+  --server_type=threaded. Models, datasets, and metadata are read-only after
+  construction. The predictions cache in CachingModelWrapper is internally
+  locked, and concurrent requests for the same uncached examples are coalesced
+  so that the model only runs once. ProjectionManager serializes fitting of
+  new projections. Models and other components themselves may be called from
+  several threads at once, so they should not keep per-call state on self.
+
+  With --server_type=prefork, each worker process gets a copy of this object;
+  set data_dir so that the workers share cached predictions on disk. Background
+  jobs (/submit_job) are tracked per process, so aren't supported with prefork.
+  """
 
   def _build_metadata(self):
     """Build metadata from model and dataset specs."""
@@ -125,11 +251,14 @@ class LitApp(object):
     """Get model info and send to frontend."""
     return self._info
 
-  def _predict(self, inputs: List[JsonDict], model_name: Text,
-               dataset_name: Optional[Text]):
+  def _predict(self,
+               inputs: List[JsonDict],
+               model_name: Text,
+               dataset_name: Optional[Text],
+               output_keys: Optional[Iterable[Text]] = None):
     """Run model predictions."""
     return self._models[model_name].predict_with_metadata(
-        inputs, dataset_name=dataset_name)
+        inputs, dataset_name=dataset_name, output_keys=output_keys)
 
   def _save_datapoints(self, data, dataset_name: Text, path: Text, **unused_kw):
     """Save datapoints to disk."""
@@ -175,8 +304,6 @@ class LitApp(object):
     Returns:
       List[JsonDict] containing requested fields of model predictions
     """
-    preds = list(self._predict(data['inputs'], model, dataset_name))
-
     # Figure out what to return to the frontend.
     output_spec = self._get_spec(model)['output']
     requested_types = requested_types.split(',')
@@ -189,12 +316,28 @@ class LitApp(object):
       ret_keys.extend(utils.find_spec_keys(output_spec, t_class))
     ret_keys = set(ret_keys)  # de-dupe
 
+    # Only the selected keys need to be available from the cache.
+    preds = list(
+        self._predict(
+            data['inputs'], model, dataset_name, output_keys=ret_keys))
+
     # Return selected keys.
     logging.info('Will return keys: %s', str(ret_keys))
     # One record per input.
     ret = [utils.filter_by_keys(p, ret_keys.__contains__) for p in preds]
     return ret
 
+  def _field_precision(self, model: Optional[Text] = None, **unused_kw):
+    """Decimal places for each output field of a model, for rounding."""
+    if model is None or not self._precision_by_type:
+      return None
+    output_spec = self._get_spec(model)['output']
+    ret = {}
+    for t_name, places in self._precision_by_type.items():
+      for key in utils.find_spec_keys(output_spec, getattr(types, t_name)):
+        ret[key] = places
+    return ret
+
   def _get_datapoint_ids(self, data):
     """Fill in unique example hashes for the provided datapoints."""
     examples = []
@@ -210,15 +353,28 @@ class LitApp(object):
     # passed from the frontend?
     assert dataset_name is not None, 'No dataset specified.'
     # TODO(lit-team): possibly allow IDs from persisted dataset.
-    return caching.add_hashes_to_input(self._datasets[dataset_name].examples)
+    return self._datasets[dataset_name].indexed_examples
+
+  def _dataset_etag(self, dataset_name: Text = None, **unused_kw) -> Text:
+    """Version of a dataset for /get_dataset, from its name and example ids."""
+    if dataset_name not in self._datasets:
+      return ''  # _get_dataset() will raise an error.
+    if dataset_name not in self._dataset_etags:
+      ids = [ex['id'] for ex in self._datasets[dataset_name].indexed_examples]
+      self._dataset_etags[dataset_name] = hashlib.blake2b(
+          serialize.to_json([dataset_name, ids]).encode('utf-8'),
+          digest_size=16).hexdigest()
+    return self._dataset_etags[dataset_name]
 
   def _get_generated(self, data, model: Text, dataset_name: Text,
                      generator: Text, **unused_kw):
     """Generate new datapoints based on the request."""
-    generator = self._generators[generator]
+    generator_name, generator = generator, self._generators[generator]
     #  IndexedInput[] -> Input[]
     raw_inputs = [d['data'] for d in data['inputs']]
-    outs = generator.generate_all(
+    outs = self._run_component(
+        f'generator_{generator_name}',
+        generator.generate_all,
         raw_inputs,
         self._models[model],
         self._datasets[dataset_name],
@@ -228,17 +384,86 @@ class LitApp(object):
   def _get_interpretations(self, data, model: Text, dataset_name: Text,
                            interpreter: Text, **unused_kw):
     """Run an interpretation component."""
-    interpreter = self._interpreters[interpreter]
+    interpreter_name, interpreter = interpreter, self._interpreters[interpreter]
     # Pre-compute using self._predict, which looks for cached results.
     model_outputs = self._predict(data['inputs'], model, dataset_name)
 
-    return interpreter.run_with_metadata(
+    # Results are cached by interpreter, model, dataset, config, and ids.
+    return self._run_component(
+        f'interpreter_{interpreter_name}',
+        self._interpretation_cache.run_with_metadata,
+        interpreter,
+        interpreter_name,
+        model,
+        dataset_name,
         data['inputs'],
         self._models[model],
         self._datasets[dataset_name],
         model_outputs=model_outputs,
         config=data.get('config'))
 
+  def _run_component(self, name: Text, fn, *args, **kw):
+    """Call a generator or interpreter, with profiling if enabled."""
+    if self._profiler is None:
+      return fn(*args, **kw)
+    return self._profiler.run(name, fn, *args, **kw)
+
+  def _job_key(self, data, endpoint: Text, **kw):
+    """Key identifying the result of a request, to de-duplicate jobs."""
+    data = data or {}
+    input_ids = tuple(
+        d.get('id') or caching.input_hash(d['data'])
+        for d in data.get('inputs') or [])
+    config = serialize.to_json(data.get('config'), sort_keys=True)
+    return (endpoint, tuple(sorted(kw.items())), config, input_ids)
+
+  def _submit_job(self, data, endpoint: Text, **kw):
+    """Start running an endpoint in the background, and return its status.
+
+    Submitting the same request (endpoint, URL parameters, config, and input
+    ids) as a running or finished job returns that job instead of a new one.
+
+    Args:
+      data: data payload, as for the endpoint
+      endpoint: name of the endpoint to run, such as 'get_interpretations'
+      **kw: URL parameters for the endpoint
+
+    Returns:
+      job status, including the 'id' to poll with /get_job_status
+    """
+    endpoint = endpoint.strip('/')
+    if endpoint not in self._job_endpoints:
+      raise ValueError(f"Endpoint '{endpoint}' can't be run as a job.")
+    name = '/'.join([endpoint] + [
+        kw[k] for k in ('model', 'interpreter', 'generator') if k in kw])
+    job = self._jobs.submit(
+        self._job_key(data, endpoint, **kw), name,
+        self._job_endpoints[endpoint], data, **kw)
+    return job.info()
+
+  def _get_job(self, job_id: Text) -> jobs.Job:
+    try:
+      return self._jobs.get(job_id)
+    except KeyError:
+      raise ValueError(
+          f"Unknown job id '{job_id}'; it may have expired.") from None
+
+  def _get_job_status(self, unused_data, job_id: Text, **unused_kw):
+    """Get the status and progress of a job."""
+    return self._get_job(job_id).info()
+
+  def _get_job_result(self, unused_data, job_id: Text, **unused_kw):
+    """Get the result of a finished job, as returned by its endpoint."""
+    job = self._get_job(job_id)
+    if job.status != jobs.DONE:
+      raise ValueError(f"Job '{job_id}' has no result; status is "
+                       f"'{job.status}'. Error: {job.error}")
+    return job.result
+
+  def _cancel_job(self, unused_data, job_id: Text, **unused_kw):
+    """Cancel a job, and return its status."""
+    return self._jobs.cancel(self._get_job(job_id).id).info()
+
   def _warm_start(self, rate: float):
     """Warm-up the predictions cache by making some model calls."""
     assert rate >= 0 and rate <= 1
@@ -279,24 +504,58 @@ class LitApp(object):
       interpreters: Optional[Mapping[Text, lit_components.Interpreter]] = None,
       # General server config; see server_flags.py.
       data_dir: Optional[Text] = None,
+      cache_max_bytes: int = 0,
+      secondary_cache_max_bytes: int = 0,
       warm_start: float = 0.0,
       warm_projections: bool = False,
       client_root: Optional[Text] = None,
       demo_mode: bool = False,
       default_layout: str = None,
+      compression_min_bytes: int = 1024,
+      compression_level: int = 6,
+      precision_by_type: Optional[Union[Mapping[Text, int],
+                                        Iterable[Text]]] = None,
+      log_request_metrics: bool = False,
+      profile: bool = False,
+      num_job_workers: int = 2,
+      interpretation_cache_max_bytes: int = 0,
   ):
     if client_root is None:
       raise ValueError('client_root must be set on application')
 
     self._demo_mode = demo_mode
     self._default_layout = default_layout
+    # LitType name -> decimal places, for model outputs sent to the frontend.
+    self._precision_by_type = _parse_precision_by_type(precision_by_type)
+    # Timing and payload sizes for each endpoint, for /metrics.
+    self._metrics = instrumentation.RequestMetrics(
+        log_requests=log_request_metrics)
     if data_dir and not os.path.isdir(data_dir):
       os.mkdir(data_dir)
+    # Optionally profile generators and interpreters, saving to data_dir.
+    self._profiler = None
+    if profile:
+      self._profiler = instrumentation.Profiler(
+          os.path.join(data_dir, 'profiles') if data_dir else None)
+    # Unwrapped models, which may hold resources to release in close().
+    self._base_models = dict(models)
     self._models = {
-        name: caching.CachingModelWrapper(model, name, cache_dir=data_dir)
+        name: caching.CachingModelWrapper(
+            model,
+            name,
+            cache_dir=data_dir,
+            cache_max_bytes=cache_max_bytes or None,
+            secondary_cache_max_bytes=secondary_cache_max_bytes or None)
         for name, model in models.items()
     }
-    self._datasets = datasets
+    self._interpretation_cache = caching.InterpretationCache(
+        cache_dir=data_dir, max_bytes=interpretation_cache_max_bytes or None)
+    # Wrap datasets so that example ids are computed once, and shared with
+    # components.
+    self._datasets = {
+        name: _make_indexed_dataset(ds) for name, ds in datasets.items()
+    }
+    self._dataset_etags = {}  # dataset name -> version, for /get_dataset
     if generators is not None:
       self._generators = generators
     else:
@@ -347,6 +606,13 @@ class LitApp(object):
     if warm_projections:
       self._warm_projections(['pca', 'umap'])
 
+    # Background jobs, for slow requests that would otherwise time out.
+    self._jobs = jobs.JobManager(num_workers=num_job_workers)
+    self._job_endpoints = {
+        'get_generated': self._get_generated,
+        'get_interpretations': self._get_interpretations,
+    }
+
     handlers = {
         # Metadata endpoints.
         '/get_info': self._get_info,
@@ -359,20 +625,84 @@ class LitApp(object):
         # Model prediction endpoints.
         '/get_preds': self._get_preds,
         '/get_interpretations': self._get_interpretations,
+        # Background job endpoints, to run the above asynchronously.
+        '/submit_job': self._submit_job,
+        '/get_job_status': self._get_job_status,
+        '/get_job_result': self._get_job_result,
+        '/cancel_job': self._cancel_job,
     }
 
+    # Endpoints which can return large lists, and so stream their responses.
+    streaming_endpoints = {'/get_dataset', '/get_preds'}
+    # Endpoints whose responses don't change for the lifetime of the app, so
+    # only need to be serialized once. The app is re-created (e.g. by
+    # dev_server) whenever the models or datasets change.
+    memoized_endpoints = {'/get_info'}
+    # Streaming endpoints which can be re-validated with an ETag, without
+    # keeping the response in memory.
+    etag_fns = {'/get_dataset': self._dataset_etag}
+    # Endpoints which return model outputs, which may be rounded by type.
+    # Interpreter outputs have no spec, so aren't rounded by field.
+    precision_fns = {'/get_preds': self._field_precision}
+
+    # Wrap endpoint fns to take (handler, request)
+    wrapped_handlers = {
+        k: make_handler(
+            v,
+            streaming=k in streaming_endpoints,
+            memoize=k in memoized_endpoints,
+            etag_fn=etag_fns.get(k),
+            precision_fn=precision_fns.get(k),
+            metrics=self._metrics) for k, v in handlers.items()
+    }
+    # Monitoring endpoints, which aren't JSON so already take
+    # (handler, request).
+    wrapped_handlers['/metrics'] = self._serve_metrics
+
     self._wsgi_app = wsgi_app.App(
-        # Wrap endpoint fns to take (handler, request)
-        handlers={k: make_handler(v) for k, v in handlers.items()},
+        handlers=wrapped_handlers,
         project_root=client_root,
         index_file='static/index.html',
+        compression_min_bytes=compression_min_bytes,
+        compression_level=compression_level,
     )
 
+  def _serve_metrics(self, handler, request):
+    """Serve request and cache metrics, in the Prometheus text format."""
+    extra = []
+    for name, m in self._models.items():
+      if isinstance(m, caching.CachingModelWrapper):
+        extra.extend(instrumentation.cache_samples(name, m.cache_stats()))
+    extra.extend(
+        instrumentation.cache_samples(
+            None,
+            self._interpretation_cache.stats(),
+            prefix='lit_interpretations_cache',
+            description='Interpretations cache'))
+    body = self._metrics.to_prometheus(extra=extra)
+    return handler.respond(request, body, 'text/plain')
+
   def save_cache(self):
     for m in self._models.values():
       if isinstance(m, caching.CachingModelWrapper):
         m.save_cache()
 
+  def close(self, shutdown_models: bool = True):
+    """Cancel background jobs, and stop their worker threads.
+
+    Args:
+      shutdown_models: if true, also call shutdown() on models which have it,
+        such as ParallelModelWrapper, to stop their worker processes. Set this
+        to false if the models will be re-used by another LitApp.
+    """
+    self._jobs.shutdown(wait=False)
+    if not shutdown_models:
+      return
+    for model in self._base_models.values():
+      shutdown = getattr(model, 'shutdown', None)
+      if callable(shutdown):
+        shutdown()
+
   def __call__(self, environ, start_response):
     """Implementation of the WSGI interface."""
     return self._wsgi_app(environ, start_response)
@@ -0,0 +1,161 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+"""Tests for lit_nlp.app."""
+
+import tempfile
+import time
+from unittest import mock
+
+from absl.testing import absltest
+
+from lit_nlp import app as lit_app
+from lit_nlp.api import components as lit_components
+from lit_nlp.api import dataset as lit_dataset
+from lit_nlp.api import types as lit_types
+from lit_nlp.lib import serialize
+from lit_nlp.lib import testing_utils
+from werkzeug import test as werkzeug_test
+
+
+class _ScoresInterpreter(lit_components.Interpreter):
+  """Returns a score for each input, with more decimal places than needed."""
+
+  def run(self, inputs, model, dataset, model_outputs=None, config=None):
+    return [{'scores': ex['value'] + 0.123456} for ex in inputs]
+
+
+class LitAppTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._client_root = tempfile.TemporaryDirectory()
+    self.addCleanup(self._client_root.cleanup)
+    self.dataset = lit_dataset.Dataset({'value': lit_types.Scalar()},
+                                       [{'value': i} for i in range(5)])
+
+  def _make_client(self, **app_kw) -> werkzeug_test.Client:
+    app = lit_app.LitApp({'model': testing_utils.TestModelBatched()},
+                         {'dataset': self.dataset},
+                         generators={},
+                         interpreters={'scores': _ScoresInterpreter()},
+                         client_root=self._client_root.name,
+                         **app_kw)
+    self.addCleanup(app.close)
+    return werkzeug_test.Client(app)
+
+  def _post_json(self, client, url, data=None):
+    response = client.post(url, data=serialize.to_json(data) if data else None)
+    self.assertEqual(200, response.status_code, response.get_data())
+    return serialize.from_json(response.get_data(as_text=True))
+
+  def test_get_dataset_etag(self):
+    client = self._make_client()
+    response = client.post('/get_dataset?dataset_name=dataset')
+    self.assertEqual(200, response.status_code)
+    # Streamed, rather than held in memory to be sent with a length.
+    self.assertIsNone(response.headers.get('Content-Length'))
+    examples = serialize.from_json(response.get_data(as_text=True))
+    self.assertEqual([{'value': i} for i in range(5)],
+                     [ex['data'] for ex in examples])
+    etag = response.headers['ETag']
+
+    response = client.post(
+        '/get_dataset?dataset_name=dataset', headers={'If-None-Match': etag})
+    self.assertEqual(304, response.status_code)
+    self.assertEqual(b'', response.get_data())
+
+    # A different serialization of the same data has a different tag.
+    response = client.post(
+        '/get_dataset?dataset_name=dataset&response_simple_json=false',
+        headers={'If-None-Match': etag})
+    self.assertEqual(200, response.status_code)
+    self.assertNotEqual(etag, response.headers['ETag'])
+
+    # As does a different dataset, even with the same URL.
+    other = lit_dataset.Dataset({'value': lit_types.Scalar()},
+                                [{'value': i} for i in range(6)])
+    self.dataset = other
+    response = self._make_client().post(
+        '/get_dataset?dataset_name=dataset', headers={'If-None-Match': etag})
+    self.assertEqual(200, response.status_code)
+
+  def test_get_info_memoized(self):
+    client = self._make_client()
+    response = client.post('/get_info')
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(
+        str(len(response.get_data())), response.headers['Content-Length'])
+    etag = response.headers['ETag']
+    response = client.post('/get_info', headers={'If-None-Match': etag})
+    self.assertEqual(304, response.status_code)
+    response = client.post('/get_info', headers={'If-None-Match': '"other"'})
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(etag, response.headers['ETag'])
+
+  def test_jobs(self):
+    client = self._make_client(precision_by_type={'RegressionScore': 2})
+    data = {'inputs': [{'data': {'value': 1}, 'id': 'a'}]}
+    url = ('/submit_job?endpoint=get_interpretations&model=model'
+           '&dataset_name=dataset&interpreter=scores')
+    job = self._post_json(client, url, data)
+    self.assertIn(job['status'], ('pending', 'running', 'done'))
+    # The same request gets the same job.
+    self.assertEqual(job['id'], self._post_json(client, url, data)['id'])
+
+    deadline = time.time() + 30
+    while job['status'] != 'done':
+      self.assertLess(time.time(), deadline)
+      time.sleep(0.01)
+      job = self._post_json(client, f'/get_job_status?job_id={job["id"]}')
+    result = self._post_json(client, f'/get_job_result?job_id={job["id"]}')
+    # Not rounded by model field type, even though the model also has a
+    # RegressionScore field named 'scores'.
+    self.assertEqual([{'scores': 1.123456}], result)
+    # Cancelling a finished job leaves it as it was.
+    job = self._post_json(client, f'/cancel_job?job_id={job["id"]}')
+    self.assertEqual('done', job['status'])
+
+  def test_get_preds_precision(self):
+    client = self._make_client(precision_by_type={'RegressionScore': 2})
+    data = {'inputs': [{'data': {'value': 1.123456}, 'id': 'a'}]}
+    url = '/get_preds?model=model&dataset_name=dataset&requested_types=Scalar'
+    self.assertEqual([{'scores': 1.12}], self._post_json(client, url, data))
+
+  def test_close(self):
+    model = testing_utils.TestModelBatched()
+    model.shutdown = mock.Mock()
+    app = lit_app.LitApp({'model': model}, {'dataset': self.dataset},
+                         generators={},
+                         interpreters={},
+                         client_root=self._client_root.name)
+    app.close(shutdown_models=False)
+    model.shutdown.assert_not_called()
+    app.close()
+    model.shutdown.assert_called_once_with()
+
+  def test_unknown_job(self):
+    client = self._make_client()
+    for endpoint in ('get_job_status', 'get_job_result', 'cancel_job'):
+      response = client.post(f'/{endpoint}?job_id=missing')
+      self.assertEqual(500, response.status_code)
+      self.assertIn("Unknown job id 'missing'",
+                    response.get_data(as_text=True))
+    response = client.post('/submit_job?endpoint=get_preds&model=model')
+    self.assertIn("can't be run as a job", response.get_data(as_text=True))
+
+
+if __name__ == '__main__':
+  absltest.main()
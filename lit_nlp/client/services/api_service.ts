@@ -35,8 +35,11 @@ export class ApiService extends LitService {
    */
   getInputs = async(dataset: string): Promise<IndexedInput[]> => {
     const loadMessage = 'Loading inputs';
+    // Use GET, so that the browser can re-use its cached copy if the server
+    // responds that it is unchanged.
     const inputResponse = await this.queryServer(
-        '/get_dataset', {'dataset_name': dataset}, [], loadMessage);
+        '/get_dataset', {'dataset_name': dataset}, [], loadMessage,
+        /* config */ undefined, 'GET');
     const toProcess = ensureArrayData(inputResponse);
     return toProcess.map((data, index) => {
       return {
@@ -53,7 +56,8 @@ export class ApiService extends LitService {
   getInfo = async():
       Promise<LitMetadata> => {
         const loadMessage = 'Loading metadata';
-        return this.queryServer<LitMetadata>('/get_info', {}, [], loadMessage);
+        return this.queryServer<LitMetadata>(
+            '/get_info', {}, [], loadMessage, /* config */ undefined, 'GET');
       }
 
   /**
@@ -171,17 +175,21 @@ export class ApiService extends LitService {
    * @param endpoint server endpoint, like /get_preds
    * @param params query params
    * @param inputs input examples
+   * @param method HTTP method; GET requests send no inputs or config, and can
+   *     be cached by the browser
    */
   private async queryServer<T>(
       endpoint: string, params: {[key: string]: string}, inputs: IndexedInput[],
-      loadMessage: string = '', config?: CallConfig): Promise<T> {
+      loadMessage: string = '', config?: CallConfig,
+      method: 'GET'|'POST' = 'POST'): Promise<T> {
     const finished = this.statusService.startLoading(loadMessage);
     try {
       const paramsArray =
           Object.keys(params).map((key: string) => `${key}=${params[key]}`);
       const url = encodeURI(`${endpoint}?${paramsArray.join('&')}`);
-      const body = JSON.stringify({inputs, config});
-      const res = await fetch(url, {method: 'POST', body});
+      const res = method === 'GET' ?
+          await fetch(url, {method}) :
+          await fetch(url, {method, body: JSON.stringify({inputs, config})});
       // If there is tsserver error, the response contains text (not json).
       if (!res.ok) {
         const text = await res.text();
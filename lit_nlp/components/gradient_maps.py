@@ -83,3 +83,6 @@ class GradientNorm(lit_components.Interpreter):
       all_results.append(result)
 
     return all_results
+
+  def is_per_example(self):
+    return True
@@ -85,7 +85,10 @@ class Indexer(object):
   def _get_dataset(self, dataset_name: Text = None):
     """Convert examples into ones to be used by the model (adding hashes)."""
     assert dataset_name is not None, "No dataset specified."
-    return caching.add_hashes_to_input(self._datasets[dataset_name].examples)
+    dataset = self._datasets[dataset_name]
+    if isinstance(dataset, lit_data.IndexedDataset):
+      return dataset.indexed_examples
+    return caching.add_hashes_to_input(dataset.examples)
 
   def _get_index_key(self, model_name, dataset_name, embedding_name):
     """Returns the key of an index, added to avoid collisions."""
@@ -163,8 +166,21 @@ class Indexer(object):
 
     # Cold start: Get embeddings for non-initialized settings.
     if self._initialize_new_indices:
-      for res_ix, (result, example) in enumerate(
-          zip(model.predict_with_metadata(examples), examples)):
+      # If all embeddings are cached on disk, read each as a single matrix
+      # instead of running the model.
+      matrices = {}
+      if isinstance(model, caching.CachingModelWrapper):
+        matrices = {
+            emb_name: model.get_embedding_matrix(dataset_name, emb_name,
+                                                 examples)
+            for emb_name in embeddings_to_index
+        }
+      if matrices and all(m is not None for m in matrices.values()):
+        results = ({emb_name: m[i] for emb_name, m in matrices.items()}
+                   for i in range(len(examples)))
+      else:
+        results = model.predict_with_metadata(examples)
+      for res_ix, (result, example) in enumerate(zip(results, examples)):
         for emb_name in embeddings_to_index:
           index_key = self._get_index_key(model_name, dataset_name, emb_name)
           # Initialize saving in the first iteration.
@@ -25,6 +25,7 @@ from lit_nlp.api import dataset as lit_dataset
 from lit_nlp.api import dtypes
 from lit_nlp.api import model as lit_model
 from lit_nlp.api import types
+from lit_nlp.lib import jobs
 from lit_nlp.lib import utils
 import numpy as np
 
@@ -97,7 +98,11 @@ class LIME(lit_components.Interpreter):
     all_results = []
 
     # Explain each input.
-    for input_ in inputs:
+    for i, input_ in enumerate(inputs):
+      # If running as a background job, stop early if it's been cancelled.
+      if jobs.cancel_requested():
+        return None
+      jobs.report_progress(i / len(inputs))
       # Dict[field name -> interpretations]
       result = {}
 
@@ -130,3 +135,6 @@ class LIME(lit_components.Interpreter):
       all_results.append(result)
 
     return all_results
+
+  def is_per_example(self):
+    return True
@@ -34,7 +34,9 @@ class PCAModel(projection.ProjectorModel):
     x_input = [i["x"] for i in inputs]
     if not x_input:
       return []
-    x_train = np.stack(x_input)
+    return self.fit_transform_array(np.stack(x_input))
+
+  def fit_transform_array(self, x_train):
     logging.info("PCA input x_train: %s", str(x_train.shape))
     zs = self._pca.fit_transform(x_train)
     self._fitted = True
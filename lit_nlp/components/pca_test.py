@@ -13,8 +13,14 @@
 # limitations under the License.
 # ==============================================================================
 """Tests for lit_nlp.components.pca."""
+import tempfile
+
 from absl.testing import absltest
+from lit_nlp.api import dataset as lit_dataset
+from lit_nlp.api import types as lit_types
 from lit_nlp.components import pca
+from lit_nlp.components import projection
+from lit_nlp.lib import caching
 from lit_nlp.lib import testing_utils
 import numpy as np
 
@@ -60,6 +66,28 @@ class PcaTest(absltest.TestCase):
     output_shape = np.array(list(output)[0]['z']).shape
     self.assertEqual(output_shape, (3,))
 
+  def test_projection_without_dataset_name(self):
+    # With an on-disk cache but no dataset_name in the config, the projection
+    # is fit on model outputs rather than the cached embedding matrix.
+    with tempfile.TemporaryDirectory() as cache_dir:
+      model = caching.CachingModelWrapper(
+          testing_utils.TestIdentityEmbeddingModel(), 'test',
+          cache_dir=cache_dir)
+      dataset = lit_dataset.Dataset(
+          {'x': lit_types.Embeddings()},
+          testing_utils.fake_projection_input(20, 10))
+      manager = projection.ProjectionManager(pca.PCAModel)
+      config = {'field_name': 'emb', 'proj_kw': {'n_components': 3}}
+      inputs = caching.add_hashes_to_input(dataset.examples[:2])
+      outputs = manager.run_with_metadata(
+          inputs,
+          model,
+          dataset,
+          model_outputs=model.predict_with_metadata(inputs),
+          config=config)
+      self.assertLen(outputs, 2)
+      self.assertEqual((3,), np.array(outputs[0]['z']).shape)
+
 
 if __name__ == '__main__':
   absltest.main()
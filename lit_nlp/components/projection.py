@@ -46,6 +46,7 @@ from lit_nlp.api import dataset as lit_dataset
 from lit_nlp.api import model as lit_model
 from lit_nlp.api import types as lit_types
 from lit_nlp.lib import caching
+import numpy as np
 
 JsonDict = lit_types.JsonDict
 Spec = lit_types.Spec
@@ -60,7 +61,25 @@ class ProjectorModel(lit_model.Model, metaclass=abc.ABCMeta):
   def fit_transform(self, inputs: Iterable[JsonDict]) -> List[JsonDict]:
     return
 
-  def fit_transform_with_metadata(self, indexed_inputs) -> List[JsonDict]:
+  def fit_transform_array(self, x: np.ndarray) -> Iterable[JsonDict]:
+    """As fit_transform(), but on a <float>[num_examples, num_dims] matrix.
+
+    Subclasses can override this to avoid splitting and re-stacking the rows.
+
+    Args:
+      x: input features, one row per example
+
+    Returns:
+      projected outputs, one per example
+    """
+    return self.fit_transform({"x": row} for row in x)
+
+  def fit_transform_with_metadata(self,
+                                  indexed_inputs,
+                                  x: Optional[np.ndarray] = None
+                                 ) -> List[JsonDict]:
+    if x is not None:
+      return self.fit_transform_array(x)
     return self.fit_transform((i["data"] for i in indexed_inputs))
 
   ##
@@ -85,14 +104,34 @@ class ProjectorModel(lit_model.Model, metaclass=abc.ABCMeta):
 class ProjectionInterpreter(lit_components.Interpreter):
   """Interpreter API implementation for dimensionality reduction model."""
 
-  def __init__(self, model: lit_model.Model, indexed_inputs: List[JsonDict],
+  def __init__(self,
+               model: lit_model.Model,
+               indexed_inputs: List[JsonDict],
                model_outputs: Optional[List[JsonDict]],
-               projector: ProjectorModel, field_name: Text, name: Text):
+               projector: ProjectorModel,
+               field_name: Text,
+               name: Text,
+               train_matrix: Optional[np.ndarray] = None):
     self._projector = caching.CachingModelWrapper(projector, name=name)
     self._field_name = field_name
 
     # Train on the given examples
-    self._run(model, indexed_inputs, model_outputs, do_fit=True)
+    if train_matrix is not None:
+      # Embeddings are already available as a single matrix.
+      self._fit_matrix(indexed_inputs, train_matrix)
+    else:
+      self._run(model, indexed_inputs, model_outputs, do_fit=True)
+
+  def _fit_matrix(self, indexed_inputs: List[JsonDict], x: np.ndarray):
+    # Rows are views into x, so this doesn't copy the embeddings.
+    converted_inputs = [{
+        "id": ex["id"],
+        "data": {
+            "x": row
+        }
+    } for ex, row in zip(indexed_inputs, x)]
+    return self._projector.fit_transform_with_metadata(
+        converted_inputs, dataset_name="", x=x)
 
   def convert_input(self, indexed_input: JsonDict,
                     model_output: JsonDict) -> JsonDict:
@@ -171,15 +210,23 @@ class ProjectionManager(lit_components.Interpreter):
     # Ignore pytype warning about abstract methods, since this should always
     # be a subclass of ProjectorModel which has these implemented.
     projector = self._model_factory(**config.get("proj_kw", {}))  # pytype: disable=not-instantiable
-    # TODO(lit-dev): recomputing hashes here is a bit wasteful - consider
-    # creating an 'IndexedDataset' class in the server, and passing that
-    # around so that components can access IndexedInputs directly.
-    train_inputs = caching.add_hashes_to_input(dataset.examples)
-    # TODO(lit-dev): remove 'dataset_name' from caching logic so we don't need
-    # to track it here or elsewhere.
-    train_outputs = list(
-        model.predict_with_metadata(
-            train_inputs, dataset_name=config.get("dataset_name")))
+    if isinstance(dataset, lit_dataset.IndexedDataset):
+      train_inputs = dataset.indexed_examples
+    else:
+      train_inputs = caching.add_hashes_to_input(dataset.examples)
+    # If the embeddings are cached on disk, read them as a single matrix rather
+    # than running (or loading) all of the model outputs.
+    train_matrix = None
+    train_outputs = None
+    if isinstance(model, caching.CachingModelWrapper):
+      train_matrix = model.get_embedding_matrix(
+          config.get("dataset_name"), config["field_name"], train_inputs)
+    if train_matrix is None:
+      # TODO(lit-dev): remove 'dataset_name' from caching logic so we don't
+      # need to track it here or elsewhere.
+      train_outputs = list(
+          model.predict_with_metadata(
+              train_inputs, dataset_name=config.get("dataset_name")))
     logging.info("Creating new projection instance on %d points",
                  len(train_inputs))
     return ProjectionInterpreter(
@@ -188,7 +235,13 @@ class ProjectionManager(lit_components.Interpreter):
         train_outputs,
         projector=projector,
         field_name=config["field_name"],
-        name=name)
+        name=name,
+        train_matrix=train_matrix)
+
+  def is_cacheable(self):
+    # Outputs depend on which projection instance was fit (and when), and
+    # are already cached by the instances themselves.
+    return False
 
   def run_with_metadata(self, *args, **kw):
     # UMAP code is not threadsafe and will throw
@@ -20,10 +20,27 @@ def query_lit_server(url: Text,
                      endpoint: Text,
                      params: Optional[Dict[Text, Text]] = None,
                      inputs: Optional[Any] = None,
-                     config: Optional[Any] = None) -> Any:
-  """Query a LIT server from Python."""
+                     config: Optional[Any] = None,
+                     binary_arrays: bool = False) -> Any:
+  """Query a LIT server from Python.
+
+  Args:
+    url: url of LIT server
+    endpoint: name of the endpoint, such as 'get_preds'
+    params: URL parameters for the request
+    inputs: inputs to send to the server
+    config: config to send to the server
+    binary_arrays: if true, send and receive NumPy arrays as base64-encoded
+      buffers, instead of as nested lists. This is smaller and much faster for
+      embeddings, gradients, and attention.
+
+  Returns:
+    the decoded server response
+  """
   # Pack data for LIT request
   data = {'inputs': inputs, 'config': config}
+  if binary_arrays:
+    params = dict(params or {}, response_binary_arrays=True)
   # TODO(lit-dev): for open source, require HTTPS.
   if not url.startswith('http://'):
     url = 'http://' + url
@@ -33,7 +50,7 @@ def query_lit_server(url: Text,
       'POST',
       full_url,
       params=params,
-      data=serialize.to_json(data),
+      data=serialize.to_json(data, binary_arrays=binary_arrays),
       headers={'Content-Type': 'application/json'})
   rq = rq.prepare()
   # Convert to urllib request
@@ -54,16 +71,23 @@ def query_lit_server(url: Text,
 class RemoteModel(lit_model.Model):
   """LIT model backed by a remote LIT server."""
 
-  def __init__(self, url: Text, name: Text, max_minibatch_size: int = 256):
+  def __init__(self,
+               url: Text,
+               name: Text,
+               max_minibatch_size: int = 256,
+               binary_arrays: bool = False):
     """Initialize model wrapper from remote server.
 
     Args:
       url: url of LIT server
       name: name of model on the remote server
       max_minibatch_size: batch size used for remote requests
+      binary_arrays: if true, transfer NumPy arrays in binary form; see
+        query_lit_server().
     """
     self._url = url
     self._name = name
+    self._binary_arrays = binary_arrays
 
     # Get specs
     server_info = query_lit_server(self._url, 'get_info')
@@ -96,7 +120,8 @@ class RemoteModel(lit_model.Model):
             'model': self._name,
             'response_simple_json': False
         },
-        inputs=indexed_inputs)
+        inputs=indexed_inputs,
+        binary_arrays=self._binary_arrays)
     logging.info('Received %d predictions from remote model.', len(preds))
     return preds
 
@@ -33,10 +33,13 @@ class SimilaritySearcher(lit_components.Generator):
   def __init__(self, indexer: index.Indexer):
     self.index = indexer
 
-  def _get_embedding(self, model, example, embedding_name, dataset_name):
+  def _get_embedding(self, model, example, embedding_name, dataset_name,
+                     dataset=None):
     """Calls the model on the example to get the embedding."""
-    # TODO(b/158626879): no longer need the add_hashes call.
-    model_input = caching.add_hashes_to_input([example])
+    if isinstance(dataset, lit_data.IndexedDataset):
+      model_input = dataset.index_inputs([example])
+    else:
+      model_input = caching.add_hashes_to_input([example])
     model_output = model.predict_with_metadata(
         model_input, dataset_name=dataset_name)
     embedding = [o[embedding_name] for o in model_output][0]
@@ -58,7 +61,7 @@ class SimilaritySearcher(lit_components.Generator):
     dataset_name = config['dataset_name']
     embedding_name = config['field_name']
     embedding = self._get_embedding(model, example, embedding_name,
-                                    dataset_name)
+                                    dataset_name, dataset)
     neighbors = self._find_nn(model_name, dataset_name, embedding_name,
                               embedding)
     return neighbors
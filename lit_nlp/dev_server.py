@@ -23,6 +23,8 @@ from lit_nlp.lib import wsgi_serving
 
 WSGI_SERVERS = {}
 WSGI_SERVERS['basic'] = wsgi_serving.BasicDevServer
+WSGI_SERVERS['threaded'] = wsgi_serving.ThreadedDevServer
+WSGI_SERVERS['prefork'] = wsgi_serving.PreforkDevServer
 WSGI_SERVERS['default'] = wsgi_serving.BasicDevServer
 
 
@@ -71,6 +73,10 @@ class Server(object):
     # Remaining keywords passed to the webserver class.
     self._server_kw = kw
     self._server_fn = WSGI_SERVERS[server_type]
+    if server_type == 'prefork' and not self._app_kw.get('data_dir'):
+      logging.warning(
+          'Running with multiple worker processes but no --data_dir; '
+          'predictions will not be shared between workers.')
 
   def serve(self):
     """Run server, with optional reload loop and cache saving."""
@@ -89,7 +95,10 @@ class Server(object):
       # TODO(b/158537323): disable or warn about this when using corplogin.
       prompt = input('[Enter] to restart server, Q to quit.')
       if len(prompt) > 0:  # pylint: disable=g-explicit-length-test
+        app.close()
         return
+      # The models are re-used by the next app, so keep them running.
+      app.close(shutdown_models=False)
 
       ##
       # pylint: disable=g-import-not-at-top
@@ -7,6 +7,7 @@ To run locally:
 
 Then navigate to localhost:5432 to access the demo UI.
 """
+import functools
 import os
 
 from absl import app
@@ -17,6 +18,7 @@ from lit_nlp import dev_server
 from lit_nlp import server_flags
 from lit_nlp.examples.datasets import glue
 from lit_nlp.examples.models import glue_models
+from lit_nlp.lib import parallel
 
 # NOTE: additional flags defined in server_flags.py
 
@@ -38,6 +40,21 @@ flags.DEFINE_integer(
     "Note: MNLI eval set is 10k examples, so will take a while to run and may "
     "be slow on older machines. Set --max_examples=200 for a quick start.")
 
+flags.DEFINE_integer(
+    "num_model_workers", 0,
+    "If > 0, run each model on this many worker processes, each with its own "
+    "copy of the model, to parallelize inference on many-core machines. "
+    "Each worker uses as much memory as a single model.")
+
+
+def _load_model(model_cls, path: str):
+  """Load a model, or start a pool of workers which each load it."""
+  if FLAGS.num_model_workers > 0:
+    return parallel.ParallelModelWrapper(
+        functools.partial(model_cls, path),
+        num_workers=FLAGS.num_model_workers)
+  return model_cls(path)
+
 
 def main(_):
 
@@ -45,20 +62,20 @@ def main(_):
   datasets = {}
 
   if "sst2" in FLAGS.tasks:
-    models["sst2"] = glue_models.SST2Model(
-        os.path.join(FLAGS.models_path, "sst2"))
+    models["sst2"] = _load_model(
+        glue_models.SST2Model, os.path.join(FLAGS.models_path, "sst2"))
     datasets["sst_dev"] = glue.SST2Data("validation")
     logging.info("Loaded models and data for SST-2 task.")
 
   if "stsb" in FLAGS.tasks:
-    models["stsb"] = glue_models.STSBModel(
-        os.path.join(FLAGS.models_path, "stsb"))
+    models["stsb"] = _load_model(
+        glue_models.STSBModel, os.path.join(FLAGS.models_path, "stsb"))
     datasets["stsb_dev"] = glue.STSBData("validation")
     logging.info("Loaded models and data for STS-B task.")
 
   if "mnli" in FLAGS.tasks:
-    models["mnli"] = glue_models.MNLIModel(
-        os.path.join(FLAGS.models_path, "mnli"))
+    models["mnli"] = _load_model(
+        glue_models.MNLIModel, os.path.join(FLAGS.models_path, "mnli"))
     datasets["mnli_dev"] = glue.MNLIData("validation_matched")
     datasets["mnli_dev_mm"] = glue.MNLIData("validation_mismatched")
     logging.info("Loaded models and data for MultiNLI task.")
@@ -3,7 +3,7 @@
 
 import os
 import re
-from typing import Optional, Dict, List, Iterable
+from typing import AbstractSet, Optional, Dict, List, Iterable
 
 from absl import logging
 import attr
@@ -35,6 +35,15 @@ class GlueModelConfig(object):
   # Preprocessing options
   max_seq_length: int = 128
   inference_batch_size: int = 32
+  # If > 0, adapt the batch size (starting from inference_batch_size) up to
+  # this, and back off on out-of-memory errors. See
+  # lit_model.Model.max_adaptive_minibatch_size().
+  max_adaptive_batch_size: int = 0
+  # If > 0, overlap tokenization and postprocessing with inference, with up to
+  # this many batches in flight. See lit_model.Model.pipeline_depth().
+  inference_pipeline_depth: int = 0
+  # If True, batch inputs of similar length together to reduce padding.
+  length_bucketing: bool = True
   # Input options
   text_a_name: str = "sentence1"
   text_b_name: Optional[str] = "sentence2"  # set to None for single-segment
@@ -203,7 +212,7 @@ class GlueModel(lit_model.Model):
       output["tokens_" + self.config.text_b_name] = output["tokens"][slicer_b]
 
     # Gradients for each segment, individually.
-    if self.config.compute_grads:
+    if "input_emb_grad" in output:
       output["token_grad_" +
              self.config.text_a_name] = output["input_emb_grad"][slicer_a]
       if self.config.text_b_name:
@@ -229,12 +238,46 @@ class GlueModel(lit_model.Model):
   def max_minibatch_size(self):
     return self.config.inference_batch_size
 
-  def predict_minibatch(self, inputs: Iterable[JsonDict]):
+  def max_adaptive_minibatch_size(self):
+    return self.config.max_adaptive_batch_size
+
+  def pipeline_depth(self):
+    return self.config.inference_pipeline_depth
+
+  def input_length(self, example: JsonDict) -> Optional[int]:
+    if not self.config.length_bucketing:
+      return None
+    # Number of words, as a cheap proxy for the number of wordpieces.
+    length = len(example[self.config.text_a_name].split())
+    if self.config.text_b_name:
+      length += len(example[self.config.text_b_name].split())
+    return length
+
+  def supports_output_keys(self):
+    return True
+
+  def preprocess_minibatch(self, inputs: List[JsonDict]):
+    return self._preprocess(inputs)
+
+  def predict_preprocessed(self,
+                           encoded_input: Dict[str, tf.Tensor],
+                           output_keys: Optional[AbstractSet[str]] = None):
+    """Run the model on tokenized inputs, returning batched NumPy outputs.
+
+    Args:
+      encoded_input: output of preprocess_minibatch()
+      output_keys: if given, gradients and attention are only returned (and
+        gradients only computed) if some of their fields are requested.
+
+    Returns:
+      dict of batched NumPy arrays
+    """
+    compute_grads = self.config.compute_grads and (
+        output_keys is None or
+        any(k.startswith("token_grad_") for k in output_keys))
     # Use watch_accessed_variables to save memory by having the tape do nothing
     # if we don't need gradients.
-    with tf.GradientTape(
-        watch_accessed_variables=self.config.compute_grads) as tape:
-      encoded_input = self._preprocess(inputs)
+    with tf.GradientTape(watch_accessed_variables=compute_grads) as tape:
       logits, embs, attentions = self.model(encoded_input, training=False)
 
       batched_outputs = {
@@ -244,7 +287,9 @@ class GlueModel(lit_model.Model):
       }
       assert len(attentions) == self.model.config.num_hidden_layers
       for i, layer_attention in enumerate(attentions):
-        batched_outputs[f"layer_{i}/attention"] = layer_attention
+        key = f"layer_{i}/attention"
+        if output_keys is None or key in output_keys:
+          batched_outputs[key] = layer_attention
 
       if self.is_regression:
         # <tf.float32>[batch_size]
@@ -260,15 +305,24 @@ class GlueModel(lit_model.Model):
     # Request gradients after the tape is run.
     # Note: embs[0] includes position and segment encodings, as well as subword
     # embeddings.
-    if self.config.compute_grads:
+    if compute_grads:
       # <tf.float32>[batch_size, num_tokens, emb_dim]
       batched_outputs["input_emb_grad"] = tape.gradient(
           scalar_pred_for_gradients, embs[0])
 
-    detached_outputs = {k: v.numpy() for k, v in batched_outputs.items()}
+    return {k: v.numpy() for k, v in batched_outputs.items()}
+
+  def postprocess_minibatch(self, detached_outputs: Dict[str, np.ndarray]):
     # Sequence of dicts, one per example.
     unbatched_outputs = utils.unbatch_preds(detached_outputs)
-    return map(self._postprocess, unbatched_outputs)
+    return list(map(self._postprocess, unbatched_outputs))
+
+  def predict_minibatch(self,
+                        inputs: Iterable[JsonDict],
+                        output_keys: Optional[AbstractSet[str]] = None):
+    encoded_input = self.preprocess_minibatch(inputs)
+    return self.postprocess_minibatch(
+        self.predict_preprocessed(encoded_input, output_keys=output_keys))
 
   def input_spec(self) -> Spec:
     ret = {}
@@ -0,0 +1,450 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+r"""Micro-benchmarks for the LIT server backend.
+
+These use synthetic data and the models in lib/testing_utils.py, so they don't
+need any model weights or dataset downloads.
+
+Usage:
+  python -m lit_nlp.examples.tools.benchmarks --benchmarks=get_dataset \
+      --num_examples=100000
+"""
+import functools
+import hashlib
+import json
+import tempfile
+import threading
+import time
+from typing import Callable, List
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+
+from lit_nlp import app as lit_app
+from lit_nlp.api import dataset as lit_dataset
+from lit_nlp.api import types as lit_types
+from lit_nlp.lib import caching
+from lit_nlp.lib import parallel
+from lit_nlp.lib import serialize
+from lit_nlp.lib import testing_utils
+from werkzeug import test as werkzeug_test
+
+flags.DEFINE_list("benchmarks", ["get_dataset"], "Which benchmarks to run.")
+flags.DEFINE_integer("num_examples", 100000,
+                     "Number of synthetic examples to use.")
+flags.DEFINE_integer("num_trials", 3, "Number of timed runs of each benchmark.")
+flags.DEFINE_integer("num_threads", 8,
+                     "Number of concurrent clients, for threaded benchmarks.")
+
+flags.DEFINE_string(
+    "glue_model_path", None,
+    "Path to a fine-tuned SST-2 GlueModel, for the imdb_warm_start benchmark. "
+    "This benchmark also downloads the IMDB dataset from TFDS.")
+
+FLAGS = flags.FLAGS
+
+JsonDict = lit_types.JsonDict
+
+
+def time_fn(name: str, fn: Callable[[], None], num_trials: int) -> List[float]:
+  """Run fn num_trials times, and log the wall time of each run."""
+  times = []
+  for _ in range(num_trials):
+    start = time.perf_counter()
+    fn()
+    times.append(time.perf_counter() - start)
+  logging.info("%s: best %.4fs, mean %.4fs over %d runs", name, min(times),
+               sum(times) / len(times), num_trials)
+  return times
+
+
+def make_text_dataset(num_examples: int) -> lit_dataset.Dataset:
+  """Synthetic sentence classification data, similar in shape to SST-2."""
+  spec = {
+      "sentence": lit_types.TextSegment(),
+      "label": lit_types.CategoryLabel(vocab=["0", "1"]),
+  }
+  examples = [{
+      "sentence": f"this is synthetic sentence number {i} , for benchmarks .",
+      "label": str(i % 2),
+  } for i in range(num_examples)]
+  return lit_dataset.Dataset(spec, examples)
+
+
+def make_app(datasets, models=None, **app_kw) -> lit_app.LitApp:
+  return lit_app.LitApp(
+      models or {},
+      datasets,
+      generators={},
+      interpreters={},
+      client_root=tempfile.mkdtemp(),
+      **app_kw)
+
+
+def _legacy_input_hash(example: JsonDict) -> str:
+  """input_hash() as originally implemented, for comparison."""
+  json_str = serialize.to_json(
+      example, simple=True, sort_keys=True).encode("utf-8")
+  return hashlib.md5(json_str).hexdigest()
+
+
+def benchmark_get_dataset(num_examples: int, num_trials: int):
+  """Example hashing and /get_dataset latency."""
+  dataset = make_text_dataset(num_examples)
+  time_fn("legacy input_hash (md5)",
+          lambda: [_legacy_input_hash(ex) for ex in dataset.examples],
+          num_trials)
+  time_fn("input_hash",
+          lambda: [caching.input_hash(ex) for ex in dataset.examples],
+          num_trials)
+
+  client = werkzeug_test.Client(make_app({"data": dataset}))
+  # The response is streamed, so read it all to time the serialization too.
+  get_dataset = lambda: client.post("/get_dataset?dataset_name=data").get_data()
+  # The first request computes ids; later ones re-use them.
+  time_fn("/get_dataset (first request)", get_dataset, 1)
+  time_fn("/get_dataset", get_dataset, num_trials)
+
+
+def benchmark_cache_contention(num_examples: int, num_trials: int):
+  """Concurrent reads from a warm CachingModelWrapper.
+
+  Several threads each read predictions for the whole dataset, as for
+  /get_preds from many users, while another thread makes small single-example
+  requests and records their latency.
+
+  Args:
+    num_examples: dataset size
+    num_trials: number of full-dataset reads per thread
+  """
+  inputs = caching.add_hashes_to_input(
+      [{"val": i} for i in range(num_examples)])
+  model = caching.CachingModelWrapper(
+      testing_utils.TestIdentityRegressionModel(), "bench")
+  model.predict_with_metadata(inputs, "data")  # warm the cache
+
+  def read_all():
+    for _ in range(num_trials):
+      model.predict_with_metadata(inputs, "data")
+
+  readers = [
+      threading.Thread(target=read_all) for _ in range(FLAGS.num_threads)
+  ]
+  latencies = []
+  start = time.perf_counter()
+  for t in readers:
+    t.start()
+  while any(t.is_alive() for t in readers):
+    request_start = time.perf_counter()
+    model.predict_with_metadata(inputs[:1], "data")
+    latencies.append(time.perf_counter() - request_start)
+  for t in readers:
+    t.join()
+  total = time.perf_counter() - start
+  logging.info(
+      "%d threads x %d reads of %d examples: %.3fs total, %.0f examples/s",
+      FLAGS.num_threads, num_trials, num_examples, total,
+      FLAGS.num_threads * num_trials * num_examples / total)
+  logging.info(
+      "single-example requests under load: %d requests, mean %.2fms, "
+      "max %.2fms", len(latencies), 1000 * sum(latencies) / len(latencies),
+      1000 * max(latencies))
+
+
+def benchmark_serialize(num_examples: int, num_trials: int):
+  """Encoding and decoding of model outputs, with and without binary arrays.
+
+  Outputs are shaped like those of a BERT-base classifier on short sentences,
+  with a pooled embedding, token gradients, and one layer of attention.
+
+  Args:
+    num_examples: number of predictions to serialize
+    num_trials: number of timed runs
+  """
+  rng = np.random.RandomState(42)
+  preds = [{
+      "probas": rng.rand(2).astype(np.float32),
+      "cls_emb": rng.rand(768).astype(np.float32),
+      "token_grad": rng.rand(16, 768).astype(np.float32),
+      "attention": rng.rand(12, 16, 16).astype(np.float32),
+  } for _ in range(num_examples)]
+  for binary_arrays in [False, True]:
+    name = "binary" if binary_arrays else "json"
+    encode = functools.partial(
+        serialize.to_json, preds, binary_arrays=binary_arrays)
+    encoded = encode()
+    logging.info("%s: %.1f MB", name, len(encoded) / 1e6)
+    time_fn(f"{name} encode", encode, num_trials)
+    time_fn(f"{name} decode", functools.partial(serialize.from_json, encoded),
+            num_trials)
+
+
+def make_glue_preds(num_examples: int,
+                    num_tokens: int = 32,
+                    num_layers: int = 12) -> List[JsonDict]:
+  """Synthetic outputs shaped like those of GlueModel with BERT-base."""
+  rng = np.random.RandomState(42)
+  tokens = [f"tok{i}" for i in range(num_tokens)]
+  preds = []
+  for _ in range(num_examples):
+    pred = {
+        "tokens": tokens,
+        "tokens_sentence": tokens,
+        "probas": rng.rand(2).astype(np.float32),
+        "cls_emb": rng.rand(768).astype(np.float32),
+        "token_grad_sentence": rng.rand(num_tokens, 768).astype(np.float32),
+    }
+    for i in range(num_layers):
+      pred[f"layer_{i}/attention"] = rng.rand(12, num_tokens,
+                                              num_tokens).astype(np.float32)
+    preds.append(pred)
+  return preds
+
+
+def benchmark_encode_preds(num_examples: int, num_trials: int):
+  """Frontend (simple) JSON encoding of model outputs and /get_info."""
+  preds = make_glue_preds(num_examples)
+  time_fn("json.dumps (stdlib)",
+          lambda: json.dumps(preds, cls=serialize.SimpleJSONEncoder),
+          num_trials)
+  logging.info("orjson available: %s", serialize.orjson is not None)
+  time_fn("serialize.to_json", lambda: serialize.to_json(preds, simple=True),
+          num_trials)
+  # Probabilities only, as for the data table.
+  probas = [{"probas": p["probas"]} for p in preds]
+  time_fn("json.dumps (stdlib), probas only",
+          lambda: json.dumps(probas, cls=serialize.SimpleJSONEncoder),
+          num_trials)
+  time_fn("serialize.to_json, probas only",
+          lambda: serialize.to_json(probas, simple=True), num_trials)
+
+  dataset = make_text_dataset(100)
+  models = {
+      f"model_{i}": testing_utils.TestRegressionModel(dataset.spec())
+      for i in range(20)
+  }
+  client = werkzeug_test.Client(make_app({"data": dataset}, models))
+  get_info = lambda: client.post("/get_info")
+  time_fn("/get_info (first request)", get_info, 1)
+  time_fn("/get_info", get_info, num_trials)
+
+
+def benchmark_pipelined_predict(num_examples: int, num_trials: int):
+  """Model.predict() with and without pipelined minibatch stages.
+
+  This uses a synthetic model whose stages sleep, so it measures the overlap
+  between stages rather than any real model. Real speedups depend on how much
+  of preprocessing and inference run without holding the GIL.
+
+  Args:
+    num_examples: number of examples to predict on; capped at 600, since each
+      minibatch of 3 takes 30ms without pipelining.
+    num_trials: number of timed runs.
+  """
+  inputs = [{"value": i} for i in range(min(num_examples, 600))]
+  for depth in (0, 1, 2, 4):
+    model = testing_utils.TestPipelinedModel(depth=depth, stage_seconds=0.01)
+    time_fn(f"predict() on {len(inputs)} examples, pipeline_depth={depth}",
+            lambda: list(model.predict(inputs)), num_trials)  # pylint: disable=cell-var-from-loop
+
+
+class _PaddedModel(testing_utils.TestModelBatched):
+  """Synthetic text model whose cost depends on the padded minibatch size.
+
+  Each minibatch is padded to its longest input, and run through a small
+  dense layer at every position, as in a real sequence model.
+  """
+
+  def __init__(self, batch_size: int, length_bucketing: bool):
+    super().__init__()
+    self._batch_size = batch_size
+    self._length_bucketing = length_bucketing
+    self._weights = np.random.RandomState(0).randn(64, 64).astype(np.float32)
+
+  def max_minibatch_size(self):
+    return self._batch_size
+
+  def input_length(self, example):
+    if not self._length_bucketing:
+      return None
+    return len(example["text"].split())
+
+  def predict_minibatch(self, inputs, **unused_kw):
+    lengths = [len(ex["text"].split()) for ex in inputs]
+    padded = np.zeros((len(inputs), max(lengths), 64), dtype=np.float32)
+    for i, n in enumerate(lengths):
+      padded[i, :n] = 1.0
+    hidden = np.tanh(padded @ self._weights) @ self._weights
+    return [{"scores": float(h[:n].sum())} for h, n in zip(hidden, lengths)]
+
+
+def benchmark_length_bucketing(num_examples: int, num_trials: int):
+  """Warm-start throughput with and without length-bucketed minibatches.
+
+  Inputs follow a long-tailed length distribution like IMDB reviews (median
+  ~170 words, truncated to 500), so that in arrival order most minibatches are
+  padded to a long outlier.
+
+  Args:
+    num_examples: number of examples; capped at 10000.
+    num_trials: number of timed runs.
+  """
+  rng = np.random.RandomState(42)
+  lengths = np.clip(rng.lognormal(np.log(170), 0.7, size=min(num_examples,
+                                                             10000)), 10, 500)
+  dataset = lit_dataset.Dataset(
+      {"text": lit_types.TextSegment()},
+      [{"text": " ".join(["word"] * int(n))} for n in lengths])
+  for length_bucketing in (False, True):
+    model = _PaddedModel(32, length_bucketing)
+    inputs = dataset.examples
+    times = time_fn(
+        f"predict() on {len(inputs)} examples, "
+        f"length_bucketing={length_bucketing}",
+        lambda: list(model.predict(inputs)), num_trials)  # pylint: disable=cell-var-from-loop
+    logging.info("Throughput: %.1f examples/s", len(inputs) / min(times))
+
+
+def benchmark_parallel_predict(num_examples: int, num_trials: int):
+  """predict() on one model, and on ParallelModelWrapper with 1-8 workers.
+
+  This uses the synthetic padded model from the length_bucketing benchmark,
+  which is CPU-bound, so speedups are limited by the number of cores.
+
+  Args:
+    num_examples: number of examples; capped at 10000.
+    num_trials: number of timed runs, after one untimed run to start workers.
+  """
+  rng = np.random.RandomState(42)
+  lengths = np.clip(rng.lognormal(np.log(170), 0.7, size=min(num_examples,
+                                                             10000)), 10, 500)
+  inputs = [{"text": " ".join(["word"] * int(n))} for n in lengths]
+  model = _PaddedModel(32, length_bucketing=False)
+  times = time_fn(f"predict() on {len(inputs)} examples, single process",
+                  lambda: list(model.predict(inputs)), num_trials)
+  logging.info("Throughput: %.1f examples/s", len(inputs) / min(times))
+  for num_workers in (1, 2, 4, 8):
+    wrapper = parallel.ParallelModelWrapper(
+        functools.partial(_PaddedModel, 32, length_bucketing=False),
+        num_workers=num_workers)
+    list(wrapper.predict(inputs[:32 * num_workers]))
+    times = time_fn(
+        f"predict() on {len(inputs)} examples, {num_workers} workers",
+        lambda: list(wrapper.predict(inputs)), num_trials)  # pylint: disable=cell-var-from-loop
+    logging.info("Throughput: %.1f examples/s", len(inputs) / min(times))
+    wrapper.shutdown()
+
+
+class _OverheadModel(testing_utils.TestModelBatched):
+  """Synthetic model with a fixed cost per minibatch, and a memory limit.
+
+  Each minibatch costs 5ms plus 0.05ms per example, like a small model on CPU
+  where per-call overhead dominates for short inputs. Minibatches of more than
+  max_fit examples raise an out-of-memory error.
+  """
+
+  def __init__(self, batch_size: int, max_adaptive: int, max_fit: int):
+    super().__init__()
+    self._batch_size = batch_size
+    self._max_adaptive = max_adaptive
+    self._max_fit = max_fit
+
+  def max_minibatch_size(self):
+    return self._batch_size
+
+  def max_adaptive_minibatch_size(self):
+    return self._max_adaptive
+
+  def predict_minibatch(self, inputs, **unused_kw):
+    if len(inputs) > self._max_fit:
+      raise MemoryError(f"Minibatch of {len(inputs)} doesn't fit.")
+    time.sleep(0.005 + 0.00005 * len(inputs))
+    return [{"scores": x["value"]} for x in inputs]
+
+
+def benchmark_adaptive_batch_size(num_examples: int, num_trials: int):
+  """Throughput with a static minibatch size, and with adaptive sizing.
+
+  Args:
+    num_examples: number of examples; capped at 20000.
+    num_trials: number of timed runs. The adaptive model keeps its size across
+      runs, so later runs show the steady state.
+  """
+  inputs = [{"value": i} for i in range(min(num_examples, 20000))]
+  configs = [("static, size 32", 0), ("adaptive, up to 1024", 1024)]
+  for name, max_adaptive in configs:
+    model = _OverheadModel(32, max_adaptive, max_fit=256)
+    times = time_fn(f"predict() on {len(inputs)} examples, {name}",
+                    lambda: list(model.predict(inputs)), num_trials)  # pylint: disable=cell-var-from-loop
+    logging.info("Throughput: %.1f examples/s", len(inputs) / min(times))
+
+
+def benchmark_imdb_warm_start(num_examples: int, num_trials: int):
+  """Warm-start a GlueModel on IMDB, with and without length bucketing.
+
+  This needs TensorFlow, TFDS, and a fine-tuned model (--glue_model_path).
+
+  Args:
+    num_examples: number of IMDB test examples to use.
+    num_trials: number of timed runs.
+  """
+  # pylint: disable=g-import-not-at-top
+  from lit_nlp.examples.datasets import classification
+  from lit_nlp.examples.models import glue_models
+  # pylint: enable=g-import-not-at-top
+  if not FLAGS.glue_model_path:
+    raise ValueError("--glue_model_path is required for imdb_warm_start.")
+  dataset = classification.IMDBData("test").sample(num_examples, seed=0)
+  for length_bucketing in (False, True):
+    # An SST-2 model, but reading the 'text' field of IMDB.
+    model = glue_models.GlueModel(
+        FLAGS.glue_model_path,
+        text_a_name="text",
+        text_b_name=None,
+        labels=classification.IMDBData.LABELS,
+        null_label_idx=0,
+        length_bucketing=length_bucketing)
+    times = time_fn(
+        f"warm start on {len(dataset)} IMDB examples, "
+        f"length_bucketing={length_bucketing}",
+        lambda: make_app({"imdb": dataset}, {"sst2": model}, warm_start=1.0),  # pylint: disable=cell-var-from-loop
+        num_trials)
+    logging.info("Throughput: %.1f examples/s", len(dataset) / min(times))
+
+
+BENCHMARKS = {
+    "get_dataset": benchmark_get_dataset,
+    "cache_contention": benchmark_cache_contention,
+    "serialize": benchmark_serialize,
+    "encode_preds": benchmark_encode_preds,
+    "pipelined_predict": benchmark_pipelined_predict,
+    "length_bucketing": benchmark_length_bucketing,
+    "adaptive_batch_size": benchmark_adaptive_batch_size,
+    "parallel_predict": benchmark_parallel_predict,
+    "imdb_warm_start": benchmark_imdb_warm_start,
+}
+
+
+def main(_):
+  for name in FLAGS.benchmarks:
+    logging.info("Running benchmark '%s'", name)
+    BENCHMARKS[name](FLAGS.num_examples, FLAGS.num_trials)
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -15,18 +15,34 @@
 # Lint as: python3
 """Miscellaneous helper functions."""
 
+import collections
+import concurrent.futures
+import contextlib
 import functools
 import hashlib
+import json
 import os
 import pickle
+import sqlite3
+import sys
 import threading
-from typing import Text, Optional, Union, Any, List, Tuple
+from typing import Text, Optional, Union, Any, Dict, Iterable, List, Tuple, Type
+import urllib.parse
 
 from absl import logging
 
+from lit_nlp.api import components as lit_components
+from lit_nlp.api import dataset as lit_dataset
 from lit_nlp.api import model as lit_model
 from lit_nlp.api import types
 from lit_nlp.lib import serialize
+from lit_nlp.lib import utils
+import numpy as np
+
+try:
+  import fcntl  # pylint: disable=g-import-not-at-top
+except ImportError:  # Not available on Windows.
+  fcntl = None
 
 JsonDict = types.JsonDict
 
@@ -34,12 +50,24 @@ JsonDict = types.JsonDict
 # None is used as a sentinel to skip the cache.
 CacheKey = Union[Tuple[Text, Text], None]
 
+# Output types which are large, but typically only viewed for a few examples at
+# a time. These can be kept in a small secondary cache; see CachingModelWrapper.
+DEFAULT_SECONDARY_TYPES = (types.AttentionHeads, types.TokenGradients)
+
+# Number of lock shards for the main predictions cache in CachingModelWrapper.
+DEFAULT_NUM_SHARDS = 16
+
+
+# Canonical encoding for hashing: sorted keys, no whitespace. Re-using a single
+# encoder instance avoids constructing one for every example.
+_HASH_ENCODER = serialize.SimpleJSONEncoder(
+    sort_keys=True, separators=(",", ":"))
+
 
 def input_hash(example: JsonDict) -> Text:
   """Create stable hash of an input example."""
-  json_str = serialize.to_json(
-      example, simple=True, sort_keys=True).encode("utf-8")
-  return hashlib.md5(json_str).hexdigest()
+  json_str = _HASH_ENCODER.encode(example).encode("utf-8")
+  return hashlib.blake2b(json_str, digest_size=16).hexdigest()
 
 
 def add_hashes_to_input(examples: List[JsonDict]) -> List[JsonDict]:
@@ -47,52 +75,192 @@ def add_hashes_to_input(examples: List[JsonDict]) -> List[JsonDict]:
   return [{"data": example, "id": input_hash(example)} for example in examples]
 
 
+def estimate_size(data) -> int:
+  """Estimate the memory footprint of a cached value, in bytes.
+
+  NumPy arrays are counted by their buffer size (nbytes), which dominates for
+  typical model outputs such as embeddings or attention heads. Containers are
+  counted recursively, and everything else is approximated by sys.getsizeof.
+
+  Args:
+    data: a cached value, typically a JsonDict of model outputs
+
+  Returns:
+    approximate size in bytes
+  """
+  if isinstance(data, np.ndarray):
+    return data.nbytes
+  elif isinstance(data, dict):
+    return sum(estimate_size(v) for v in data.values())
+  elif isinstance(data, (list, tuple)):
+    return sum(estimate_size(v) for v in data)
+  else:
+    return sys.getsizeof(data)
+
+
+class _CacheShard(object):
+  """LRU dict with size accounting; one partition of a PredsCache."""
+
+  def __init__(self, max_bytes: Optional[int]):
+    self.lock = threading.RLock()
+    self._max_bytes = max_bytes
+    # Ordered from least- to most-recently used.
+    self._d = collections.OrderedDict()
+    self._sizes = dict()
+    self.total_bytes = 0
+    # Counters, for monitoring.
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self):
+    return len(self._d)
+
+  def put(self, data, key: CacheKey):
+    with self.lock:
+      self._remove(key)
+      self._d[key] = data
+      self._sizes[key] = estimate_size(data)
+      self.total_bytes += self._sizes[key]
+      self._evict()
+
+  def get(self, key: CacheKey) -> Optional[Any]:
+    with self.lock:
+      if key not in self._d:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._d.move_to_end(key)
+      return self._d[key]
+
+  def peek(self, key: CacheKey) -> Optional[Any]:
+    with self.lock:
+      return self._d.get(key)
+
+  def items(self) -> List[Tuple[CacheKey, Any]]:
+    with self.lock:
+      return list(self._d.items())
+
+  def _remove(self, key: CacheKey):
+    if key in self._d:
+      del self._d[key]
+      self.total_bytes -= self._sizes.pop(key)
+
+  def _evict(self):
+    """Evict least-recently-used entries until we're within budget."""
+    if self._max_bytes is None:
+      return
+    # Always keep the most recent entry, even if it alone exceeds the budget.
+    while self.total_bytes > self._max_bytes and len(self._d) > 1:
+      key = next(iter(self._d))
+      self._remove(key)
+      self.evictions += 1
+
+
 class PredsCache(object):
-  """Cache for model outputs."""
+  """Cache for model outputs.
 
-  def __init__(self):
-    # TODO(lit-team): consider using a read/write lock, or setting timeouts if
-    # contention becomes an issue.
+  By default the cache is unbounded. If max_bytes is set, entries are evicted
+  in least-recently-used order once the estimated size of the cached values
+  (see estimate_size()) exceeds the budget.
+
+  Keys are partitioned across num_shards shards, each with its own lock, so
+  that concurrent readers and writers mostly don't block each other. Each
+  shard gets an equal part of max_bytes, so with more than one shard the
+  eviction order is only approximately LRU.
+  """
+
+  def __init__(self, max_bytes: Optional[int] = None, num_shards: int = 1):
+    # Not used by get() or put(), which lock individual shards. Callers can use
+    # this to make a sequence of operations atomic with respect to each other.
     self._lock = threading.RLock()
-    # TODO(lit-dev): consider using an OrderedDict to implement a LRU cache of
-    # bounded size.
-    self._d = dict()
+    self._max_bytes = max_bytes or None
+    shard_max_bytes = None
+    if self._max_bytes is not None:
+      shard_max_bytes = max(1, self._max_bytes // num_shards)
+    self._shards = [_CacheShard(shard_max_bytes) for _ in range(num_shards)]
 
   @property
   def lock(self):
     return self._lock
 
+  def _shard(self, key: CacheKey) -> _CacheShard:
+    return self._shards[hash(key) % len(self._shards)]
+
   def put(self, data, key: CacheKey):
     if key is None:
       logging.info("Ignoring put(data, None) due to sentinel values in key.")
       return
-    self._d[key] = data
+    self._shard(key).put(data, key)
 
   def get(self, key: CacheKey) -> Optional[Any]:
     if key is None:
       logging.info("Ignoring get(None) due to sentinel values in key.")
       return None
-    return self._d.get(key, None)
+    return self._shard(key).get(key)
+
+  def peek(self, key: CacheKey) -> Optional[Any]:
+    """As get(), but doesn't count as a hit or miss, or as a recent use."""
+    if key is None:
+      return None
+    return self._shard(key).peek(key)
+
+  def __len__(self):
+    return sum(len(shard) for shard in self._shards)
 
   def info(self) -> Text:
     """Print some info, for logging."""
-    return str(len(self._d))
+    return str(len(self))
+
+  def items(self) -> List[Tuple[CacheKey, Any]]:
+    """Return a snapshot of (key, value) pairs, from least-recently used.
+
+    With multiple shards, the order is only LRU within each shard.
+
+    Returns:
+      list of (key, value)
+    """
+    ret = []
+    for shard in self._shards:
+      ret.extend(shard.items())
+    return ret
+
+  def stats(self) -> Dict[Text, int]:
+    """Return cache counters, for monitoring."""
+    ret = {
+        "entries": 0,
+        "bytes": 0,
+        "max_bytes": self._max_bytes or 0,
+        "hits": 0,
+        "misses": 0,
+        "evictions": 0,
+    }
+    for shard in self._shards:
+      with shard.lock:
+        ret["entries"] += len(shard)
+        ret["bytes"] += shard.total_bytes
+        ret["hits"] += shard.hits
+        ret["misses"] += shard.misses
+        ret["evictions"] += shard.evictions
+    return ret
 
   ##
   # For development use
   def save_to_disk(self, path):
     """Save cache data to disk."""
-    logging.info("Saving cache (%d entries) to %s", len(self._d), path)
+    data = dict(self.items())
+    logging.info("Saving cache (%d entries) to %s", len(data), path)
     with open(path, "wb") as fd:
-      pickle.dump(self._d, fd)
+      pickle.dump(data, fd)
 
   def load_from_disk(self, path):
     """Load cache data from disk."""
     try:
       with open(path, "rb") as fd:
         data = pickle.load(fd)
-      self._d = data
-      logging.info("Loaded cache (%d entries) from %s", len(self._d), path)
+      for key, value in data.items():
+        self.put(value, key)
+      logging.info("Loaded cache (%d entries) from %s", len(self), path)
     except EOFError:
       logging.error(
           "Failed loading cache, possibly due to malformed cache data."
@@ -100,49 +268,492 @@ class PredsCache(object):
       exit(1)
 
 
+class DiskPredsStore(object):
+  """Persistent store for model outputs, backed by SQLite.
+
+  Unlike PredsCache.save_to_disk(), which pickles the whole cache in one shot,
+  entries are written through incrementally as they are computed and read back
+  lazily, one key at a time. This keeps startup time independent of the cache
+  size, and means that predictions survive a crash of the server.
+
+  Each value is pickled individually with the highest protocol, so NumPy arrays
+  are stored as their raw buffers rather than as nested lists.
+
+  The underlying file can be shared by multiple processes; each process (and
+  forked child) opens its own connection.
+  """
+
+  def __init__(self, path: Text):
+    self._path = path
+    self._lock = threading.RLock()
+    self._conn = None
+    self._pid = None
+    self._hits = 0
+    self._misses = 0
+    with self._lock:
+      self._connection().execute(
+          "CREATE TABLE IF NOT EXISTS preds ("
+          "dataset TEXT NOT NULL, id TEXT NOT NULL, value BLOB NOT NULL, "
+          "PRIMARY KEY (dataset, id))")
+      self._connection().commit()
+
+  @property
+  def path(self) -> Text:
+    return self._path
+
+  def _connection(self) -> sqlite3.Connection:
+    """Return a connection for the current process."""
+    if self._conn is None or self._pid != os.getpid():
+      # Don't re-use a connection inherited across fork().
+      self._conn = sqlite3.connect(
+          self._path, timeout=60.0, check_same_thread=False)
+      # Write-ahead logging allows concurrent readers alongside a writer.
+      self._conn.execute("PRAGMA journal_mode=WAL")
+      self._conn.execute("PRAGMA synchronous=NORMAL")
+      self._pid = os.getpid()
+    return self._conn
+
+  def put(self, data, key: CacheKey):
+    self.put_many([(key, data)])
+
+  def put_many(self, items: Iterable[Tuple[CacheKey, Any]]):
+    """Write several entries in a single transaction."""
+    rows = [(key[0], key[1], pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+            for key, data in items
+            if key is not None]
+    if not rows:
+      return
+    with self._lock:
+      conn = self._connection()
+      conn.executemany(
+          "INSERT OR REPLACE INTO preds (dataset, id, value) VALUES (?, ?, ?)",
+          rows)
+      conn.commit()
+
+  def get(self, key: CacheKey) -> Optional[Any]:
+    if key is None:
+      return None
+    with self._lock:
+      row = self._connection().execute(
+          "SELECT value FROM preds WHERE dataset = ? AND id = ?",
+          key).fetchone()
+      if row is None:
+        self._misses += 1
+        return None
+      self._hits += 1
+    return pickle.loads(row[0])
+
+  def __len__(self):
+    with self._lock:
+      return self._connection().execute(
+          "SELECT COUNT(*) FROM preds").fetchone()[0]
+
+  def stats(self) -> Dict[Text, int]:
+    """Return store counters, for monitoring."""
+    with self._lock:
+      return {"hits": self._hits, "misses": self._misses}
+
+  def close(self):
+    with self._lock:
+      if self._conn is not None and self._pid == os.getpid():
+        self._conn.close()
+      self._conn = None
+
+
+def _safe_filename(name: Text) -> Text:
+  """Escape a dataset or field name (e.g. 'layer_0/attention') for the disk."""
+  return urllib.parse.quote(name, safe="") or "_"
+
+
+class ArrayColumn(object):
+  """Append-only column of fixed-shape arrays, read as a memory-mapped matrix.
+
+  Rows are stored as a raw buffer in <path>.bin, with one example id per line
+  in <path>.ids and the dtype and row shape in <path>.json. A whole column can
+  be read back as a single [num_rows, ...] np.memmap, without deserializing
+  each row individually.
+
+  Appends are serialized with a file lock where available, so that several
+  processes can share a column.
+  """
+
+  def __init__(self, path: Text):
+    self._path = path
+    self._lock = threading.RLock()
+    self._dtype = None
+    self._row_shape = None
+    self._ids = []
+    self._index = {}  # id -> row
+    self._ids_offset = 0  # bytes of the .ids file read so far
+    self._mmap = None
+
+  @contextlib.contextmanager
+  def _file_lock(self):
+    if fcntl is None:
+      yield
+      return
+    with open(self._path + ".lock", "a") as fd:
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+  @property
+  def _row_bytes(self) -> int:
+    return self._dtype.itemsize * int(np.prod(self._row_shape))
+
+  def _refresh(self):
+    """Pick up rows appended since the last read, e.g. by other processes."""
+    if self._dtype is None:
+      if not os.path.exists(self._path + ".json"):
+        return
+      with open(self._path + ".json") as fd:
+        meta = json.load(fd)
+      self._dtype = np.dtype(meta["dtype"])
+      self._row_shape = tuple(meta["shape"])
+    if not os.path.exists(self._path + ".ids"):
+      return
+    with open(self._path + ".ids", "rb") as fd:
+      fd.seek(self._ids_offset)
+      new_data = fd.read()
+    # Ignore a trailing partial line, if a write is in progress.
+    new_data = new_data[:new_data.rfind(b"\n") + 1]
+    self._ids_offset += len(new_data)
+    for example_id in new_data.decode("utf-8").splitlines():
+      self._index[example_id] = len(self._ids)
+      self._ids.append(example_id)
+
+  def __len__(self):
+    with self._lock:
+      self._refresh()
+      return len(self._ids)
+
+  def append(self, ids: List[Text], arrays: List[np.ndarray]):
+    """Append rows for any ids not already in the column."""
+    with self._lock, self._file_lock():
+      self._refresh()
+      rows = collections.OrderedDict()
+      for example_id, arr in zip(ids, arrays):
+        if example_id not in self._index:
+          rows[example_id] = np.asarray(arr)
+      if not rows:
+        return
+      if self._dtype is None:
+        first = next(iter(rows.values()))
+        self._dtype = first.dtype
+        self._row_shape = first.shape
+        with open(self._path + ".json", "w") as fd:
+          json.dump({"dtype": self._dtype.str, "shape": self._row_shape}, fd)
+      rows = collections.OrderedDict(
+          (k, v) for k, v in rows.items() if v.shape == self._row_shape)
+      if not rows:
+        return
+      data = np.stack(list(rows.values())).astype(self._dtype, copy=False)
+      with open(self._path + ".bin", "ab") as fd:
+        # Drop any rows from an interrupted append that never got ids.
+        fd.truncate(len(self._ids) * self._row_bytes)
+        fd.write(data.tobytes())
+      # Write ids last, so that readers never see an id without its row.
+      with open(self._path + ".ids", "ab") as fd:
+        fd.write("".join(k + "\n" for k in rows).encode("utf-8"))
+      self._refresh()
+
+  def matrix(self) -> Optional[np.ndarray]:
+    """Return all rows as a read-only memory-mapped matrix."""
+    with self._lock:
+      self._refresh()
+      if not self._ids:
+        return None
+      num_rows = len(self._ids)
+      if self._mmap is None or self._mmap.shape[0] != num_rows:
+        self._mmap = np.memmap(
+            self._path + ".bin",
+            dtype=self._dtype,
+            mode="r",
+            shape=(num_rows,) + self._row_shape)
+      return self._mmap
+
+  def get_rows(self, ids: List[Text]) -> Optional[np.ndarray]:
+    """Return rows for the given ids, or None if any are missing.
+
+    If the ids are a contiguous run of rows in insertion order (as for a full
+    dataset that was written in order), the result is a view into the
+    memory-mapped file and no data is copied.
+
+    Args:
+      ids: example ids
+
+    Returns:
+      <dtype>[len(ids), ...], or None
+    """
+    matrix = self.matrix()
+    if matrix is None:
+      return None
+    with self._lock:
+      try:
+        rows = [self._index[example_id] for example_id in ids]
+      except KeyError:
+        return None
+    if rows and rows == list(range(rows[0], rows[0] + len(rows))):
+      return matrix[rows[0]:rows[0] + len(rows)]
+    return matrix[rows]
+
+
+# Reserved field in cached outputs which were computed for only some of the
+# output fields; holds the frozenset of fields that the entry covers.
+_OUTPUT_KEYS_FIELD = "__output_keys__"
+
+
+def _covers(output: JsonDict, output_keys: Optional[frozenset]) -> bool:
+  """Whether a cached output has all of the fields in output_keys."""
+  computed = output.get(_OUTPUT_KEYS_FIELD)
+  if computed is None:
+    return True
+  return output_keys is not None and output_keys.issubset(computed)
+
+
+def _strip_output_keys(output: JsonDict) -> JsonDict:
+  if _OUTPUT_KEYS_FIELD not in output:
+    return output
+  return utils.filter_by_keys(output, lambda k: k != _OUTPUT_KEYS_FIELD)
+
+
 class CachingModelWrapper(lit_model.Model):
-  """Wrapper to add per-example caching to a LIT model."""
+  """Wrapper to add per-example caching to a LIT model.
+
+  If secondary_cache_max_bytes is set, output fields matching secondary_types
+  (by default, attention heads and gradients) are split off into a separate,
+  small LRU cache so that they don't dominate memory use. A lookup which only
+  needs the remaining fields (see output_keys in predict_with_metadata()) can
+  be served even if the secondary fields have been evicted; otherwise, the
+  model is re-run to recompute them.
+
+  If the model supports it (see Model.supports_output_keys()), a request for
+  only some output fields runs the model for just those fields, e.g. without
+  a backward pass for gradients. Such entries record the fields they cover,
+  and are merged with the fields computed by later requests.
+
+  If cache_dir is set, all outputs are also written through to a DiskPredsStore
+  as they are computed, and looked up there on a miss in memory. Fixed-width
+  Embeddings fields are additionally stored in one ArrayColumn per (dataset,
+  field), so that a whole dataset's embeddings can be read as a single matrix;
+  see get_embedding_matrix().
+  """
 
   def __init__(self,
                model: lit_model.Model,
                name: Text,
-               cache_dir: Optional[Text] = None):
+               cache_dir: Optional[Text] = None,
+               cache_max_bytes: Optional[int] = None,
+               cache_num_shards: int = DEFAULT_NUM_SHARDS,
+               secondary_cache_max_bytes: Optional[int] = None,
+               secondary_types: Tuple[Type[types.LitType],
+                                      ...] = DEFAULT_SECONDARY_TYPES):
     """Wrap a model to add caching.
 
     Args:
       model: a LIT model
       name: name, used for logging and data files
-      cache_dir: if given, will load/save data to disk
+      cache_dir: if given, will persist outputs to disk and read them back
+      cache_max_bytes: if given, bound the cache to approximately this many
+        bytes of model outputs, evicting least-recently-used examples.
+      cache_num_shards: number of independently-locked partitions of the
+        cache, to reduce lock contention between concurrent requests.
+      secondary_cache_max_bytes: if given, store fields of secondary_types in a
+        separate LRU cache bounded to this many bytes.
+      secondary_types: output types to store in the secondary cache.
     """
     self._log_prefix = f"CachingModelWrapper '{name:s}'"
     self._model = model
-    self._cache = PredsCache()
-    self._cache_path = None
+    self._cache = PredsCache(
+        max_bytes=cache_max_bytes, num_shards=cache_num_shards)
+    self._secondary_cache = None
+    self._secondary_keys = frozenset()
+    if secondary_cache_max_bytes:
+      self._secondary_cache = PredsCache(max_bytes=secondary_cache_max_bytes)
+      self._secondary_keys = frozenset(
+          utils.find_spec_keys(model.output_spec(), secondary_types))
+    # In-flight predictions, so that concurrent requests for the same example
+    # wait for a single model call. Maps CacheKey -> (Future, output keys being
+    # computed, or None for all of them).
+    self._pending_lock = threading.Lock()
+    self._pending = {}
+    self._num_completed = 0  # model calls finished, guarded by _pending_lock
+    self._store = None
+    # Pickle file written by older versions, whose entries can't be re-used.
+    self._legacy_cache_path = None
+    self._columns_dir = None
+    self._columns_lock = threading.Lock()
+    self._columns = {}  # (dataset_name, field_name) -> ArrayColumn
+    self._column_fields = utils.find_spec_keys(model.output_spec(),
+                                               types.Embeddings)
     if cache_dir:
-      self._cache_path = os.path.join(cache_dir, name + ".cache.pkl")
+      self._store = DiskPredsStore(
+          os.path.join(cache_dir, name + ".cache.sqlite"))
+      self._legacy_cache_path = os.path.join(cache_dir, name + ".cache.pkl")
+      self._columns_dir = os.path.join(cache_dir, name + ".columns")
     self.load_cache()
 
   def load_cache(self):
-    if not self._cache_path:
+    """Open the on-disk cache. Entries are loaded lazily, as needed."""
+    if self._store is None:
       logging.info("%s: no cache path specified, not loading.",
                    self._log_prefix)
       return
 
-    if not os.path.exists(self._cache_path):
-      logging.info("%s: cache file %s does not exist, not loading.",
-                   self._log_prefix, self._cache_path)
-      return
-
-    logging.info("%s: loading from %s", self._log_prefix, self._cache_path)
-    self._cache.load_from_disk(self._cache_path)
+    logging.info("%s: using on-disk cache at %s", self._log_prefix,
+                 self._store.path)
+    if os.path.exists(self._legacy_cache_path):
+      # Its entries are keyed by md5 example ids, which input_hash() no longer
+      # produces, so loading it would only cost time and memory.
+      logging.warning("%s: ignoring legacy cache file %s; it can be deleted.",
+                      self._log_prefix, self._legacy_cache_path)
 
   def save_cache(self):
-    if not self._cache_path:
+    """Log cache status. Outputs are already written to disk as computed."""
+    if self._store is None:
       logging.info("%s: no cache path specified, not saving.", self._log_prefix)
       return
 
-    logging.info("%s: saving to %s", self._log_prefix, self._cache_path)
-    self._cache.save_to_disk(self._cache_path)
+    logging.info("%s: %d entries in on-disk cache %s", self._log_prefix,
+                 len(self._store), self._store.path)
+
+  def cache_stats(self) -> Dict[Text, int]:
+    """Return hit/miss/eviction counters for the predictions cache."""
+    stats = self._cache.stats()
+    if self._secondary_cache is not None:
+      for k, v in self._secondary_cache.stats().items():
+        stats["secondary_" + k] = v
+    if self._store is not None:
+      for k, v in self._store.stats().items():
+        stats["disk_" + k] = v
+    return stats
+
+  def _column(self, dataset_name: Text, field_name: Text) -> ArrayColumn:
+    """Get or create the ArrayColumn for a (dataset, field) pair."""
+    key = (dataset_name, field_name)
+    with self._columns_lock:
+      if key not in self._columns:
+        dirname = os.path.join(self._columns_dir, _safe_filename(dataset_name))
+        os.makedirs(dirname, exist_ok=True)
+        self._columns[key] = ArrayColumn(
+            os.path.join(dirname, _safe_filename(field_name)))
+      return self._columns[key]
+
+  def _cache_put_many(self, outputs: List[JsonDict], keys: List[CacheKey]):
+    """Store model outputs in memory, and write through to disk if enabled."""
+    for output, key in zip(outputs, keys):
+      self._memory_put(output, key)
+    if self._store is not None:
+      self._store.put_many(zip(keys, outputs))
+    if self._columns_dir is not None:
+      for field_name in self._column_fields:
+        rows_by_dataset = collections.defaultdict(lambda: ([], []))
+        for output, key in zip(outputs, keys):
+          if key is None or not isinstance(output.get(field_name), np.ndarray):
+            continue
+          ids, arrays = rows_by_dataset[key[0]]
+          ids.append(key[1])
+          arrays.append(output[field_name])
+        for dataset_name, (ids, arrays) in rows_by_dataset.items():
+          self._column(dataset_name, field_name).append(ids, arrays)
+
+  def get_embedding_matrix(
+      self, dataset_name: Text, field_name: Text,
+      indexed_inputs: List[JsonDict]) -> Optional[np.ndarray]:
+    """Return cached embeddings for a list of inputs, as a single matrix.
+
+    Args:
+      dataset_name: name of the dataset, as passed to predict_with_metadata().
+        If None, the cache is bypassed, as in predict_with_metadata().
+      field_name: name of an Embeddings field in the output spec
+      indexed_inputs: inputs, with ids
+
+    Returns:
+      <float>[len(indexed_inputs), emb_dim], backed by a memory-mapped file
+      where possible, or None if the on-disk cache is disabled or is missing
+      any of the inputs.
+    """
+    if (self._columns_dir is None or dataset_name is None or
+        field_name not in self._column_fields):
+      return None
+    column = self._column(dataset_name, field_name)
+    return column.get_rows([d["id"] for d in indexed_inputs])
+
+  def _cache_get(self, key: CacheKey,
+                 output_keys: Optional[frozenset]) -> Optional[JsonDict]:
+    """Look up model output in memory, falling back to the on-disk store."""
+    output = self._memory_get(key, output_keys)
+    if output is None and self._store is not None:
+      output = self._store.get(key)
+      if output is not None:
+        self._memory_put(output, key)
+    if output is None or not _covers(output, output_keys):
+      return None
+    return _strip_output_keys(output)
+
+  def _merge_partial(self, output: JsonDict, key: CacheKey) -> JsonDict:
+    """Merge a partial model output with the fields already cached for key."""
+    if key is None or _OUTPUT_KEYS_FIELD not in output:
+      return output
+    old = self._cache.peek(key)
+    if old is None:
+      return output
+    if self._secondary_cache is not None:
+      old = dict(old, **(self._secondary_cache.peek(key) or {}))
+    merged = dict(old, **output)
+    old_keys = old.get(_OUTPUT_KEYS_FIELD)
+    if old_keys is None:
+      # The old entry had every field.
+      old_keys = frozenset(self._model.output_spec())
+    # Secondary fields may have been evicted since the old entry was stored;
+    # those are no longer covered unless they were just computed.
+    evicted = self._secondary_keys - set(merged)
+    covered = (old_keys - evicted) | output[_OUTPUT_KEYS_FIELD]
+    if covered.issuperset(self._model.output_spec()):
+      del merged[_OUTPUT_KEYS_FIELD]
+    else:
+      merged[_OUTPUT_KEYS_FIELD] = frozenset(covered)
+    return merged
+
+  def _memory_put(self, output: JsonDict, key: CacheKey):
+    """Store model output, splitting off secondary fields if enabled."""
+    if self._secondary_cache is None:
+      self._cache.put(output, key)
+      return
+    is_secondary = self._secondary_keys.__contains__
+    self._cache.put(utils.filter_by_keys(output, lambda k: not is_secondary(k)),
+                    key)
+    secondary = utils.filter_by_keys(output, is_secondary)
+    if secondary:
+      self._secondary_cache.put(secondary, key)
+
+  def _memory_get(self, key: CacheKey,
+                  output_keys: Optional[frozenset]) -> Optional[JsonDict]:
+    """Look up model output, or return None if any needed fields are missing.
+
+    Args:
+      key: cache key
+      output_keys: fields needed by the caller, or None for all fields.
+
+    Returns:
+      model output, possibly restricted to a subset of fields that includes
+      output_keys, or None on a cache miss.
+    """
+    output = self._cache.get(key)
+    if output is None or self._secondary_cache is None:
+      return output
+    if output_keys is None:
+      needed = self._secondary_keys
+    else:
+      needed = self._secondary_keys & output_keys
+    secondary = self._secondary_cache.get(key) if needed else None
+    if needed and (secondary is None or not needed.issubset(secondary)):
+      return None
+    if secondary:
+      output = dict(output, **secondary)
+    return output
 
   def key_fn(self, d, group_name) -> CacheKey:
     if d["id"] == "":  # pylint: disable=g-explicit-bool-comparison
@@ -153,13 +764,12 @@ class CachingModelWrapper(lit_model.Model):
   ##
   # For internal use
   def fit_transform_with_metadata(self, indexed_inputs: List[JsonDict],
-                                  dataset_name: Text):
+                                  dataset_name: Text, **kw):
     """For use with UMAP and other preprocessing transforms."""
-    outputs = list(self._model.fit_transform_with_metadata(indexed_inputs))
+    outputs = list(
+        self._model.fit_transform_with_metadata(indexed_inputs, **kw))
     key_fn = functools.partial(self.key_fn, group_name=dataset_name)
-    with self._cache.lock:
-      for i, output in enumerate(outputs):
-        self._cache.put(output, key_fn(indexed_inputs[i]))
+    self._cache_put_many(outputs, [key_fn(d) for d in indexed_inputs])
     return outputs
 
   ##
@@ -170,6 +780,9 @@ class CachingModelWrapper(lit_model.Model):
   def get_embedding_table(self):
     return self._model.get_embedding_table()
 
+  def supports_output_keys(self):
+    return self._model.supports_output_keys()
+
   def predict_minibatch(self, *args, **kw):
     logging.warning(
         "CachingModelWrapper.predict_minibatch() bypasses the cache - if this is not intended, use predict_with_metadata() instead to access cache via example IDs."
@@ -191,8 +804,22 @@ class CachingModelWrapper(lit_model.Model):
   def predict_with_metadata(self,
                             indexed_inputs: List[JsonDict],
                             dataset_name: Optional[Text] = None,
+                            output_keys: Optional[Iterable[Text]] = None,
                             **kw) -> List[JsonDict]:
-    """As predict(), but inputs are IndexedInput."""
+    """As predict(), but inputs are IndexedInput.
+
+    Args:
+      indexed_inputs: inputs, with ids
+      dataset_name: name of the dataset, used as part of the cache key. If None,
+        the cache is bypassed.
+      output_keys: if given, only these output fields are required, and cached
+        results missing other fields may be returned. If the model supports
+        it, only these fields are computed on a cache miss.
+      **kw: unused
+
+    Returns:
+      list of model outputs, one per input
+    """
     # TODO(lit-dev): consider moving this to example level
     # (null keys skip cache), and removing this codepath.
     if dataset_name is None:
@@ -201,27 +828,215 @@ class CachingModelWrapper(lit_model.Model):
       return results
 
     key_fn = functools.partial(self.key_fn, group_name=dataset_name)
+    if output_keys is not None:
+      output_keys = frozenset(output_keys)
+    # Fields to compute on a miss; None for all of them.
+    model_output_keys = None
+    if (self._model.supports_output_keys() and output_keys is not None and
+        not output_keys.issuperset(self.output_spec())):
+      model_output_keys = output_keys
 
     # Try to get results from the cache.
-    with self._cache.lock:
-      results = [self._cache.get(key_fn(d)) for d in indexed_inputs]
+    num_completed = self._num_completed
+    results = [self._cache_get(key_fn(d), output_keys) for d in indexed_inputs]
     miss_idxs = [i for i, v in enumerate(results) if v is None]
     logging.info("%s: misses (dataset=%s): %s", self._log_prefix, dataset_name,
                  str([indexed_inputs[i]["id"] for i in miss_idxs]))
     logging.info("%s: %d misses out of %d inputs", self._log_prefix,
                  len(miss_idxs), len(results))
 
+    # If another request is already computing some of these, wait for it rather
+    # than running the model again. Claim the rest for this request, unless
+    # another request is computing a different set of fields for them.
+    model_idxs = []
+    model_futures = []
+    waiting = []  # (orig_idx, future)
+    with self._pending_lock:
+      for i in miss_idxs:
+        key = key_fn(indexed_inputs[i])
+        if key in self._pending:
+          future, pending_keys = self._pending[key]
+          if pending_keys is None or (output_keys is not None and
+                                      output_keys.issubset(pending_keys)):
+            waiting.append((i, future))
+          else:
+            # Computing other fields; run the model for these ones as well.
+            model_idxs.append(i)
+            model_futures.append(None)
+          continue
+        future = None
+        if key is not None:
+          # Another request may have finished since we checked the cache.
+          if self._num_completed != num_completed:
+            results[i] = self._cache_get(key, output_keys)
+            if results[i] is not None:
+              continue
+          future = concurrent.futures.Future()
+          self._pending[key] = (future, model_output_keys)
+        model_idxs.append(i)
+        model_futures.append(future)
+    if waiting:
+      logging.info("%s: waiting on %d in-flight predictions", self._log_prefix,
+                   len(waiting))
+
     # Make a single list of everything that wasn't found in the cache,
     # and actually run the model on these inputs.
-    model_inputs = [indexed_inputs[i] for i in miss_idxs]
+    model_inputs = [indexed_inputs[i] for i in model_idxs]
+    model_keys = [key_fn(d) for d in model_inputs]
     logging.info("Prepared %d inputs for model", len(model_inputs))
-    model_preds = list(self._model.predict_with_metadata(model_inputs))
-    logging.info("Received %d predictions from model", len(model_preds))
+    try:
+      if model_output_keys is None:
+        model_preds = list(self._model.predict_with_metadata(model_inputs))
+      else:
+        model_preds = list(
+            self._model.predict_with_metadata(
+                model_inputs, output_keys=model_output_keys))
+      logging.info("Received %d predictions from model", len(model_preds))
 
-    # Merge results back into the output list.
-    with self._cache.lock:
-      for i, orig_idx in enumerate(miss_idxs):
-        self._cache.put(model_preds[i], key_fn(indexed_inputs[orig_idx]))
+      # Merge results back into the output list.
+      if model_output_keys is None:
+        self._cache_put_many(model_preds, model_keys)
+      else:
+        # Record which fields were computed, and keep any others we had.
+        partial_preds = []
+        for pred, key in zip(model_preds, model_keys):
+          computed = model_output_keys | set(pred)
+          partial_preds.append(
+              self._merge_partial(dict(pred, **{_OUTPUT_KEYS_FIELD: computed}),
+                                  key))
+        self._cache_put_many(partial_preds, model_keys)
+      for i, orig_idx in enumerate(model_idxs):
         results[orig_idx] = model_preds[i]
+        if model_futures[i] is not None:
+          model_futures[i].set_result(model_preds[i])
+    except BaseException as e:
+      for future in model_futures:
+        if future is not None and not future.done():
+          future.set_exception(e)
+      raise
+    finally:
+      # Results are in the cache by now, so later requests will find them.
+      with self._pending_lock:
+        for key, future in zip(model_keys, model_futures):
+          if future is not None and self._pending[key][0] is future:
+            del self._pending[key]
+        self._num_completed += 1
+
+    for orig_idx, future in waiting:
+      results[orig_idx] = future.result()
+
+    return results
+
+
+class InterpretationCache(object):
+  """Cache for interpreter outputs, such as salience maps and metrics.
+
+  Results are grouped by interpreter, model, dataset, and a hash of the config.
+  Per-example interpreters (see Interpreter.is_per_example()) are cached for
+  each input id, so that a request which overlaps an earlier one only runs on
+  the new inputs. Other interpreters are cached for the request as a whole,
+  keyed by a hash of all of the input ids.
 
+  If cache_dir is set, results are also written through to a DiskPredsStore
+  and looked up there on a miss in memory, as in CachingModelWrapper.
+  """
+
+  def __init__(self,
+               cache_dir: Optional[Text] = None,
+               max_bytes: Optional[int] = None):
+    self._cache = PredsCache(max_bytes=max_bytes, num_shards=DEFAULT_NUM_SHARDS)
+    self._store = None
+    if cache_dir:
+      self._store = DiskPredsStore(
+          os.path.join(cache_dir, "interpretations.cache.sqlite"))
+
+  def stats(self) -> Dict[Text, int]:
+    """Return hit/miss/eviction counters, for monitoring."""
+    stats = self._cache.stats()
+    if self._store is not None:
+      for k, v in self._store.stats().items():
+        stats["disk_" + k] = v
+    return stats
+
+  def _get(self, key: CacheKey) -> Optional[Any]:
+    value = self._cache.get(key)
+    if value is None and self._store is not None:
+      value = self._store.get(key)
+      if value is not None:
+        self._cache.put(value, key)
+    return value
+
+  def _put_many(self, items: List[Tuple[CacheKey, Any]]):
+    for key, value in items:
+      self._cache.put(value, key)
+    if self._store is not None:
+      self._store.put_many(items)
+
+  def run_with_metadata(self,
+                        interpreter: lit_components.Interpreter,
+                        interpreter_name: Text,
+                        model_name: Text,
+                        dataset_name: Optional[Text],
+                        indexed_inputs: List[JsonDict],
+                        model: lit_model.Model,
+                        dataset: lit_dataset.Dataset,
+                        model_outputs: Optional[List[JsonDict]] = None,
+                        config: Optional[JsonDict] = None):
+    """Run an interpreter, re-using cached results where possible.
+
+    Args:
+      interpreter: the interpreter to run
+      interpreter_name: name of the interpreter, used as part of the cache key
+      model_name: name of the model, used as part of the cache key
+      dataset_name: name of the dataset, used as part of the cache key. If
+        None, the cache is bypassed.
+      indexed_inputs: inputs, with ids
+      model: passed to the interpreter
+      dataset: passed to the interpreter
+      model_outputs: passed to the interpreter, subset as needed
+      config: passed to the interpreter, and hashed as part of the cache key
+
+    Returns:
+      output of interpreter.run_with_metadata()
+    """
+    run_fn = functools.partial(
+        interpreter.run_with_metadata, model=model, dataset=dataset)
+    if dataset_name is None or not interpreter.is_cacheable():
+      return run_fn(
+          indexed_inputs, model_outputs=model_outputs, config=config)
+
+    group_name = ":".join(
+        [interpreter_name, model_name, dataset_name, input_hash(config)])
+    ids = [d.get("id") for d in indexed_inputs]
+
+    if not interpreter.is_per_example():
+      key = (group_name, input_hash(ids)) if all(ids) else None
+      result = self._get(key)
+      if result is None:
+        result = run_fn(
+            indexed_inputs, model_outputs=model_outputs, config=config)
+        if result is not None:
+          self._put_many([(key, result)])
+      return result
+
+    keys = [(group_name, i) if i else None for i in ids]
+    results = [self._get(key) for key in keys]
+    miss_idxs = [i for i, v in enumerate(results) if v is None]
+    logging.info("InterpretationCache '%s': %d misses out of %d inputs",
+                 group_name, len(miss_idxs), len(results))
+    if not miss_idxs:
+      return results
+    miss_outputs = None
+    if model_outputs is not None:
+      miss_outputs = [model_outputs[i] for i in miss_idxs]
+    miss_results = run_fn([indexed_inputs[i] for i in miss_idxs],
+                          model_outputs=miss_outputs,
+                          config=config)
+    if miss_results is None:
+      return None
+    for i, result in zip(miss_idxs, miss_results):
+      results[i] = result
+    self._put_many([(keys[i], results[i])
+                    for i in miss_idxs
+                    if results[i] is not None])
     return results
@@ -15,14 +15,37 @@
 # Lint as: python3
 """Tests for lit_nlp.lib.model."""
 
+import os
+import tempfile
+import threading
+import time
+
 from absl.testing import absltest
 
+from lit_nlp.api import components as lit_components
+from lit_nlp.api import types
 from lit_nlp.lib import caching
 from lit_nlp.lib import testing_utils
+import numpy as np
 
 
 class CachingTest(absltest.TestCase):
 
+  def _make_tempdir(self):
+    tempdir = tempfile.TemporaryDirectory()
+    self.addCleanup(tempdir.cleanup)
+    return tempdir.name
+
+  def test_input_hash(self):
+    """Test that hashes are independent of key order, but not of values."""
+    self.assertEqual(
+        caching.input_hash({"a": "foo", "b": 1}),
+        caching.input_hash({"b": 1, "a": "foo"}))
+    self.assertNotEqual(
+        caching.input_hash({"a": "foo", "b": 1}),
+        caching.input_hash({"a": "foo", "b": 2}))
+    self.assertLen(caching.input_hash({"a": "foo"}), 32)
+
   def test_preds_cache(self):
     """Test with an exact match."""
     cache = caching.PredsCache()
@@ -33,6 +56,52 @@ class CachingTest(absltest.TestCase):
     self.assertEqual("1", cache.info())
     self.assertIsNone(None, cache.get(("a", "2")))
     self.assertEqual("test", cache.get(("a", "1")))
+    # peek() isn't counted in the stats.
+    self.assertEqual("test", cache.peek(("a", "1")))
+    self.assertIsNone(cache.peek(("a", "2")))
+    self.assertEqual(1, cache.stats()["hits"])
+    self.assertEqual(1, cache.stats()["misses"])
+
+  def test_preds_cache_lru_eviction(self):
+    """Test that a bounded cache evicts least-recently-used entries."""
+    entry_bytes = np.zeros(10, dtype=np.float32).nbytes
+    cache = caching.PredsCache(max_bytes=2 * entry_bytes)
+    cache.put({"emb": np.zeros(10, dtype=np.float32)}, ("a", "1"))
+    cache.put({"emb": np.zeros(10, dtype=np.float32)}, ("a", "2"))
+    # Touch the first entry, so that the second one is least-recently used.
+    self.assertIsNotNone(cache.get(("a", "1")))
+    cache.put({"emb": np.zeros(10, dtype=np.float32)}, ("a", "3"))
+    self.assertEqual("2", cache.info())
+    self.assertIsNotNone(cache.get(("a", "1")))
+    self.assertIsNone(cache.get(("a", "2")))
+    self.assertIsNotNone(cache.get(("a", "3")))
+    stats = cache.stats()
+    self.assertEqual(1, stats["evictions"])
+    self.assertEqual(3, stats["hits"])
+    self.assertEqual(1, stats["misses"])
+    self.assertEqual(2 * entry_bytes, stats["bytes"])
+
+  def test_preds_cache_overwrite(self):
+    """Test that re-inserting a key doesn't double-count its size."""
+    cache = caching.PredsCache(max_bytes=1000)
+    cache.put({"emb": np.zeros(10, dtype=np.float32)}, ("a", "1"))
+    cache.put({"emb": np.zeros(20, dtype=np.float32)}, ("a", "1"))
+    self.assertEqual("1", cache.info())
+    self.assertEqual(80, cache.stats()["bytes"])
+
+  def test_preds_cache_sharded(self):
+    """Test that a sharded cache behaves like a single one."""
+    cache = caching.PredsCache(num_shards=4)
+    for i in range(20):
+      cache.put({"val": i}, ("a", str(i)))
+    self.assertEqual("20", cache.info())
+    self.assertLen(list(cache.items()), 20)
+    for i in range(20):
+      self.assertEqual({"val": i}, cache.get(("a", str(i))))
+    self.assertIsNone(cache.get(("a", "missing")))
+    stats = cache.stats()
+    self.assertEqual(20, stats["hits"])
+    self.assertEqual(1, stats["misses"])
 
   def test_caching_model_wrapper_no_dataset_skip_cache(self):
     model = testing_utils.TestIdentityRegressionModel()
@@ -55,6 +124,9 @@ class CachingTest(absltest.TestCase):
     results = wrapper.predict_with_metadata(examples, "dataset")
     self.assertEqual(1, model.count)
     self.assertEqual({"score": 1}, results[0])
+    stats = wrapper.cache_stats()
+    self.assertEqual(1, stats["hits"])
+    self.assertEqual(1, stats["misses"])
 
   def test_caching_model_wrapper_not_cached(self):
     model = testing_utils.TestIdentityRegressionModel()
@@ -102,6 +174,302 @@ class CachingTest(absltest.TestCase):
     self.assertEqual({"score": 1}, results[1])
     self.assertEqual({"score": 2}, results[2])
 
+  def test_caching_model_wrapper_secondary_cache(self):
+    model = testing_utils.TestIdentityRegressionModel()
+    # Treat "score" as a heavy field, and keep at most one entry for it.
+    wrapper = caching.CachingModelWrapper(
+        model,
+        "test",
+        secondary_cache_max_bytes=1,
+        secondary_types=(types.RegressionScore,))
+    examples = [
+        {"data": {"val": 1}, "id": "first_id"},
+        {"data": {"val": 2}, "id": "second_id"},
+    ]
+    results = wrapper.predict_with_metadata(examples, "dataset")
+    self.assertEqual(2, model.count)
+    self.assertEqual([{"score": 1}, {"score": 2}], results)
+    # Requests which don't need the heavy field are served from the cache.
+    results = wrapper.predict_with_metadata(examples, "dataset", output_keys=[])
+    self.assertEqual(2, model.count)
+    # The heavy field was evicted for the first example, so it is recomputed.
+    results = wrapper.predict_with_metadata(examples, "dataset")
+    self.assertEqual(3, model.count)
+    self.assertEqual([{"score": 1}, {"score": 2}], results)
+    self.assertEqual(2, wrapper.cache_stats()["secondary_evictions"])
+
+  def test_caching_model_wrapper_output_keys(self):
+    model = testing_utils.TestOutputKeysModel()
+    wrapper = caching.CachingModelWrapper(model, "test")
+    examples = [{"data": {"val": i}, "id": f"id_{i}"} for i in range(2)]
+    # Cheap request: the expensive field isn't computed.
+    results = wrapper.predict_with_metadata(
+        examples, "dataset", output_keys=["score"])
+    self.assertEqual([{"score": 0}, {"score": 1}], results)
+    self.assertEqual([frozenset(["score"])], model.requests)
+    # Served from the cache.
+    wrapper.predict_with_metadata(examples, "dataset", output_keys=["score"])
+    self.assertLen(model.requests, 1)
+    # Needs a field which isn't cached, so the model runs for it, and the
+    # cache merges it with the fields from the first call.
+    stats = wrapper.cache_stats()
+    results = wrapper.predict_with_metadata(
+        examples[:1], "dataset", output_keys=["expensive"])
+    # Merging doesn't count as a lookup; only the initial one does.
+    self.assertEqual(stats["hits"] + 1, wrapper.cache_stats()["hits"])
+    self.assertEqual(stats["misses"], wrapper.cache_stats()["misses"])
+    self.assertEqual([{"score": 0, "expensive": 0}], results)
+    self.assertEqual(frozenset(["expensive"]), model.requests[-1])
+    results = wrapper.predict_with_metadata(
+        examples[:1], "dataset", output_keys=["score", "expensive"])
+    self.assertEqual([{"score": 0, "expensive": 0}], results)
+    self.assertLen(model.requests, 2)
+    # A request for all fields only re-runs examples which lack some of them.
+    results = wrapper.predict_with_metadata(examples, "dataset")
+    self.assertEqual({"score": 1, "expensive": 2}, results[1])
+    self.assertEqual([None], model.requests[2:])
+    self.assertLen(model.requests, 3)
+
+  def test_caching_model_wrapper_output_keys_secondary_evicted(self):
+
+    class TwoHeavyFieldsModel(testing_utils.TestOutputKeysModel):
+
+      def output_spec(self):
+        return {
+            "score": types.RegressionScore(),
+            "heavy": types.TokenGradients(),
+            "grad": types.TokenGradients()
+        }
+
+      def predict_minibatch(self, inputs, output_keys=None):
+        self.requests.append(output_keys)
+        results = [{"score": x["val"]} for x in inputs]
+        for result in results:
+          if output_keys is None or "heavy" in output_keys:
+            result["heavy"] = 2 * result["score"]
+          if output_keys is None or "grad" in output_keys:
+            result["grad"] = 3 * result["score"]
+        return results
+
+    model = TwoHeavyFieldsModel()
+    # Keep the secondary (gradient) fields for at most one example.
+    wrapper = caching.CachingModelWrapper(
+        model,
+        "test",
+        cache_dir=self._make_tempdir(),
+        secondary_cache_max_bytes=1)
+    examples = [{"data": {"val": i}, "id": f"id_{i}"} for i in range(1, 3)]
+    wrapper.predict_with_metadata(examples, "dataset", output_keys=["heavy"])
+    # Reading each example back from disk evicts the previous one's heavy
+    # field from memory, before the model's outputs are merged with them.
+    results = wrapper.predict_with_metadata(
+        examples, "dataset", output_keys=["grad"])
+    self.assertEqual([{"score": 1, "grad": 3}, {"score": 2, "grad": 6}],
+                     results)
+    self.assertLen(model.requests, 2)
+    # The merged entry doesn't claim the field it lacks, so it is recomputed
+    # rather than returned without it.
+    results = wrapper.predict_with_metadata(
+        examples[:1], "dataset", output_keys=["heavy"])
+    self.assertEqual(2, results[0]["heavy"])
+    self.assertEqual(frozenset(["heavy"]), model.requests[-1])
+
+  def test_disk_preds_store(self):
+    path = os.path.join(self._make_tempdir(), "test.cache.sqlite")
+    store = caching.DiskPredsStore(path)
+    self.assertEqual(0, len(store))
+    store.put({"emb": np.arange(3, dtype=np.float32)}, ("a", "1"))
+    store.put_many([(("a", "2"), {"score": 2}), (None, {"score": 3})])
+    self.assertLen(store, 2)
+    np.testing.assert_array_equal([0, 1, 2], store.get(("a", "1"))["emb"])
+    self.assertEqual(np.float32, store.get(("a", "1"))["emb"].dtype)
+    self.assertEqual({"score": 2}, store.get(("a", "2")))
+    self.assertIsNone(store.get(("b", "1")))
+    store.close()
+    # Re-open; entries should be persisted.
+    store = caching.DiskPredsStore(path)
+    self.assertEqual({"score": 2}, store.get(("a", "2")))
+
+  def test_caching_model_wrapper_write_through(self):
+    cache_dir = self._make_tempdir()
+    model = testing_utils.TestIdentityRegressionModel()
+    wrapper = caching.CachingModelWrapper(model, "test", cache_dir=cache_dir)
+    examples = [{"data": {"val": 1}, "id": "my_id"}]
+    wrapper.predict_with_metadata(examples, "dataset")
+    self.assertEqual(1, model.count)
+    # A new wrapper (e.g. after a restart) reads the entry back from disk,
+    # without needing save_cache().
+    model = testing_utils.TestIdentityRegressionModel()
+    wrapper = caching.CachingModelWrapper(model, "test", cache_dir=cache_dir)
+    results = wrapper.predict_with_metadata(examples, "dataset")
+    self.assertEqual(0, model.count)
+    self.assertEqual({"score": 1}, results[0])
+    self.assertEqual(1, wrapper.cache_stats()["disk_hits"])
+
+  def test_caching_model_wrapper_ignores_legacy_cache(self):
+    cache_dir = self._make_tempdir()
+    legacy_cache = caching.PredsCache()
+    legacy_cache.put({"score": 0}, ("dataset", "my_id"))
+    legacy_cache.save_to_disk(os.path.join(cache_dir, "test.cache.pkl"))
+    model = testing_utils.TestIdentityRegressionModel()
+    wrapper = caching.CachingModelWrapper(model, "test", cache_dir=cache_dir)
+    examples = [{"data": {"val": 1}, "id": "my_id"}]
+    results = wrapper.predict_with_metadata(examples, "dataset")
+    self.assertEqual(1, model.count)
+    self.assertEqual({"score": 1}, results[0])
+
+  def test_array_column(self):
+    path = os.path.join(self._make_tempdir(), "emb")
+    column = caching.ArrayColumn(path)
+    self.assertIsNone(column.matrix())
+    column.append(["a", "b"], [np.zeros(3), np.ones(3)])
+    # Duplicate ids and mismatched shapes are skipped.
+    column.append(["b", "c", "d"], [np.zeros(3), np.full(3, 2.0), np.zeros(4)])
+    self.assertLen(column, 3)
+    matrix = column.matrix()
+    self.assertIsInstance(matrix, np.memmap)
+    np.testing.assert_array_equal([[0, 0, 0], [1, 1, 1], [2, 2, 2]], matrix)
+    np.testing.assert_array_equal([[2, 2, 2], [0, 0, 0]],
+                                  column.get_rows(["c", "a"]))
+    # Contiguous rows are returned as a view of the memory-mapped file.
+    self.assertIsInstance(column.get_rows(["b", "c"]), np.memmap)
+    self.assertIsNone(column.get_rows(["a", "d"]))
+    # A second reader (e.g. in another process) sees the same data.
+    np.testing.assert_array_equal(matrix, caching.ArrayColumn(path).matrix())
+
+  def test_caching_model_wrapper_embedding_matrix(self):
+    cache_dir = self._make_tempdir()
+    model = testing_utils.TestIdentityEmbeddingModel()
+    wrapper = caching.CachingModelWrapper(model, "test", cache_dir=cache_dir)
+    examples = [{"data": {"x": [i, i]}, "id": str(i)} for i in range(4)]
+    self.assertIsNone(
+        wrapper.get_embedding_matrix("dataset", "emb", examples))
+    wrapper.predict_with_metadata(examples, "dataset")
+    matrix = wrapper.get_embedding_matrix("dataset", "emb", examples)
+    np.testing.assert_array_equal([[0, 0], [1, 1], [2, 2], [3, 3]], matrix)
+    self.assertEqual(np.float32, matrix.dtype)
+    self.assertIsNone(
+        wrapper.get_embedding_matrix("other_dataset", "emb", examples))
+    # Without a dataset name the cache is bypassed, so there's no matrix.
+    wrapper.predict_with_metadata(examples)
+    self.assertIsNone(wrapper.get_embedding_matrix(None, "emb", examples))
+
+  def test_caching_model_wrapper_coalesces_concurrent_misses(self):
+    started = threading.Event()
+    release = threading.Event()
+
+    class BlockingModel(testing_utils.TestIdentityRegressionModel):
+
+      def predict(self, inputs, **kw):
+        started.set()
+        release.wait()
+        return super().predict(inputs, **kw)
+
+    model = BlockingModel()
+    wrapper = caching.CachingModelWrapper(model, "test")
+    examples = [{"data": {"val": 1}, "id": "my_id"}]
+    results = [None, None]
+
+    def run(i):
+      results[i] = wrapper.predict_with_metadata(examples, "dataset")
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(2)]
+    threads[0].start()
+    started.wait()
+    # The second request should wait on the first one's model call.
+    threads[1].start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+      t.join()
+    self.assertEqual(1, model.count)
+    self.assertEqual([[{"score": 1}], [{"score": 1}]], results)
+
+  def test_caching_model_wrapper_propagates_errors(self):
+
+    class FailingModel(testing_utils.TestIdentityRegressionModel):
+
+      def predict(self, inputs, **kw):
+        raise ValueError("model failed")
+
+    wrapper = caching.CachingModelWrapper(FailingModel(), "test")
+    examples = [{"data": {"val": 1}, "id": "my_id"}]
+    with self.assertRaises(ValueError):
+      wrapper.predict_with_metadata(examples, "dataset")
+    # Failed predictions aren't left pending, so a retry runs the model again.
+    with self.assertRaises(ValueError):
+      wrapper.predict_with_metadata(examples, "dataset")
+
+  def test_interpretation_cache(self):
+
+    class ScaleInterpreter(lit_components.Interpreter):
+
+      def __init__(self, per_example):
+        self._per_example = per_example
+        self.calls = []
+
+      def run_with_metadata(self, indexed_inputs, model, dataset,
+                            model_outputs=None, config=None):
+        self.calls.append([d["id"] for d in indexed_inputs])
+        return [{"val": d["data"]["val"] * config["scale"]}
+                for d in indexed_inputs]
+
+      def is_per_example(self):
+        return self._per_example
+
+    cache_dir = self._make_tempdir()
+    examples = [{"data": {"val": i}, "id": str(i)} for i in range(3)]
+    for per_example in (True, False):
+      interpreter = ScaleInterpreter(per_example)
+      name = f"interpreter_{per_example}"
+
+      def run(cache, inputs, scale):
+        return cache.run_with_metadata(  # pylint: disable=cell-var-from-loop
+            interpreter, name, "model", "dataset", inputs, None, None,
+            config={"scale": scale})
+
+      cache = caching.InterpretationCache(cache_dir=cache_dir)
+      self.assertEqual([{"val": 0}, {"val": 2}], run(cache, examples[:2], 2))
+      self.assertEqual([{"val": 0}, {"val": 2}, {"val": 4}],
+                       run(cache, examples, 2))
+      # Different config, so not cached.
+      self.assertEqual([{"val": 0}, {"val": 3}], run(cache, examples[:2], 3))
+      if per_example:
+        self.assertEqual([["0", "1"], ["2"], ["0", "1"]], interpreter.calls)
+      else:
+        self.assertEqual([["0", "1"], ["0", "1", "2"], ["0", "1"]],
+                         interpreter.calls)
+
+      # Results are read back from disk by a new cache.
+      interpreter.calls = []
+      cache = caching.InterpretationCache(cache_dir=cache_dir)
+      self.assertEqual([{"val": 0}, {"val": 2}, {"val": 4}],
+                       run(cache, examples, 2))
+      self.assertEqual([], interpreter.calls)
+
+  def test_interpretation_cache_not_cacheable(self):
+
+    class StatefulInterpreter(lit_components.Interpreter):
+
+      def __init__(self):
+        self.count = 0
+
+      def run_with_metadata(self, *unused_args, **unused_kw):
+        self.count += 1
+        return self.count
+
+      def is_cacheable(self):
+        return False
+
+    interpreter = StatefulInterpreter()
+    cache = caching.InterpretationCache()
+    examples = [{"data": {"val": 1}, "id": "1"}]
+    for expected in (1, 2):
+      self.assertEqual(
+          expected,
+          cache.run_with_metadata(interpreter, "stateful", "model", "dataset",
+                                  examples, None, None))
+
 
 if __name__ == "__main__":
   absltest.main()
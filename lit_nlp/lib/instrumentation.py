@@ -0,0 +1,365 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+"""Request timing and payload-size metrics for the LIT server.
+
+Each request to a LIT endpoint is broken into phases:
+  - parse: reading URL parameters and decoding the JSON request body
+  - compute: running the endpoint function (predictions, interpretations, etc.)
+  - serialize: encoding the result as JSON
+  - respond: building the response, including compression
+
+Totals are kept per endpoint and phase, and can be exported in the Prometheus
+text format, e.g. for the /metrics endpoint.
+
+This also has a simple cProfile wrapper (Profiler) for individual calls to
+slow components, such as LIME or UMAP.
+"""
+import collections
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Text
+from typing import Tuple
+
+from absl import logging
+
+PHASES = ('parse', 'compute', 'serialize', 'respond')
+
+# Upper bounds (in seconds) of the histogram buckets for total request time.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0, 30.0, 60.0)
+
+
+class RequestTimer(object):
+  """Times the phases of a single request.
+
+  Usage:
+    timer = metrics.start('/get_preds')
+    with timer.phase('parse'):
+      ...
+    timer.finish(request_bytes=..., response_bytes=...)
+  """
+
+  def __init__(self, metrics: 'RequestMetrics', endpoint: Text):
+    self._metrics = metrics
+    self.endpoint = endpoint
+    self.start_time = time.perf_counter()
+    self.phase_seconds = collections.OrderedDict((p, 0.0) for p in PHASES)
+
+  def phase(self, name: Text) -> '_PhaseContext':
+    return _PhaseContext(self, name)
+
+  def time_chunks(self, name: Text, chunks: Iterable[bytes],
+                  **finish_kw) -> Iterator[bytes]:
+    """Time a (lazy) sequence of chunks, and finish the request when done.
+
+    This is for streamed responses, where serialization happens while the
+    response is being sent.
+
+    Args:
+      name: phase name for the time spent producing chunks
+      chunks: the chunks to time
+      **finish_kw: passed to finish()
+
+    Yields:
+      the chunks, unchanged
+    """
+    num_bytes = 0
+    iterator = iter(chunks)
+    try:
+      while True:
+        start = time.perf_counter()
+        try:
+          chunk = next(iterator)
+        except StopIteration:
+          return
+        finally:
+          self.phase_seconds[name] += time.perf_counter() - start
+        num_bytes += len(chunk)
+        yield chunk
+    finally:
+      self.finish(response_bytes=num_bytes, **finish_kw)
+
+  def finish(self,
+             request_bytes: int = 0,
+             response_bytes: int = 0,
+             error: bool = False):
+    self._metrics.record(self, request_bytes, response_bytes, error)
+
+
+class _PhaseContext(object):
+  """Context manager which adds elapsed time to a phase of a RequestTimer."""
+
+  def __init__(self, timer: RequestTimer, name: Text):
+    self._timer = timer
+    self._name = name
+    self._start = None
+
+  def __enter__(self):
+    self._start = time.perf_counter()
+    return self
+
+  def __exit__(self, *unused_exc):
+    self._timer.phase_seconds[self._name] += time.perf_counter() - self._start
+
+
+def _escape_label(value: Text) -> Text:
+  return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Mapping[Text, Text]) -> Text:
+  if not labels:
+    return ''
+  items = ','.join(f'{k}="{_escape_label(str(v))}"' for k, v in labels.items())
+  return '{' + items + '}'
+
+
+class RequestMetrics(object):
+  """Thread-safe totals of request timing and payload sizes, by endpoint."""
+
+  def __init__(self, log_requests: bool = False):
+    """Initialize metrics.
+
+    Args:
+      log_requests: if true, also log one JSON record per request with its
+        phase timings and payload sizes.
+    """
+    self._log_requests = log_requests
+    self._lock = threading.Lock()
+    self._requests = collections.Counter()  # (endpoint, status) -> count
+    self._phase_seconds = collections.Counter()  # (endpoint, phase) -> sum
+    self._request_bytes = collections.Counter()  # endpoint -> sum
+    self._response_bytes = collections.Counter()  # endpoint -> sum
+    # endpoint -> count per bucket, with a final bucket for +Inf
+    self._duration_buckets = collections.defaultdict(
+        lambda: [0] * (len(DURATION_BUCKETS) + 1))
+    self._duration_sum = collections.Counter()  # endpoint -> sum
+
+  def start(self, endpoint: Text) -> RequestTimer:
+    return RequestTimer(self, endpoint)
+
+  def record(self, timer: RequestTimer, request_bytes: int,
+             response_bytes: int, error: bool):
+    """Add the measurements from a finished request."""
+    total = time.perf_counter() - timer.start_time
+    status = 'error' if error else 'ok'
+    endpoint = timer.endpoint
+    with self._lock:
+      self._requests[(endpoint, status)] += 1
+      for phase, seconds in timer.phase_seconds.items():
+        self._phase_seconds[(endpoint, phase)] += seconds
+      self._request_bytes[endpoint] += request_bytes
+      self._response_bytes[endpoint] += response_bytes
+      buckets = self._duration_buckets[endpoint]
+      for i, bound in enumerate(DURATION_BUCKETS):
+        if total <= bound:
+          buckets[i] += 1
+          break
+      else:
+        buckets[-1] += 1
+      self._duration_sum[endpoint] += total
+    if self._log_requests:
+      record = {
+          'endpoint': endpoint,
+          'status': status,
+          'total_s': round(total, 6),
+          'request_bytes': request_bytes,
+          'response_bytes': response_bytes,
+      }
+      for phase, seconds in timer.phase_seconds.items():
+        record[phase + '_s'] = round(seconds, 6)
+      logging.info('Request metrics: %s', json.dumps(record))
+
+  def to_prometheus(
+      self,
+      extra: Optional[Iterable[Tuple[Text, Text, Text, Mapping[Text, Text],
+                                     float]]] = None
+  ) -> Text:
+    """Export metrics in the Prometheus text exposition format.
+
+    Args:
+      extra: optional additional samples, as (name, type, help, labels, value)
+
+    Returns:
+      metrics, as text
+    """
+    samples = collections.OrderedDict()  # name -> (type, help, [lines])
+
+    def add(name, metric_type, help_text, labels, value, suffix=''):
+      if name not in samples:
+        samples[name] = (metric_type, help_text, [])
+      samples[name][2].append(
+          f'{name}{suffix}{_format_labels(labels)} {value!r}')
+
+    with self._lock:
+      for (endpoint, status), count in sorted(self._requests.items()):
+        add('lit_requests_total', 'counter', 'Number of requests.', {
+            'endpoint': endpoint,
+            'status': status
+        }, count)
+      for (endpoint, phase), seconds in sorted(self._phase_seconds.items()):
+        add('lit_request_phase_seconds_total', 'counter',
+            'Time spent in each phase of handling requests.', {
+                'endpoint': endpoint,
+                'phase': phase
+            }, seconds)
+      for endpoint, buckets in sorted(self._duration_buckets.items()):
+        cumulative = 0
+        bounds = [repr(b) for b in DURATION_BUCKETS] + ['+Inf']
+        for bound, count in zip(bounds, buckets):
+          cumulative += count
+          add('lit_request_duration_seconds', 'histogram',
+              'Total time to handle requests.', {
+                  'endpoint': endpoint,
+                  'le': bound
+              }, cumulative, suffix='_bucket')
+        add('lit_request_duration_seconds', 'histogram', '',
+            {'endpoint': endpoint}, self._duration_sum[endpoint],
+            suffix='_sum')
+        add('lit_request_duration_seconds', 'histogram', '',
+            {'endpoint': endpoint}, cumulative, suffix='_count')
+      for endpoint, num_bytes in sorted(self._request_bytes.items()):
+        add('lit_request_bytes_total', 'counter', 'Size of request bodies.',
+            {'endpoint': endpoint}, num_bytes)
+      for endpoint, num_bytes in sorted(self._response_bytes.items()):
+        add('lit_response_bytes_total', 'counter',
+            'Size of response bodies, before compression.',
+            {'endpoint': endpoint}, num_bytes)
+
+    for name, metric_type, help_text, labels, value in (extra or []):
+      add(name, metric_type, help_text, labels, value)
+
+    lines: List[Text] = []
+    for name, (metric_type, help_text, sample_lines) in samples.items():
+      lines.append(f'# HELP {name} {help_text}')
+      lines.append(f'# TYPE {name} {metric_type}')
+      lines.extend(sample_lines)
+    return '\n'.join(lines) + '\n'
+
+
+def cache_samples(model_name: Optional[Text],
+                  stats: Dict[Text, int],
+                  prefix: Text = 'lit_predictions_cache',
+                  description: Text = 'Predictions cache'):
+  """Prometheus samples for the counters from CachingModelWrapper.cache_stats().
+
+  Args:
+    model_name: name of the model, or None for caches which aren't per-model
+    stats: dict of counters, with keys like 'hits' (for the in-memory cache) or
+      'disk_hits' (for other caches, by prefix)
+    prefix: prefix for the metric names
+    description: name of the cache, for the metric help text
+
+  Yields:
+    (name, type, help, labels, value) tuples, for RequestMetrics.to_prometheus
+  """
+  by_cache = collections.defaultdict(dict)
+  for key, value in stats.items():
+    cache, stat = 'memory', key
+    for stat_prefix in ('secondary_', 'disk_'):
+      if key.startswith(stat_prefix):
+        cache, stat = stat_prefix[:-1], key[len(stat_prefix):]
+    by_cache[cache][stat] = value
+  for cache, cache_stats in by_cache.items():
+    labels = {'cache': cache}
+    if model_name is not None:
+      labels = {'model': model_name, 'cache': cache}
+    for stat in ('hits', 'misses', 'evictions'):
+      if stat in cache_stats:
+        yield (f'{prefix}_{stat}_total', 'counter', f'{description} {stat}.',
+               labels, cache_stats[stat])
+    for stat in ('entries', 'bytes'):
+      if stat in cache_stats:
+        yield (f'{prefix}_{stat}', 'gauge', f'{description} {stat}.', labels,
+               cache_stats[stat])
+    lookups = cache_stats.get('hits', 0) + cache_stats.get('misses', 0)
+    if lookups:
+      yield (f'{prefix}_hit_ratio', 'gauge',
+             f'Fraction of {description.lower()} lookups which were hits.',
+             labels, cache_stats['hits'] / lookups)
+
+
+class Profiler(object):
+  """Runs functions under cProfile, and saves and logs the results.
+
+  Only one call is profiled at a time; calls made while another is being
+  profiled (e.g. from other server threads) run normally, since overlapping
+  profiles would be hard to read and not all Python versions allow them.
+  """
+
+  def __init__(self, output_dir: Optional[Text] = None, top_n: int = 25):
+    """Initialize profiler.
+
+    Args:
+      output_dir: if set, write a .prof file here for each profiled call, for
+        use with pstats or a viewer such as snakeviz.
+      top_n: number of functions to log, by cumulative time.
+    """
+    self._output_dir = output_dir
+    self._top_n = top_n
+    self._lock = threading.Lock()
+    self._num_profiles = 0  # guarded by _lock
+    if output_dir:
+      os.makedirs(output_dir, exist_ok=True)
+
+  def run(self, name: Text, fn, *args, **kw):
+    """Call fn(*args, **kw), and profile it if no other call is in progress.
+
+    Args:
+      name: name for the call, such as 'interpreter_lime', used in logs and
+        for the profile filename.
+      fn: function to call
+      *args: passed to fn
+      **kw: passed to fn
+
+    Returns:
+      the return value of fn
+    """
+    if not self._lock.acquire(blocking=False):
+      logging.info('Profiler busy; running %s without profiling.', name)
+      return fn(*args, **kw)
+    try:
+      profile = cProfile.Profile()
+      start = time.perf_counter()
+      try:
+        return profile.runcall(fn, *args, **kw)
+      finally:
+        self._report(name, profile, time.perf_counter() - start)
+    finally:
+      self._lock.release()
+
+  def _report(self, name: Text, profile: cProfile.Profile, seconds: float):
+    """Log the top functions, and save the profile if output_dir is set."""
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self._top_n)
+    logging.info('Profile of %s (%.3fs):\n%s', name, seconds,
+                 stream.getvalue())
+    if self._output_dir:
+      # The pid and a counter keep names unique between calls in the same
+      # second, and between server processes sharing output_dir.
+      self._num_profiles += 1
+      filename = '{}_{}-{:04d}_{}.prof'.format(
+          time.strftime('%Y%m%d-%H%M%S'), os.getpid(), self._num_profiles,
+          re.sub(r'[^\w.-]', '_', name))
+      path = os.path.join(self._output_dir, filename)
+      stats.dump_stats(path)
+      logging.info('Wrote profile to %s', path)
@@ -0,0 +1,88 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+"""Tests for lit_nlp.lib.instrumentation."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+
+from lit_nlp.lib import instrumentation
+
+
+class InstrumentationTest(absltest.TestCase):
+
+  def test_request_metrics(self):
+    metrics = instrumentation.RequestMetrics()
+    timer = metrics.start('/get_preds')
+    with timer.phase('compute'):
+      pass
+    timer.finish(request_bytes=10, response_bytes=20)
+    # Streamed responses are finished when the chunks run out.
+    timer = metrics.start('/get_preds')
+    chunks = list(timer.time_chunks('serialize', [b'[', b'1', b']']))
+    self.assertEqual([b'[', b'1', b']'], chunks)
+    metrics.start('/get_preds').finish(error=True)
+
+    text = metrics.to_prometheus()
+    self.assertIn('# TYPE lit_requests_total counter', text)
+    self.assertIn('lit_requests_total{endpoint="/get_preds",status="ok"} 2',
+                  text)
+    self.assertIn('lit_requests_total{endpoint="/get_preds",status="error"} 1',
+                  text)
+    self.assertIn('lit_request_bytes_total{endpoint="/get_preds"} 10', text)
+    self.assertIn('lit_response_bytes_total{endpoint="/get_preds"} 23', text)
+    self.assertIn(
+        'lit_request_duration_seconds_bucket{endpoint="/get_preds",'
+        'le="+Inf"} 3', text)
+    self.assertIn(
+        'lit_request_phase_seconds_total{endpoint="/get_preds",'
+        'phase="serialize"}', text)
+
+  def test_cache_samples(self):
+    stats = {
+        'entries': 3,
+        'bytes': 100,
+        'max_bytes': 0,
+        'hits': 3,
+        'misses': 1,
+        'evictions': 0,
+        'disk_hits': 1,
+        'disk_misses': 0,
+    }
+    samples = {(name, labels['cache']): value
+               for name, _, _, labels, value in instrumentation.cache_samples(
+                   'model', stats)}
+    self.assertEqual(3, samples[('lit_predictions_cache_hits_total', 'memory')])
+    self.assertEqual(0.75,
+                     samples[('lit_predictions_cache_hit_ratio', 'memory')])
+    self.assertEqual(1, samples[('lit_predictions_cache_hits_total', 'disk')])
+    self.assertEqual(1.0, samples[('lit_predictions_cache_hit_ratio', 'disk')])
+
+  def test_profiler(self):
+    with tempfile.TemporaryDirectory() as output_dir:
+      profiler = instrumentation.Profiler(output_dir)
+      self.assertEqual(6, profiler.run('interpreter/sum', sum, [1, 2, 3]))
+      filenames = os.listdir(output_dir)
+      self.assertLen(filenames, 1)
+      self.assertTrue(filenames[0].endswith('_interpreter_sum.prof'))
+      # Repeated calls within the same second each get their own file.
+      profiler.run('interpreter/sum', sum, [1, 2, 3])
+      self.assertLen(os.listdir(output_dir), 2)
+
+
+if __name__ == '__main__':
+  absltest.main()
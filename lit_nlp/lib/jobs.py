@@ -0,0 +1,215 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+"""Background jobs, for long-running requests such as LIME or UMAP.
+
+A JobManager runs functions on a thread pool, and keeps their status and
+results so that clients can poll for them instead of holding an HTTP request
+open. Jobs are de-duplicated by a key, so that submitting the same request
+twice re-uses the running (or finished) job.
+
+Functions running as jobs can call report_progress() to update the progress
+shown to clients, and cancel_requested() to stop early if the job has been
+cancelled. Both are no-ops outside of a job.
+"""
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Text
+import uuid
+
+from absl import logging
+
+# Job states.
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+_FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# Job running on the current thread, if any.
+_current = threading.local()
+
+
+class Job(object):
+  """State of a single job."""
+
+  def __init__(self, key: Hashable, name: Text):
+    self.id = uuid.uuid4().hex
+    self.key = key
+    self.name = name
+    self.status = PENDING
+    self.progress = None  # Optional[float], in [0, 1]
+    self.result = None
+    self.error = None  # Optional[Text]
+    self.submit_time = time.time()
+    self.start_time = None
+    self.end_time = None
+    self.cancel_event = threading.Event()
+    self.future = None  # Optional[concurrent.futures.Future]
+
+  @property
+  def finished(self) -> bool:
+    return self.status in _FINISHED_STATES
+
+  def info(self) -> Dict[Text, Any]:
+    """Job status as a JSON-serializable dict, without the result."""
+    now = self.end_time or time.time()
+    return {
+        'id': self.id,
+        'name': self.name,
+        'status': self.status,
+        'progress': self.progress,
+        'error': self.error,
+        'elapsed': now - (self.start_time or now),
+        'queued': (self.start_time or now) - self.submit_time,
+    }
+
+
+def report_progress(fraction: float):
+  """Report progress of the current job, as a fraction in [0, 1]."""
+  job = getattr(_current, 'job', None)
+  if job is not None:
+    job.progress = min(max(float(fraction), 0.0), 1.0)
+
+
+def cancel_requested() -> bool:
+  """Whether the current job has been cancelled, and should stop early."""
+  job = getattr(_current, 'job', None)
+  return job is not None and job.cancel_event.is_set()
+
+
+class JobManager(object):
+  """Runs jobs on a thread pool, and tracks their status and results.
+
+  Finished jobs are kept (with their results) until there are more than
+  max_finished_jobs of them, and then the oldest are forgotten. Failed and
+  cancelled jobs are not re-used by submit(), so a retry runs a new job.
+  """
+
+  def __init__(self, num_workers: int = 2, max_finished_jobs: int = 100):
+    self._executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=num_workers, thread_name_prefix='lit_job')
+    self._max_finished_jobs = max_finished_jobs
+    self._lock = threading.Lock()
+    self._jobs: Dict[Text, Job] = {}
+    self._jobs_by_key: Dict[Hashable, Job] = {}
+    # Finished job ids, oldest first.
+    self._finished = collections.OrderedDict()
+
+  def submit(self, key: Hashable, name: Text, fn: Callable[..., Any], *args,
+             **kw) -> Job:
+    """Run fn(*args, **kw) as a job, or return an existing job for key.
+
+    Args:
+      key: hashable key identifying the computation, used to de-duplicate
+        requests.
+      name: human-readable name, for logging and status.
+      fn: function to run
+      *args: passed to fn
+      **kw: passed to fn
+
+    Returns:
+      the new or existing Job
+    """
+    with self._lock:
+      job = self._jobs_by_key.get(key)
+      if job is not None and job.status not in (FAILED, CANCELLED):
+        return job
+      job = Job(key, name)
+      self._jobs[job.id] = job
+      self._jobs_by_key[key] = job
+      job.future = self._executor.submit(self._run, job, fn, args, kw)
+    logging.info('Submitted job %s (%s)', job.id, name)
+    return job
+
+  def _run(self, job: Job, fn, args, kw):
+    """Run a job on a worker thread, and record its outcome."""
+    if job.cancel_event.is_set():
+      # Cancelled after the worker picked it up, but before it started.
+      job.status = CANCELLED
+      job.end_time = time.time()
+      self._mark_finished(job)
+      return
+    job.status = RUNNING
+    job.start_time = time.time()
+    _current.job = job
+    try:
+      result = fn(*args, **kw)
+      if job.cancel_event.is_set():
+        job.status = CANCELLED
+      else:
+        job.result, job.progress, job.status = result, 1.0, DONE
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception('Job %s (%s) failed.', job.id, job.name)
+      job.error = '{}: {}'.format(type(e).__name__, e)
+      job.status = FAILED
+    finally:
+      _current.job = None
+      job.end_time = time.time()
+      logging.info('Job %s (%s) %s after %.3fs', job.id, job.name, job.status,
+                   job.end_time - job.start_time)
+      self._mark_finished(job)
+
+  def _mark_finished(self, job: Job):
+    with self._lock:
+      self._finished[job.id] = None
+      while len(self._finished) > self._max_finished_jobs:
+        old_id, _ = self._finished.popitem(last=False)
+        old = self._jobs.pop(old_id)
+        if self._jobs_by_key.get(old.key) is old:
+          del self._jobs_by_key[old.key]
+
+  def get(self, job_id: Text) -> Job:
+    """Get a job by id. Raises KeyError if it is unknown or expired."""
+    with self._lock:
+      if job_id not in self._jobs:
+        raise KeyError(f"Unknown job id '{job_id}'; it may have expired.")
+      return self._jobs[job_id]
+
+  def cancel(self, job_id: Text) -> Job:
+    """Cancel a job.
+
+    Pending jobs won't run. Running jobs continue until they finish or check
+    cancel_requested(), and their results are discarded.
+
+    Args:
+      job_id: id of the job to cancel
+
+    Returns:
+      the Job
+    """
+    job = self.get(job_id)
+    if job.finished:
+      return job
+    job.cancel_event.set()
+    if job.future.cancel():
+      job.status = CANCELLED
+      job.end_time = time.time()
+      self._mark_finished(job)
+    logging.info('Cancelled job %s (%s)', job.id, job.name)
+    return job
+
+  def shutdown(self, wait: bool = True):
+    """Cancel pending jobs, and stop the worker threads."""
+    with self._lock:
+      jobs = list(self._jobs.values())
+    for job in jobs:
+      if not job.finished:
+        self.cancel(job.id)
+    self._executor.shutdown(wait=wait)
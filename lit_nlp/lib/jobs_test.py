@@ -0,0 +1,88 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+"""Tests for lit_nlp.lib.jobs."""
+
+import threading
+
+from absl.testing import absltest
+
+from lit_nlp.lib import jobs
+
+
+class JobManagerTest(absltest.TestCase):
+
+  def test_submit_and_dedupe(self):
+    manager = jobs.JobManager(num_workers=1)
+    job = manager.submit('key', 'add', lambda a, b: a + b, 1, b=2)
+    job.future.result()
+    self.assertEqual(jobs.DONE, job.status)
+    self.assertEqual(3, job.result)
+    self.assertEqual(1.0, job.info()['progress'])
+    # Same key returns the finished job, without running again.
+    self.assertIs(job, manager.submit('key', 'add', lambda a, b: 0, 1, b=2))
+    self.assertIs(job, manager.get(job.id))
+    manager.shutdown()
+
+  def test_failure(self):
+    manager = jobs.JobManager(num_workers=1)
+    job = manager.submit('key', 'fail', lambda: 1 / 0)
+    job.future.result()
+    self.assertEqual(jobs.FAILED, job.status)
+    self.assertIn('ZeroDivisionError', job.error)
+    # Failed jobs are retried.
+    self.assertIsNot(job, manager.submit('key', 'fail', lambda: 1 / 0))
+    manager.shutdown()
+
+  def test_cancel_and_progress(self):
+    manager = jobs.JobManager(num_workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def _work():
+      jobs.report_progress(0.5)
+      started.set()
+      release.wait()
+      return 'stopped' if jobs.cancel_requested() else 'finished'
+
+    running = manager.submit('running', 'work', _work)
+    pending = manager.submit('pending', 'work', _work)
+    started.wait()
+    self.assertEqual(jobs.RUNNING, running.status)
+    self.assertEqual(0.5, running.progress)
+    self.assertEqual(jobs.PENDING, pending.status)
+
+    manager.cancel(pending.id)
+    self.assertEqual(jobs.CANCELLED, pending.status)
+    manager.cancel(running.id)
+    release.set()
+    running.future.result()
+    self.assertEqual(jobs.CANCELLED, running.status)
+    self.assertIsNone(running.result)
+    manager.shutdown()
+
+  def test_expiry(self):
+    manager = jobs.JobManager(num_workers=1, max_finished_jobs=1)
+    first = manager.submit(1, 'one', lambda: 1)
+    first.future.result()
+    second = manager.submit(2, 'two', lambda: 2)
+    second.future.result()
+    with self.assertRaises(KeyError):
+      manager.get(first.id)
+    self.assertIs(second, manager.get(second.id))
+    manager.shutdown()
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,185 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+"""Data-parallel inference, with a model replica in each worker process.
+
+ParallelModelWrapper runs predict() on a pool of processes, so that inference
+on a large dataset (e.g. LitApp warm-start) can use all of the cores of a
+machine, rather than one predict_minibatch() call at a time. It implements the
+LIT model API, so it can be used anywhere a model is, including inside
+CachingModelWrapper.
+"""
+import collections
+import concurrent.futures
+import multiprocessing
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Text
+
+from absl import logging
+
+from lit_nlp.api import model as lit_model
+from lit_nlp.api import types
+
+JsonDict = types.JsonDict
+
+# Model replica for the current worker process; set by _init_worker().
+_worker_model = None
+
+
+def _init_worker(model_fn: Callable[[], lit_model.Model]):
+  global _worker_model
+  _worker_model = model_fn()
+
+
+def _call_worker_model(method_name: Text, *args, **kw) -> Any:
+  """Call a method of the model replica in this worker process."""
+  return getattr(_worker_model, method_name)(*args, **kw)
+
+
+def _predict_on_worker(method_name: Text, inputs: List[JsonDict],
+                       kw) -> List[JsonDict]:
+  """Run predict() or predict_minibatch() on this worker's model replica."""
+  # Outputs may be a generator, which can't be sent back to the parent.
+  return list(getattr(_worker_model, method_name)(inputs, **kw))
+
+
+class ParallelModelWrapper(lit_model.Model):
+  """Wrapper to run a LIT model on a pool of worker processes.
+
+  Each worker loads its own replica of the model by calling model_fn. Inputs
+  to predict() are split into shards of shard_size examples, which run on the
+  workers in parallel, and the outputs are returned in input order. Within a
+  shard, the replica's own predict() does the minibatching.
+
+  model_fn is sent to the workers, so it must be picklable: for example a
+  model class, or a functools.partial() of one with its arguments. Workers are
+  started with the 'spawn' method by default, since forking a process which
+  has already started TensorFlow or PyTorch threads is unsafe.
+
+  Each replica uses its own memory, so num_workers is limited by RAM (or
+  accelerator memory). Frameworks which use a thread pool per process should
+  also be limited to about (num cores / num_workers) threads each, e.g. with
+  tf.config.threading.set_intra_op_parallelism_threads() in model_fn.
+  """
+
+  def __init__(self,
+               model_fn: Callable[[], lit_model.Model],
+               num_workers: Optional[int] = None,
+               shard_size: Optional[int] = None,
+               start_method: Text = "spawn"):
+    """Start the worker pool, and load a model replica in each worker.
+
+    Args:
+      model_fn: picklable function which returns a LIT model
+      num_workers: number of worker processes; defaults to the number of CPUs.
+      shard_size: number of inputs to send to a worker at a time. Defaults to
+        the model's max_minibatch_size().
+      start_method: multiprocessing start method for the workers.
+    """
+    self._num_workers = num_workers or multiprocessing.cpu_count()
+    self._executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=self._num_workers,
+        mp_context=multiprocessing.get_context(start_method),
+        initializer=_init_worker,
+        initargs=(model_fn,))
+    # These are needed to plan work in this process, so fetch them once.
+    self._input_spec = self._call("input_spec")
+    self._output_spec = self._call("output_spec")
+    self._max_minibatch_size = self._call("max_minibatch_size")
+    self._supports_output_keys = self._call("supports_output_keys")
+    self._shard_size = shard_size or self._max_minibatch_size
+    logging.info("ParallelModelWrapper: %d workers, %d inputs per shard",
+                 self._num_workers, self._shard_size)
+
+  def _call(self, method_name: Text, *args, **kw) -> Any:
+    """Call a model method on one of the workers, and wait for the result."""
+    return self._executor.submit(_call_worker_model, method_name, *args,
+                                 **kw).result()
+
+  def shutdown(self, wait: bool = True):
+    """Stop the worker processes."""
+    self._executor.shutdown(wait=wait)
+
+  ##
+  # LIT model API implementation.
+  def max_minibatch_size(self, config=None):
+    if config is None:
+      return self._max_minibatch_size
+    return self._call("max_minibatch_size", config=config)
+
+  def supports_output_keys(self):
+    return self._supports_output_keys
+
+  def input_spec(self):
+    return self._input_spec
+
+  def output_spec(self):
+    return self._output_spec
+
+  def get_embedding_table(self):
+    return self._call("get_embedding_table")
+
+  def predict_minibatch(self, inputs: List[JsonDict], **kw):
+    return self._executor.submit(_predict_on_worker, "predict_minibatch",
+                                 inputs, kw).result()
+
+  def predict(self,
+              inputs: Iterable[JsonDict],
+              scrub_arrays=True,
+              **kw) -> Iterator[JsonDict]:
+    """Run prediction on a dataset, in parallel on the worker processes.
+
+    Args:
+      inputs: iterable of input dicts
+      scrub_arrays: unused; outputs are copied from the workers, so they never
+        share memory with intermediate arrays.
+      **kw: additional kwargs passed to the replicas' predict()
+
+    Returns:
+      model outputs, for each input
+    """
+    del scrub_arrays
+    return self._parallel_predict(inputs, kw)
+
+  def _parallel_predict(self, inputs: Iterable[JsonDict],
+                        kw) -> Iterator[JsonDict]:
+    """Run shards on the workers, and yield their outputs in order."""
+    # Keep every worker busy, plus one queued shard each so that a worker can
+    # start on its next shard while this process unpickles the last one.
+    max_in_flight = 2 * self._num_workers
+    in_flight = collections.deque()
+    try:
+      for shard in self._minibatches_of_size(inputs, self._shard_size):
+        in_flight.append(
+            self._executor.submit(_predict_on_worker, "predict", shard, kw))
+        while len(in_flight) >= max_in_flight:
+          yield from in_flight.popleft().result()
+      while in_flight:
+        yield from in_flight.popleft().result()
+    finally:
+      # On error, or if the consumer stops early, don't start any more work.
+      for future in in_flight:
+        future.cancel()
+
+  @staticmethod
+  def _minibatches_of_size(inputs: Iterable[JsonDict],
+                           size: int) -> Iterator[List[JsonDict]]:
+    shard = []
+    for ex in inputs:
+      shard.append(ex)
+      if len(shard) >= size:
+        yield shard
+        shard = []
+    if shard:
+      yield shard
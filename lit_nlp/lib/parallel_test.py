@@ -0,0 +1,62 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+"""Tests for lit_nlp.lib.parallel."""
+
+from absl.testing import absltest
+
+from lit_nlp.lib import caching
+from lit_nlp.lib import parallel
+from lit_nlp.lib import testing_utils
+
+
+class ParallelModelWrapperTest(absltest.TestCase):
+
+  def test_predict(self):
+    wrapper = parallel.ParallelModelWrapper(
+        testing_utils.TestModelBatched, num_workers=2)
+    self.addCleanup(wrapper.shutdown)
+    self.assertEqual(3, wrapper.max_minibatch_size())
+    self.assertEqual(['value'], list(wrapper.input_spec()))
+    inputs = [{'value': i} for i in range(20)]
+    self.assertEqual([{'scores': i} for i in range(20)],
+                     list(wrapper.predict(inputs)))
+    self.assertEqual([{'scores': 1}], wrapper.predict_minibatch(inputs[1:2]))
+
+  def test_predict_error(self):
+    wrapper = parallel.ParallelModelWrapper(
+        testing_utils.TestModelBatched, num_workers=2, shard_size=2)
+    self.addCleanup(wrapper.shutdown)
+    inputs = [{'value': i} for i in range(6)] + [{}]
+    with self.assertRaises(KeyError):
+      list(wrapper.predict(inputs))
+
+  def test_caching_model_wrapper(self):
+    wrapper = parallel.ParallelModelWrapper(
+        testing_utils.TestOutputKeysModel, num_workers=2, shard_size=2)
+    self.addCleanup(wrapper.shutdown)
+    self.assertTrue(wrapper.supports_output_keys())
+    model = caching.CachingModelWrapper(wrapper, 'test')
+    examples = [{'data': {'val': i}, 'id': f'id_{i}'} for i in range(5)]
+    results = model.predict_with_metadata(
+        examples, 'dataset', output_keys=['score'])
+    self.assertEqual([{'score': i} for i in range(5)], results)
+    results = model.predict_with_metadata(examples, 'dataset')
+    self.assertEqual([{'score': i, 'expensive': 2 * i} for i in range(5)],
+                     results)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -14,16 +14,27 @@
 # ==============================================================================
 # Lint as: python3
 """Miscellaneous utility functions."""
+import base64
 import json
-from typing import cast, Optional, Text
+from typing import cast, Iterator, Mapping, Optional, Text
 
 import attr
 from lit_nlp.api import dtypes
 from lit_nlp.api import types
 import numpy as np
 
+try:
+  import orjson  # pylint: disable=g-import-not-at-top
+except ImportError:
+  orjson = None
+
 JsonDict = types.JsonDict
 
+# Options for the accelerated encoder, if available. This handles NumPy arrays
+# and scalars natively; other types go through _obj_to_json_simple.
+_ORJSON_OPTIONS = (
+    orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson else None)
+
 
 def _obj_to_json(o: object):
   """JSON serialization helper."""
@@ -57,6 +68,30 @@ def _obj_to_json(o: object):
     raise TypeError(repr(o) + ' is not JSON serializable.')
 
 
+def _obj_to_json_binary(o: object):
+  """JSON serialization helper, with NumPy arrays as base64-encoded buffers.
+
+  This is much faster to encode and decode than nested lists, and about 4x
+  smaller for float32 data. Arrays are stored as little-endian, along with
+  their dtype and shape. Non-numeric arrays fall back to _obj_to_json().
+
+  Args:
+    o: object to serialize
+
+  Returns:
+    JSON-serializable representation of o
+  """
+  if isinstance(o, np.ndarray) and o.dtype.kind in 'biufc':
+    o = np.ascontiguousarray(o, dtype=o.dtype.newbyteorder('<'))
+    return {
+        '__class__': 'np.ndarray',
+        '__b64__': base64.b64encode(o.data).decode('ascii'),
+        'dtype': o.dtype.str,
+        'shape': list(o.shape),
+    }
+  return _obj_to_json(o)
+
+
 # TODO(lit-team): remove this once frontend can use the invertible versions.
 def _obj_to_json_simple(o: object):
   """JSON serialization helper. Not invertible!"""
@@ -87,6 +122,9 @@ def _obj_from_json(d: JsonDict):
   """JSON deserialization helper."""
   obj_class = d.pop('__class__', None)
   if obj_class == 'np.ndarray':
+    if '__b64__' in d:
+      buf = bytearray(base64.b64decode(d['__b64__']))
+      return np.frombuffer(buf, dtype=d['dtype']).reshape(d['shape'])
     return np.array(d['__value__'])
   elif obj_class == 'LitType':
     cls = getattr(types, d['__name__'])
@@ -116,6 +154,63 @@ class CustomJSONEncoder(json.JSONEncoder):
     return _obj_to_json(obj)
 
 
+class BinaryJSONEncoder(json.JSONEncoder):
+
+  def default(self, obj):
+    return _obj_to_json_binary(obj)
+
+
+def _encoder_cls(simple: bool, binary_arrays: bool):
+  if simple:
+    return SimpleJSONEncoder
+  return BinaryJSONEncoder if binary_arrays else CustomJSONEncoder
+
+
+def round_floats(obj,
+                 precision: Optional[int] = None,
+                 field_precision: Optional[Mapping[Text, int]] = None):
+  """Round floats and float arrays to a number of decimal places.
+
+  This is used to shrink frontend responses, since float32 outputs would
+  otherwise be serialized with up to 17 significant digits. Float arrays are
+  converted to float64 so that the rounded values print in their short form.
+
+  Args:
+    obj: object to round; dicts, lists, tuples, and DataTuples are rounded
+      recursively, and the input is not modified.
+    precision: number of decimal places. If None, floats are left as-is unless
+      covered by field_precision.
+    field_precision: dict of key -> number of decimal places, applied to the
+      values of dicts (at any depth) under that key. Overrides precision.
+
+  Returns:
+    a copy of obj, with floats rounded.
+  """
+  if precision is None and not field_precision:
+    return obj
+  if isinstance(obj, np.ndarray):
+    if precision is None or obj.dtype.kind != 'f':
+      return obj
+    return np.round(obj.astype(np.float64), precision)
+  elif isinstance(obj, (float, np.floating)):
+    return obj if precision is None else round(float(obj), precision)
+  elif isinstance(obj, dict):
+    return {
+        k: round_floats(v, (field_precision or {}).get(k, precision),
+                        field_precision) for k, v in obj.items()
+    }
+  elif isinstance(obj, (list, tuple)):
+    return type(obj)(
+        round_floats(v, precision, field_precision) for v in obj)
+  elif isinstance(obj, dtypes.DataTuple):
+    return attr.evolve(
+        obj, **{
+            k: round_floats(v, precision, field_precision)
+            for k, v in attr.asdict(obj, recurse=False).items()
+        })
+  return obj
+
+
 def from_json(json_string: Text) -> Optional[JsonDict]:
   """Reconstruct from a JSON string."""
   if json_string:
@@ -123,7 +218,95 @@ def from_json(json_string: Text) -> Optional[JsonDict]:
   return None
 
 
-def to_json(obj, simple=False, **json_kw) -> Text:
-  """Serialize to a JSON string."""
-  return json.dumps(
-      obj, cls=SimpleJSONEncoder if simple else CustomJSONEncoder, **json_kw)
+def _use_fast_encoder(simple: bool, json_kw) -> bool:
+  """Whether to use orjson, which doesn't support json.dumps() options."""
+  return orjson is not None and simple and not json_kw
+
+
+def _fast_to_json_simple(obj) -> Text:
+  return orjson.dumps(
+      obj, default=_obj_to_json_simple, option=_ORJSON_OPTIONS).decode('utf-8')
+
+
+def to_json(obj,
+            simple=False,
+            binary_arrays=False,
+            precision: Optional[int] = None,
+            field_precision: Optional[Mapping[Text, int]] = None,
+            **json_kw) -> Text:
+  """Serialize to a JSON string.
+
+  If orjson is installed, it is used for the simple encoding, which is several
+  times faster for model outputs with many arrays. Its output is compact (no
+  whitespace) and it writes NaN and Infinity as null, but otherwise decodes to
+  the same result as the standard library encoder.
+
+  Args:
+    obj: object to serialize
+    simple: if true, use a non-invertible encoding with plain lists in place of
+      NumPy arrays, for the frontend.
+    binary_arrays: if true (and not simple), encode numeric NumPy arrays as
+      base64 strings of their raw data. These are decoded by from_json().
+    precision: (simple only) round floats to this many decimal places.
+    field_precision: (simple only) number of decimal places by dict key; see
+      round_floats().
+    **json_kw: passed to json.dumps()
+
+  Returns:
+    JSON string
+  """
+  if simple:
+    obj = round_floats(obj, precision, field_precision)
+  if _use_fast_encoder(simple, json_kw):
+    return _fast_to_json_simple(obj)
+  return json.dumps(obj, cls=_encoder_cls(simple, binary_arrays), **json_kw)
+
+
+def to_json_chunks(obj,
+                   simple=False,
+                   binary_arrays=False,
+                   precision: Optional[int] = None,
+                   field_precision: Optional[Mapping[Text, int]] = None,
+                   chunk_size: int = 1000,
+                   **json_kw) -> Iterator[Text]:
+  """Serialize to JSON incrementally, as a sequence of string chunks.
+
+  If obj is a list, it is encoded chunk_size elements at a time, so that the
+  full JSON string is never held in memory. Other objects are encoded at once.
+  Concatenating the chunks gives the same result as to_json().
+
+  Args:
+    obj: object to serialize
+    simple: if true, use the non-invertible encoding (see to_json())
+    binary_arrays: if true, use base64 encoding for arrays (see to_json())
+    precision: (simple only) round floats; see to_json()
+    field_precision: (simple only) round floats by dict key; see to_json()
+    chunk_size: number of list elements to encode per chunk
+    **json_kw: passed to the JSON encoder
+
+  Yields:
+    pieces of the JSON string
+  """
+  if not isinstance(obj, list):
+    yield to_json(
+        obj,
+        simple=simple,
+        binary_arrays=binary_arrays,
+        precision=precision,
+        field_precision=field_precision,
+        **json_kw)
+    return
+  if _use_fast_encoder(simple, json_kw):
+    encode, item_separator = _fast_to_json_simple, ','
+  else:
+    encode = _encoder_cls(simple, binary_arrays)(**json_kw).encode
+    item_separator = json_kw.get('separators', (', ', ': '))[0]
+  if not simple:
+    precision, field_precision = None, None
+  yield '['
+  for start in range(0, len(obj), chunk_size):
+    chunk = item_separator.join(
+        encode(round_floats(o, precision, field_precision))
+        for o in obj[start:start + chunk_size])
+    yield (item_separator if start else '') + chunk
+  yield ']'
@@ -0,0 +1,97 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+"""Tests for lit_nlp.lib.serialize."""
+
+import json
+
+from absl.testing import absltest
+
+from lit_nlp.api import dtypes
+from lit_nlp.api import types
+from lit_nlp.lib import serialize
+import numpy as np
+
+
+class SerializeTest(absltest.TestCase):
+
+  def test_binary_arrays_round_trip(self):
+    data = {
+        "emb": np.arange(6, dtype=np.float32).reshape(2, 3),
+        "ids": np.array([1, 2, 3], dtype=">i8"),  # big-endian
+        "tokens": np.array(["a", "b"]),
+        "spec": types.Scalar(),
+    }
+    encoded = serialize.to_json(data, binary_arrays=True)
+    self.assertIn("__b64__", encoded)
+    decoded = serialize.from_json(encoded)
+    self.assertEqual(np.float32, decoded["emb"].dtype)
+    np.testing.assert_array_equal(data["emb"], decoded["emb"])
+    np.testing.assert_array_equal(data["ids"], decoded["ids"])
+    np.testing.assert_array_equal(data["tokens"], decoded["tokens"])
+    self.assertEqual(types.Scalar(), decoded["spec"])
+    # Decoded arrays should be writable, like those from the list encoding.
+    decoded["emb"][0, 0] = 1.0
+
+  def test_simple_encoding(self):
+    data = {
+        "emb": np.arange(6, dtype=np.float32).reshape(2, 3).T,
+        "tokens": np.array(["a", "b"]),
+        "score": np.float32(0.5),
+        "spec": types.MulticlassPreds(vocab=["0", "1"]),
+        "pair": (1, 2),
+        3: "int key",
+    }
+    # Same result with either the fast path (if available) or the stdlib one.
+    expected = json.loads(json.dumps(data, cls=serialize.SimpleJSONEncoder))
+    self.assertEqual(expected, json.loads(serialize.to_json(data, simple=True)))
+    self.assertEqual(["0", "1"], expected["spec"]["vocab"])
+    self.assertEqual([[0, 3], [1, 4], [2, 5]], expected["emb"])
+
+  def test_round_floats(self):
+    data = [{
+        "probas": np.array([0.123456, 0.876544], dtype=np.float32),
+        "attention": np.full((1, 2), 1 / 3, dtype=np.float32),
+        "salience": dtypes.SalienceMap(tokens=["a"], salience=np.array([0.5])),
+        "score": 0.654321,
+        "ids": np.array([1, 2]),
+    }]
+    encoded = serialize.to_json(
+        data, simple=True, precision=3, field_precision={"attention": 1})
+    self.assertEqual([{
+        "probas": [0.123, 0.877],
+        "attention": [[0.3, 0.3]],
+        "salience": {"tokens": ["a"], "salience": [0.5]},
+        "score": 0.654,
+        "ids": [1, 2],
+    }], json.loads(encoded))
+    # Streamed responses are rounded the same way.
+    chunks = serialize.to_json_chunks(
+        data, simple=True, precision=3, field_precision={"attention": 1})
+    self.assertEqual(encoded, "".join(chunks))
+    # The invertible encoding is never rounded.
+    decoded = serialize.from_json(serialize.to_json(data, precision=3))
+    np.testing.assert_array_equal(data[0]["probas"], decoded[0]["probas"])
+
+  def test_to_json_chunks(self):
+    data = [{"emb": np.ones(3, dtype=np.float32)} for _ in range(5)]
+    for kw in [{}, {"simple": True}, {"binary_arrays": True}]:
+      chunks = list(serialize.to_json_chunks(data, chunk_size=2, **kw))
+      self.assertLen(chunks, 5)  # "[", three chunks, "]"
+      self.assertEqual(serialize.to_json(data, **kw), "".join(chunks))
+
+
+if __name__ == "__main__":
+  absltest.main()
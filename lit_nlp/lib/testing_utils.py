@@ -19,6 +19,7 @@ test.
 """
 
 # Lint as: python3
+import time
 from typing import Iterable, Iterator, List
 
 from lit_nlp.api import model as lit_model
@@ -103,6 +104,64 @@ class TestIdentityRegressionModel(lit_model.Model):
     return self._count
 
 
+class TestOutputKeysModel(lit_model.Model):
+  """Identity model with an 'expensive' field, only computed on request.
+
+  Records the output_keys passed to each call of predict_minibatch().
+  """
+
+  def __init__(self):
+    self.requests = []
+
+  def supports_output_keys(self):
+    return True
+
+  def max_minibatch_size(self):
+    return 3
+
+  def input_spec(self):
+    return {'val': lit_types.Scalar()}
+
+  def output_spec(self):
+    return {
+        'score': lit_types.RegressionScore(),
+        'expensive': lit_types.Scalar()
+    }
+
+  def predict_minibatch(self, inputs: List[JsonDict], output_keys=None):
+    self.requests.append(output_keys)
+    results = [{'score': x['val']} for x in inputs]
+    if output_keys is None or 'expensive' in output_keys:
+      for result in results:
+        result['expensive'] = 2 * result['score']
+    return results
+
+
+class TestIdentityEmbeddingModel(lit_model.Model):
+  """Implements lit.Model interface for testing.
+
+  This class returns the input vector as an embedding.
+  """
+
+  def __init__(self):
+    self._count = 0
+
+  def input_spec(self):
+    return {'x': lit_types.Embeddings()}
+
+  def output_spec(self):
+    return {'emb': lit_types.Embeddings()}
+
+  def predict_minibatch(self, inputs: List[JsonDict], **kw):
+    self._count += len(inputs)
+    return [{'emb': np.asarray(x['x'], dtype=np.float32)} for x in inputs]
+
+  @property
+  def count(self):
+    """Returns the number of examples predict has been called on."""
+    return self._count
+
+
 class TestModelBatched(lit_model.Model):
   """Implements lit.Model interface for testing with a max minibatch size of 3.
   """
@@ -132,6 +191,40 @@ class TestModelBatched(lit_model.Model):
     return self._count
 
 
+class TestPipelinedModel(TestModelBatched):
+  """TestModelBatched, with separate stages for pipelined inference.
+
+  Each stage sleeps for stage_seconds, as a stand-in for work which releases
+  the GIL (such as tokenization or a TensorFlow forward pass).
+  """
+
+  def __init__(self, depth: int = 2, stage_seconds: float = 0.0):
+    super().__init__()
+    self._depth = depth
+    self._stage_seconds = stage_seconds
+
+  def pipeline_depth(self):
+    return self._depth
+
+  def preprocess_minibatch(self, inputs: List[JsonDict]):
+    time.sleep(self._stage_seconds)
+    return [x['value'] for x in inputs]
+
+  def predict_preprocessed(self, batch: List[float]):
+    assert len(batch) <= self.max_minibatch_size()
+    self._count += 1
+    time.sleep(self._stage_seconds)
+    return np.array(batch)
+
+  def postprocess_minibatch(self, outputs: np.ndarray):
+    time.sleep(self._stage_seconds)
+    return [{'scores': x} for x in outputs.tolist()]
+
+  def predict_minibatch(self, inputs: List[JsonDict], **kw):
+    return self.postprocess_minibatch(
+        self.predict_preprocessed(self.preprocess_minibatch(inputs)))
+
+
 def fake_projection_input(n, num_dims):
   """Generates random embeddings in the correct format."""
   rng = np.random.RandomState(42)
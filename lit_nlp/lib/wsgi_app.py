@@ -22,17 +22,27 @@ Why not use Flask or something? Historical reasons, and if it ain't broke, don't
 fix it.
 """
 
+import collections
+import hashlib
 import mimetypes
 import os
+import re
+import threading
 import time
 import traceback
 import wsgiref.handlers
+import zlib
 
 from absl import logging
 import six
 from six.moves.urllib.parse import urlparse
 from werkzeug import wrappers
 
+try:
+  import brotli  # pylint: disable=g-import-not-at-top
+except ImportError:
+  brotli = None
+
 
 def _LoadResource(path):
   """Load the resource at given path.
@@ -56,6 +66,54 @@ def _LoadResource(path):
     raise e
 
 
+def _ReadChunks(path, chunk_size=1024 * 1024):
+  """Read a file in chunks, opening it when the first chunk is needed."""
+  with open(path, 'rb') as f:
+    while True:
+      chunk = f.read(chunk_size)
+      if not chunk:
+        return
+      yield chunk
+
+
+def _CompressChunks(chunks, encoding, level):
+  """Compress a sequence of byte strings, yielding compressed pieces.
+
+  Args:
+    chunks: an iterable of bytes.
+    encoding: 'gzip' or 'br'.
+    level: compression level, from 1 (fastest) to 9; for brotli this is used as
+      the quality setting.
+
+  Yields:
+    Compressed data, which when joined is a complete gzip or brotli stream.
+  """
+  if encoding == 'br':
+    compressor = brotli.Compressor(quality=level)
+    compress, flush = compressor.process, compressor.finish
+  else:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compress, flush = compressor.compress, compressor.flush
+  for chunk in chunks:
+    out = compress(chunk)
+    if out:
+      yield out
+  yield flush()
+
+
+class _StaticFile(object):
+  """A static file, cached in memory along with its compressed versions."""
+
+  def __init__(self, path, mtime, contents, mimetype, content_encoding):
+    self.path = path
+    self.mtime = mtime
+    self.contents = contents
+    self.mimetype = mimetype
+    self.content_encoding = content_encoding
+    self.etag = hashlib.blake2b(contents, digest_size=16).hexdigest()
+    self.encoded = {}  # encoding -> compressed contents
+
+
 class App(object):
   """Standalone WSGI app that can serve files, etc."""
 
@@ -67,16 +125,87 @@ class App(object):
       'text/css',
       'text/csv',
       'text/html',
+      'text/javascript',
       'text/json',
       'text/plain',
       'text/tab-separated-values',
       'text/x-protobuf',
   ])
 
-  def __init__(self, handlers, project_root, index_file='index.html'):
+  # Max number of compressed responses to keep, for responses with an etag.
+  _MAX_COMPRESSED_ENTRIES = 16
+
+  # Static files larger than this are streamed from disk on each request, and
+  # compressed (if at all) only with the encoding the client asks for.
+  _MAX_CACHED_FILE_BYTES = 64 * 1024 * 1024
+
+  # Filenames with a content hash, like main.3b9f0a1c.js, which can be cached
+  # by the browser indefinitely.
+  _HASHED_FILENAME_RE = re.compile(r'[.-][0-9a-f]{8,}\.[a-z0-9]+$')
+  _HASHED_FILE_EXPIRES = 365 * 24 * 3600
+
+  # Supported content encodings, in order of preference, and the file
+  # extension of precompressed static files.
+  _ENCODING_EXTENSIONS = (('br', '.br'), ('gzip', '.gz'))
+
+  def __init__(self,
+               handlers,
+               project_root,
+               index_file='index.html',
+               compression_min_bytes=1024,
+               compression_level=6,
+               static_reload=True):
+    """Initialize the app.
+
+    Args:
+      handlers: dict of path -> handler fn (App, request) -> response.
+      project_root: directory to serve static files from.
+      index_file: path to the index page, relative to project_root.
+      compression_min_bytes: responses smaller than this are not compressed.
+        Streamed responses are always compressed, if the client accepts it.
+      compression_level: gzip (or brotli) compression level for text
+        responses, from 1 to 9. If 0, responses are not compressed.
+      static_reload: if true, check the modification time of cached static
+        files on each request, and re-load them if they have changed.
+    """
     self._handlers = handlers
     self._project_root = project_root
     self._index_file = index_file
+    self._compression_min_bytes = compression_min_bytes
+    self._compression_level = compression_level
+    # LRU cache of etag -> compressed content.
+    self._compressed_lock = threading.Lock()
+    self._compressed = collections.OrderedDict()
+    # Static files, loaded and compressed on first request.
+    self._static_reload = static_reload
+    self._static_lock = threading.Lock()
+    self._static_files = {}  # path -> _StaticFile
+
+  def _Compress(self, content, encoding, etag=None):
+    """Compress bytes or an iterable of bytes, with caching by etag."""
+    if not isinstance(content, bytes):
+      return _CompressChunks(content, encoding, self._compression_level)
+    if etag is None:
+      return b''.join(
+          _CompressChunks([content], encoding, self._compression_level))
+    with self._compressed_lock:
+      if etag in self._compressed:
+        self._compressed.move_to_end(etag)
+        return self._compressed[etag]
+    compressed = b''.join(
+        _CompressChunks([content], encoding, self._compression_level))
+    with self._compressed_lock:
+      self._compressed[etag] = compressed
+      while len(self._compressed) > self._MAX_COMPRESSED_ENTRIES:
+        self._compressed.popitem(last=False)
+    return compressed
+
+  def _AcceptedEncodings(self, request):
+    """Supported content encodings accepted by the client, in order."""
+    return [(encoding, ext)
+            for encoding, ext in self._ENCODING_EXTENSIONS
+            if request.accept_encodings[encoding] > 0 and
+            (encoding != 'br' or brotli is not None)]
 
   def respond(  # pylint: disable=invalid-name
       self,
@@ -85,27 +214,58 @@ class App(object):
       content_type,
       code=200,
       expires=0,
-      content_encoding=None):
+      content_encoding=None,
+      etag=None):
     """Construct a werkzeug WSGI response object.
 
     Args:
       request: A werkzeug Request object. Used mostly to check the
         Accept-Encoding header.
-      content: Payload data as bytes or unicode string (will be UTF-8 encoded).
+      content: Payload data as bytes or unicode string (will be UTF-8 encoded),
+        or an iterable of these to stream the response in chunks. Streamed
+        responses are sent without a Content-Length header.
       content_type: Media type only - "charset=utf-8" will be added for text.
       code: Numeric HTTP status code to use.
       expires: Second duration for browser caching, default 0.
       content_encoding: Encoding if content is already encoded, e.g. 'gzip'.
+      etag: Optional entity tag (without quotes) which identifies the content.
+        If the client already has this version, as given by If-None-Match, the
+        response is a 304 with no body. Compressed versions of content with an
+        etag are cached, so they can be re-sent without compressing again.
 
     Returns:
       A werkzeug Response object (a WSGI application).
     """
     if isinstance(content, six.text_type):
       content = content.encode('utf-8')
+    elif not isinstance(content, bytes):
+      content = (c.encode('utf-8') if isinstance(c, six.text_type) else c
+                 for c in content)
+    headers = []
+    compress_with = None
     if content_type in self._TEXTUAL_MIMETYPES:
       content_type += '; charset=utf-8'
-    headers = []
-    headers.append(('Content-Length', str(len(content))))
+      headers.append(('Vary', 'Accept-Encoding'))
+      accepted = self._AcceptedEncodings(request)
+      if (self._compression_level > 0 and accepted and
+          content_encoding is None and
+          (not isinstance(content, bytes) or
+           len(content) >= self._compression_min_bytes)):
+        compress_with = accepted[0][0]
+
+    if etag is not None:
+      # Each encoding is a different representation, so gets its own tag.
+      if compress_with:
+        etag = f'{etag}-{compress_with}'
+      headers.append(('ETag', f'"{etag}"'))
+      if request.if_none_match.contains_weak(etag):
+        return wrappers.Response(status=304, headers=headers)
+
+    if compress_with:
+      content = self._Compress(content, compress_with, etag)
+      content_encoding = compress_with
+    if isinstance(content, bytes):
+      headers.append(('Content-Length', str(len(content))))
     if content_encoding:
       headers.append(('Content-Encoding', content_encoding))
     if expires > 0:
@@ -123,6 +283,76 @@ class App(object):
         headers=headers,
         content_type=content_type)
 
+  def _LoadStaticFile(self, path):
+    """Load a static file, and precompress it if it's text.
+
+    Precompressed versions next to the file (path.br or path.gz) are used if
+    they exist, and otherwise the file is compressed here.
+
+    Args:
+      path: The path of the static file.
+
+    Returns:
+      A _StaticFile.
+
+    Raises:
+      IOError: If the file can't be read.
+    """
+    mtime = os.stat(path).st_mtime
+    mimetype, content_encoding = mimetypes.guess_type(path)
+    mimetype = mimetype or 'application/octet-stream'
+    entry = _StaticFile(path, mtime, _LoadResource(path), mimetype,
+                        content_encoding)
+    if (content_encoding is None and mimetype in self._TEXTUAL_MIMETYPES and
+        len(entry.contents) >= self._compression_min_bytes):
+      for encoding, ext in self._ENCODING_EXTENSIONS:
+        if os.path.isfile(path + ext):
+          entry.encoded[encoding] = _LoadResource(path + ext)
+        elif self._compression_level > 0 and (encoding != 'br' or brotli):
+          entry.encoded[encoding] = b''.join(
+              _CompressChunks([entry.contents], encoding,
+                              self._compression_level))
+    return entry
+
+  def _GetStaticFile(self, path):
+    """Get a static file from the cache, loading it if new or modified.
+
+    Args:
+      path: The path of the static file.
+
+    Returns:
+      A _StaticFile, or None if the file is too large to cache.
+
+    Raises:
+      IOError: If the file can't be read.
+    """
+    entry = self._static_files.get(path)
+    if entry is not None and not self._static_reload:
+      return entry
+    stat = os.stat(path)
+    if entry is not None and stat.st_mtime == entry.mtime:
+      return entry
+    if stat.st_size > self._MAX_CACHED_FILE_BYTES:
+      with self._static_lock:
+        self._static_files.pop(path, None)
+      return None
+    entry = self._LoadStaticFile(path)
+    with self._static_lock:
+      self._static_files[path] = entry
+    return entry
+
+  def _ServeLargeStaticFile(self, request, path, expires):
+    """Stream a static file which is too large to cache from disk."""
+    stat = os.stat(path)
+    mimetype, content_encoding = mimetypes.guess_type(path)
+    return self.respond(
+        request,
+        _ReadChunks(path),
+        mimetype or 'application/octet-stream',
+        expires=expires,
+        content_encoding=content_encoding,
+        etag=f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+
   def _ServeStaticFile(self, request, path):
     """Serves the static file located at the given path.
 
@@ -138,21 +368,37 @@ class App(object):
       # Traversal attack, so 400.
       return self.respond(request, 'Path not safe', 'text/plain', 400)
 
-    # Open the file and read it.
+    if self._HASHED_FILENAME_RE.search(os.path.basename(path)):
+      expires = self._HASHED_FILE_EXPIRES
+    else:
+      expires = 3600
+
     try:
-      contents = _LoadResource(path)
+      entry = self._GetStaticFile(path)
+      if entry is None:
+        return self._ServeLargeStaticFile(request, path, expires)
     except IOError:
       logging.info('path %s not found, sending 404', path)
       return self.respond(request, 'Not found', 'text/plain', code=404)
 
-    mimetype, content_encoding = mimetypes.guess_type(path)
-    mimetype = mimetype or 'application/octet-stream'
+    # Serve a compressed version of the file, if there is one.
+    for encoding, _ in self._AcceptedEncodings(request):
+      if encoding in entry.encoded:
+        return self.respond(
+            request,
+            entry.encoded[encoding],
+            entry.mimetype,
+            expires=expires,
+            content_encoding=encoding,
+            etag=f'{entry.etag}-{encoding}')
+
     return self.respond(
         request,
-        contents,
-        mimetype,
-        expires=3600,
-        content_encoding=content_encoding)
+        entry.contents,
+        entry.mimetype,
+        expires=expires,
+        content_encoding=entry.content_encoding,
+        etag=entry.etag)
 
   def _PathIsSafe(self, path):
     """Check path is safe (stays within current directory).
@@ -0,0 +1,220 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+"""Tests for lit_nlp.lib.wsgi_app."""
+
+import gzip
+import os
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+
+from lit_nlp.lib import wsgi_app
+from werkzeug import test as werkzeug_test
+from werkzeug import wrappers
+
+
+class _FakeBrotliCompressor(object):
+  """Stands in for brotli.Compressor; 'compresses' by adding a prefix."""
+
+  def __init__(self, quality):
+    del quality
+    self._started = False
+
+  def process(self, data):
+    if self._started:
+      return data
+    self._started = True
+    return b'br:' + data
+
+  def finish(self):
+    return b''
+
+
+_FAKE_BROTLI = mock.Mock(Compressor=_FakeBrotliCompressor)
+
+
+class StaticFilesTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    tempdir = tempfile.TemporaryDirectory()
+    self.addCleanup(tempdir.cleanup)
+    self.root = tempdir.name
+    # Static file paths are checked to be under the current directory.
+    cwd = os.getcwd()
+    os.chdir(self.root)
+    self.addCleanup(os.chdir, cwd)
+
+  def _write(self, filename, contents):
+    path = os.path.join(self.root, filename)
+    with open(path, 'wb') as f:
+      f.write(contents)
+    return path
+
+  def _make_client(self, **app_kw):
+    app = wsgi_app.App({}, self.root, **app_kw)
+    return werkzeug_test.Client(app), app
+
+  def test_cached(self):
+    path = self._write('app.js', b'x' * 2000)
+    with mock.patch.object(
+        wsgi_app, '_LoadResource', wraps=wsgi_app._LoadResource) as load:
+      client, _ = self._make_client(static_reload=False)
+      # Nothing is read until it is requested.
+      load.assert_not_called()
+      self.assertEqual(200, client.get('/app.js').status_code)
+      load.assert_called_once_with(path)
+    # After the first request it is served from memory, so it doesn't matter
+    # if the file goes away.
+    os.remove(path)
+    response = client.get('/app.js', headers={'Accept-Encoding': 'gzip'})
+    self.assertEqual(200, response.status_code)
+    self.assertEqual('gzip', response.headers['Content-Encoding'])
+    self.assertEqual(b'x' * 2000, gzip.decompress(response.get_data()))
+    self.assertIn('max-age=3600', response.headers['Cache-Control'])
+
+  def test_path_not_safe(self):
+    self._write('app.js', b'var x;')
+    client, _ = self._make_client()
+    self.assertEqual(200, client.get('/app.js').status_code)
+    # Even cached files are only served from under the current directory.
+    os.mkdir(os.path.join(self.root, 'subdir'))
+    os.chdir(os.path.join(self.root, 'subdir'))
+    self.assertEqual(400, client.get('/app.js').status_code)
+
+  def test_reload_on_change(self):
+    path = self._write('index.html', b'old')
+    client, _ = self._make_client()
+    self.assertEqual(b'old', client.get('/index.html').get_data())
+    self._write('index.html', b'new')
+    os.utime(path, (0, 0))  # mtime resolution may be coarse
+    self.assertEqual(b'new', client.get('/index.html').get_data())
+
+  def test_hashed_filename_expiry(self):
+    self._write('main.3b9f0a1c.js', b'var x;')
+    client, _ = self._make_client()
+    response = client.get('/main.3b9f0a1c.js')
+    self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+
+  def test_large_file(self):
+    self._write('big.json', b'[' + b'1,' * 1000 + b'1]')
+    with mock.patch.object(wsgi_app.App, '_MAX_CACHED_FILE_BYTES', 100), \
+        mock.patch.object(wsgi_app, 'brotli', _FAKE_BROTLI), \
+        mock.patch.object(wsgi_app, '_CompressChunks',
+                          wraps=wsgi_app._CompressChunks) as compress:
+      client, _ = self._make_client()
+      response = client.get('/big.json', headers={'Accept-Encoding': 'gzip'})
+      self.assertEqual(200, response.status_code)
+      # Streamed from disk, rather than read into memory.
+      self.assertIsNone(response.headers.get('Content-Length'))
+      self.assertEqual(b'[' + b'1,' * 1000 + b'1]',
+                       gzip.decompress(response.get_data()))
+      # Only compressed for the encoding that was asked for.
+      self.assertEqual(['gzip'], [c[0][1] for c in compress.call_args_list])
+      etag = response.headers['ETag']
+      response = client.get(
+          '/big.json',
+          headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+      self.assertEqual(304, response.status_code)
+
+  def test_not_found(self):
+    client, _ = self._make_client()
+    self.assertEqual(404, client.get('/missing.js').status_code)
+
+
+class CompressionTest(absltest.TestCase):
+
+  def _respond(self, content, accept_encoding='gzip', app_kw=None,
+               **respond_kw):
+    app = wsgi_app.App({}, '/nonexistent', **(app_kw or {}))
+    headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+    request = wrappers.Request(
+        werkzeug_test.EnvironBuilder(headers=headers).get_environ())
+    response = app.respond(request, content, 'application/json', **respond_kw)
+    return response, b''.join(response.response)
+
+  def test_gzip(self):
+    response, body = self._respond(b'[1]' * 1000)
+    self.assertEqual('gzip', response.headers['Content-Encoding'])
+    self.assertEqual(b'[1]' * 1000, gzip.decompress(body))
+    self.assertEqual(str(len(body)), response.headers['Content-Length'])
+    self.assertEqual('Accept-Encoding', response.headers['Vary'])
+
+  def test_negotiation(self):
+    with mock.patch.object(wsgi_app, 'brotli', _FAKE_BROTLI):
+      # Brotli is preferred, if the client accepts it.
+      response, body = self._respond(b'[1]' * 1000, 'gzip, deflate, br')
+      self.assertEqual('br', response.headers['Content-Encoding'])
+      self.assertEqual(b'br:' + b'[1]' * 1000, body)
+      response, _ = self._respond(b'[1]' * 1000, 'gzip, br;q=0')
+      self.assertEqual('gzip', response.headers['Content-Encoding'])
+    # Without the brotli module, fall back to gzip.
+    with mock.patch.object(wsgi_app, 'brotli', None):
+      response, _ = self._respond(b'[1]' * 1000, 'br, gzip')
+      self.assertEqual('gzip', response.headers['Content-Encoding'])
+    # q=0 means not acceptable.
+    for accept_encoding in ('gzip;q=0', 'identity', None):
+      response, body = self._respond(b'[1]' * 1000, accept_encoding)
+      self.assertNotIn('Content-Encoding', response.headers)
+      self.assertEqual(b'[1]' * 1000, body)
+      # Still varies by Accept-Encoding, for caches.
+      self.assertEqual('Accept-Encoding', response.headers['Vary'])
+
+  def test_min_bytes(self):
+    response, body = self._respond(
+        b'[1]', app_kw=dict(compression_min_bytes=4))
+    self.assertNotIn('Content-Encoding', response.headers)
+    self.assertEqual(b'[1]', body)
+    response, body = self._respond(
+        b'[11]', app_kw=dict(compression_min_bytes=4))
+    self.assertEqual('gzip', response.headers['Content-Encoding'])
+    self.assertEqual(b'[11]', gzip.decompress(body))
+
+  def test_streamed(self):
+    # Streamed responses are compressed regardless of size, and sent without
+    # a Content-Length.
+    chunks = iter([b'[', '1', b']'])
+    response, body = self._respond(chunks)
+    self.assertEqual('gzip', response.headers['Content-Encoding'])
+    self.assertNotIn('Content-Length', response.headers)
+    self.assertEqual(b'[1]', gzip.decompress(body))
+
+  def test_already_encoded(self):
+    compressed = gzip.compress(b'[1]' * 1000)
+    response, body = self._respond(
+        compressed, accept_encoding='gzip', content_encoding='gzip')
+    self.assertEqual('gzip', response.headers['Content-Encoding'])
+    self.assertEqual(compressed, body)
+
+  def test_compression_level_zero(self):
+    response, body = self._respond(
+        b'[1]' * 1000, app_kw=dict(compression_level=0))
+    self.assertNotIn('Content-Encoding', response.headers)
+    self.assertEqual(b'[1]' * 1000, body)
+
+  def test_not_textual(self):
+    app = wsgi_app.App({}, '/nonexistent')
+    request = wrappers.Request(
+        werkzeug_test.EnvironBuilder(
+            headers={'Accept-Encoding': 'gzip'}).get_environ())
+    response = app.respond(request, b'\x89PNG' * 1000, 'image/png')
+    self.assertNotIn('Content-Encoding', response.headers)
+    self.assertNotIn('Vary', response.headers)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -15,6 +15,8 @@
 # Lint as: python3
 """WSGI servers to power the LIT backend."""
 
+import os
+import signal
 from typing import Optional, Text, List
 from wsgiref import validate
 
@@ -42,3 +44,91 @@ class BasicDevServer(object):
         self._app,
         use_debugger=False,
         use_reloader=False)
+
+
+class ThreadedDevServer(BasicDevServer):
+  """Development server which handles each request in a new thread.
+
+  This lets the UI stay responsive while a slow request, such as LIME on a
+  large number of samples, is running. The LIT app is shared between threads;
+  see the notes on thread-safety in app.LitApp.
+  """
+
+  def serve(self):
+    logging.info(('\n\nStarting threaded server on port %d'
+                  '\nYou can navigate to %s:%d\n\n'), self._port, self._host,
+                 self._port)
+    werkzeug_serving.run_simple(
+        self._host,
+        self._port,
+        self._app,
+        use_debugger=False,
+        use_reloader=False,
+        threaded=True)
+
+
+class PreforkDevServer(BasicDevServer):
+  """Development server with a fixed pool of worker processes.
+
+  The listening socket and the LIT app (including loaded models) are created
+  in the parent process, which then forks num_workers children that all
+  accept connections on the same socket. Models are shared copy-on-write, but
+  each worker has its own in-memory predictions cache; set --data_dir so that
+  workers also share predictions through the on-disk cache.
+
+  Because the workers are forked after models are loaded, this is only safe
+  with fork-safe models: those which haven't started any threads or device
+  contexts by the time the server starts. TensorFlow and PyTorch models
+  (including the GlueModel examples) usually start thread pools as soon as
+  they are loaded or first run, and a forked child may then deadlock or crash
+  in the framework. The same goes for models wrapped in
+  parallel.ParallelModelWrapper, whose worker pool belongs to the parent
+  process. For such models, use the threaded server instead.
+
+  Only available on platforms which support os.fork().
+  """
+
+  def __init__(self, wsgi_app, port: int = 4321, host: Text = '127.0.0.1',
+               num_workers: int = 4, threaded: bool = False, **unused_kw):
+    super().__init__(wsgi_app, port=port, host=host)
+    if not hasattr(os, 'fork'):
+      raise NotImplementedError(
+          'PreforkDevServer requires os.fork(), which is not available on '
+          'this platform. Use the threaded server instead.')
+    if num_workers < 1:
+      raise ValueError(f'num_workers must be positive, got {num_workers}')
+    self._num_workers = num_workers
+    self._threaded = threaded
+
+  def _run_worker(self, server):
+    try:
+      server.serve_forever()
+    finally:
+      os._exit(0)  # pylint: disable=protected-access
+
+  def serve(self):
+    server = werkzeug_serving.make_server(
+        self._host, self._port, self._app, threaded=self._threaded)
+    logging.info(('\n\nStarting server on port %d with %d worker processes'
+                  '\nYou can navigate to %s:%d\n\n'), self._port,
+                 self._num_workers, self._host, self._port)
+    pids = []
+    for _ in range(self._num_workers):
+      pid = os.fork()
+      if pid == 0:
+        self._run_worker(server)
+      pids.append(pid)
+
+    try:
+      for pid in pids:
+        os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+      pass
+    finally:
+      for pid in pids:
+        try:
+          os.kill(pid, signal.SIGTERM)
+          os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+          pass
+      server.server_close()
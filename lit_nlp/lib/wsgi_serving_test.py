@@ -0,0 +1,85 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# Lint as: python3
+"""Tests for lit_nlp.lib.wsgi_serving."""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from absl.testing import absltest
+
+from lit_nlp.lib import wsgi_serving
+
+# Runs a PreforkDevServer whose app responds with the pid of the worker.
+_SERVER_SCRIPT = """
+import os, sys
+from lit_nlp.lib import wsgi_serving
+
+def app(environ, start_response):
+  start_response('200 OK', [('Content-Type', 'text/plain')])
+  return [str(os.getpid()).encode('utf-8')]
+
+wsgi_serving.PreforkDevServer(app, port=int(sys.argv[1]), num_workers=2).serve()
+"""
+
+
+def _free_port() -> int:
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+class PreforkDevServerTest(absltest.TestCase):
+
+  def test_invalid_num_workers(self):
+    with self.assertRaises(ValueError):
+      wsgi_serving.PreforkDevServer(None, num_workers=0)
+
+  @absltest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+  def test_serve(self):
+    port = _free_port()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    proc = subprocess.Popen([sys.executable, '-c', _SERVER_SCRIPT,
+                             str(port)],
+                            env=env)
+    self.addCleanup(proc.kill)
+    url = f'http://127.0.0.1:{port}/'
+    worker_pid = None
+    deadline = time.time() + 30
+    while worker_pid is None:
+      try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+          worker_pid = int(response.read())
+      except OSError:
+        if time.time() > deadline:
+          raise
+        time.sleep(0.1)
+    # Requests are handled by forked workers, not the parent.
+    self.assertNotEqual(proc.pid, worker_pid)
+
+    # On Ctrl+C, the parent stops the workers and exits.
+    proc.send_signal(signal.SIGINT)
+    self.assertEqual(0, proc.wait(timeout=30))
+    with self.assertRaises(ProcessLookupError):
+      os.kill(worker_pid, 0)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -36,8 +36,15 @@ FLAGS = flags.FLAGS
 ##
 # Server flags, passed to the WSGI server.
 flags.DEFINE_integer('port', 5432, 'What port to serve on.')
-flags.DEFINE_string('server_type', 'default',
-                    'Webserver to use; see dev_server.py')
+flags.DEFINE_string(
+    'server_type', 'default',
+    'Webserver to use; see dev_server.py. One of "default" (single-threaded), '
+    '"threaded", or "prefork" (multiple worker processes). Prefork forks '
+    'after models are loaded, so is only safe with fork-safe models; most '
+    'TensorFlow and PyTorch models are not. See wsgi_serving.py.')
+flags.DEFINE_integer(
+    'num_workers', 4,
+    'Number of worker processes, for --server_type=prefork.')
 flags.DEFINE_string(
     'host', '127.0.0.1', 'What host address to serve on. Use 127.0.0.1 for '
     'local development, or 0.0.0.0 to allow external connections.')
@@ -47,6 +54,20 @@ flags.DEFINE_string(
 flags.DEFINE_string(
     'data_dir', '', 'Directory to store/lookup persisted data used by server, '
     'such as cached predictions. If empty, will cache in-memory only.')
+flags.DEFINE_integer(
+    'cache_max_bytes', 0,
+    'If > 0, bound the in-memory predictions cache of each model to '
+    'approximately this many bytes, evicting least-recently-used examples. '
+    'If 0, the cache is unbounded.')
+flags.DEFINE_integer(
+    'secondary_cache_max_bytes', 0,
+    'If > 0, keep large per-example outputs (attention heads and gradients) '
+    'in a separate LRU cache of approximately this many bytes, and recompute '
+    'them on demand after eviction. If 0, they are cached with other outputs.')
+flags.DEFINE_integer(
+    'interpretation_cache_max_bytes', 0,
+    'If > 0, bound the in-memory cache of interpreter results (such as LIME '
+    'and metrics) to approximately this many bytes. If 0, it is unbounded.')
 flags.DEFINE_float(
     'warm_start', 0.0,
     'If 1, will run all (model, dataset) on startup to populate the cache. '
@@ -59,6 +80,33 @@ flags.DEFINE_bool(
     'demo_mode', False,
     'If true, will disable capabilities not allowed in demo mode, such as '
     'saving generated datapoints to disk.')
+flags.DEFINE_integer(
+    'compression_min_bytes', 1024,
+    'Compress text responses of at least this many bytes, if the client '
+    'accepts gzip or brotli encoding.')
+flags.DEFINE_integer(
+    'compression_level', 6,
+    'Compression level for responses, from 1 (fastest) to 9 (smallest). '
+    'If 0, responses are not compressed.')
+flags.DEFINE_list(
+    'precision_by_type', [],
+    'Comma-separated list of LitType:places, such as AttentionHeads:4, to '
+    'round model outputs of these types (and subclasses) to this many decimal '
+    'places in /get_preds responses to the frontend. This makes large outputs '
+    'such as attention much smaller to send.')
+flags.DEFINE_bool(
+    'log_request_metrics', False,
+    'If true, log a JSON record for each request with the time spent parsing, '
+    'computing, serializing, and responding, and the payload sizes. Totals '
+    'are always available from the /metrics endpoint.')
+flags.DEFINE_bool(
+    'profile', False,
+    'If true, run generators and interpreters under cProfile, log the top '
+    'functions for each call, and save profiles to <data_dir>/profiles.')
+flags.DEFINE_integer(
+    'num_job_workers', 2,
+    'Number of threads for running background jobs, such as LIME or UMAP '
+    'requests made through /submit_job.')
 flags.DEFINE_string(
     'default_layout', 'default',
     'Which layout to use by default (can be changed via url); see layout.ts')